@@ -0,0 +1,123 @@
+import time
+import asyncio
+from atproto_client.exceptions import InvokeTimeoutError, NetworkError, RateLimitExceededError, RequestException
+
+from bluesky_client import create_async_client
+from crawl_journal import needs_crawl
+from crawl_store import follows_saved, save_actor_follows
+from instrumentation import count
+from rate_limit import TokenBucket
+
+
+def is_transient(error):
+    """True for errors worth retrying: rate limits, network failures, timeouts and 5xx responses"""
+    if isinstance(error, (RateLimitExceededError, NetworkError, InvokeTimeoutError)):
+        return True
+    response = getattr(error, 'response', None)
+    return isinstance(error, RequestException) and response is not None and response.status_code >= 500
+
+
+async def call_with_retries(limiter, request, params, retries=3, backoff=2.0):
+    """Call an XRPC method once a rate-limit token is available, retrying transient errors"""
+    for attempt in range(retries + 1):
+        await limiter.acquire_async()
+        try:
+            return await request(params)
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            count('retries', error=type(e).__name__)
+            count('retry_backoff_seconds', backoff * 2 ** attempt)
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+
+def call_with_retries_sync(request, params, retries=3, backoff=2.0, limiter=None):
+    """Synchronous version of call_with_retries, for the sync client (the limiter is optional)"""
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return request(params)
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            count('retries', error=type(e).__name__)
+            count('retry_backoff_seconds', backoff * 2 ** attempt)
+            time.sleep(backoff * 2 ** attempt)
+
+
+async def get_follows_for_user_async(client, username, limiter, journal=None):
+    """Async version of get_follows_for_user that paces requests with a shared limiter"""
+    follows, cursor, finished = journal.resume(username) if journal else ([], None, False)
+    if finished:
+        return follows, True
+    try:
+        while True:
+            params = {'actor': username, 'limit': 100}
+            if cursor:
+                params['cursor'] = cursor
+            response = await call_with_retries(limiter, client.app.bsky.graph.get_follows, params)
+            page = [follow.model_dump() for follow in response.follows]
+            count('pages', endpoint='app.bsky.graph.getFollows')
+            follows.extend(page)
+            if journal:
+                journal.record_page(username, page, response.cursor)
+            if not response.cursor:
+                break
+            cursor = response.cursor
+    except Exception as e:
+        print(f"Error fetching follows for {username}: {str(e)}")
+        if journal:
+            journal.mark_incomplete(username, e)
+        return follows, False
+    return follows, True
+
+
+async def download_following_network_async(client, following, output_dir, journal, store=None,
+                                           concurrency=8, rate_limit=8.0):
+    """
+    Download the follows of every account in `following` concurrently.
+
+    :param client: Logged-in atproto AsyncClient
+    :param following: List of followed profiles (as saved in following.json)
+    :param output_dir: Data directory; one file per handle is written to following_network/
+    :param journal: CrawlJournal used to checkpoint and resume pagination
+    :param store: Optional CrawlStore to save follow lists to instead of JSON files
+    :param concurrency: Maximum number of accounts fetched at the same time
+    :param rate_limit: Requests per second shared by all workers
+    :return: Dict mapping each newly downloaded handle to its follows
+    """
+    limiter = TokenBucket(rate_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+    following_network = {}
+    total = len(following)
+
+    async def crawl(i, profile):
+        handle = profile['handle']
+        if not needs_crawl(journal, handle, follows_saved(output_dir, store, profile)):
+            print(f"Skipping {i}/{total}: {handle} (already exists)")
+            return
+        async with semaphore:
+            print(f"Processing {i}/{total}: {handle}")
+            follows, complete = await get_follows_for_user_async(client, handle, limiter, journal)
+        if complete:
+            save_actor_follows(output_dir, store, profile, follows)
+            journal.mark_done(handle)
+            following_network[handle] = follows
+        else:
+            print(f"Follows for {handle} are incomplete, they will be resumed on the next run")
+
+    await asyncio.gather(*(crawl(i, follow) for i, follow in enumerate(following, 1)))
+    return following_network
+
+
+def crawl_following_network(session_string, following, output_dir, journal, store=None,
+                            concurrency=8, rate_limit=8.0):
+    """Run the async following-network crawl from synchronous code, reusing an existing session"""
+    async def run():
+        client = create_async_client()
+        await client.login(session_string=session_string)
+        return await download_following_network_async(client, following, output_dir, journal, store,
+                                                      concurrency=concurrency, rate_limit=rate_limit)
+
+    return asyncio.run(run())
@@ -0,0 +1,229 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import shutil
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+import numpy as np
+
+from build_graph import create_network_graph, export_to_graphml, load_network_data
+from instrumentation import peak_rss_mb
+from interning import NodeInterner
+from metrics import MetricsCache
+from network_visualization import compute_layout, detect_communities, export_nodes
+from recommend_accounts import recommend_accounts
+
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+
+
+def _profile(i, created_at):
+    """A profile shaped like the model_dump() of a ProfileView, as saved by bluesky_download.py"""
+    return {
+        'did': f"did:plc:bench{i:07d}",
+        'handle': f"user{i}.bench.test",
+        'associated': None,
+        'avatar': f"https://cdn.bsky.app/img/avatar/plain/did:plc:bench{i:07d}/avatar@jpeg",
+        'created_at': created_at,
+        'description': f"Synthetic account {i} for benchmarks",
+        'display_name': f"User {i}",
+        'indexed_at': created_at,
+        'labels': [],
+        'viewer': {'blocked_by': False, 'muted': False, 'followed_by': None, 'following': None},
+        'py_type': 'app.bsky.actor.defs#profileView',
+    }
+
+
+def generate_dataset(output_dir, num_edges, seed=42, exponent=2.1):
+    """
+    Write a synthetic crawl in the bluesky_download.py layout: following.json
+    and one following_network/<handle>.json file per followed account.
+
+    Out-degrees follow a power law with the given `exponent`, and followees
+    are drawn by a power-law popularity, so a few accounts are followed by
+    many. The total number of edges is close to `num_edges`.
+    """
+    rng = np.random.default_rng(seed)
+    num_following = int(np.clip(num_edges // 50, 20, 5000))
+    population = max(num_following * 10, num_edges // 10)
+    created_at = "2024-01-01T00:00:00.000Z"
+
+    # Power-law out-degrees, rescaled to the edge budget
+    weight = rng.pareto(exponent - 1, num_following) + 1
+    budget = num_edges - num_following
+    degree = np.ones(num_following)
+    for _ in range(10):
+        # Rescale the accounts below the cap until the capped degrees add up to the budget
+        free = degree < population - 1
+        remaining = budget - degree[~free].sum()
+        degree[free] = weight[free] / weight[free].sum() * remaining
+        degree = np.clip(degree, 1, population - 1)
+    degree = np.round(degree).astype(np.int64)
+
+    # Power-law popularity; the followed accounts come first so they follow each other too
+    popularity = (np.arange(population) + 1.0) ** (-1 / (exponent - 1))
+    popularity = rng.permutation(popularity)
+    popularity[:num_following] *= 5
+    cumulative = np.cumsum(popularity / popularity.sum())
+
+    os.makedirs(os.path.join(output_dir, "following_network"), exist_ok=True)
+    with open(os.path.join(output_dir, "following.json"), "w", encoding="utf-8") as f:
+        json.dump([_profile(i, created_at) for i in range(num_following)], f, indent=2)
+
+    edges = num_following
+    for i in range(num_following):
+        followees = np.empty(0, dtype=np.int64)
+        while len(followees) < degree[i]:
+            # Draw with replacement and keep first occurrences until there are enough distinct accounts
+            draws = np.searchsorted(cumulative, rng.random(2 * degree[i] + 5), side='right')
+            draws = np.concatenate((followees, np.minimum(draws, population - 1)))
+            _, first = np.unique(draws, return_index=True)
+            followees = draws[np.sort(first)]
+            followees = followees[followees != i]
+        followees = followees[:degree[i]]
+        edges += len(followees)
+        with open(os.path.join(output_dir, "following_network", f"user{i}.bench.test.json"), "w",
+                  encoding="utf-8") as f:
+            json.dump([_profile(j, created_at) for j in followees], f, indent=2)
+    return {'following': num_following, 'population': population, 'edges': edges}
+
+
+def measure(stage, fn, results, memory=True, quiet=True):
+    """Run fn(), recording its wall time, peak traced Python/NumPy memory and the process peak RSS"""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO() if quiet else sys.stdout):
+        value = fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    max_rss = peak_rss_mb()
+    results.append({'stage': stage, 'seconds': round(seconds, 4),
+                    'peak_traced_mb': round(peak, 2) if peak is not None else None,
+                    'max_rss_mb': round(max_rss, 1) if max_rss is not None else None})
+    print(f"  {stage:<40} {seconds:9.3f}s" + (f" {peak:10.1f} MB" if peak is not None else ""))
+    return value
+
+
+def run_scale(data_dir, work_dir, memory=True, layout_iterations=100, exact_betweenness_nodes=2000):
+    """Time every pipeline stage on one generated dataset and return the per-stage results"""
+    results = []
+    main_json_path = os.path.join(data_dir, "following.json")
+    network_dir = os.path.join(data_dir, "following_network")
+    os.makedirs(work_dir, exist_ok=True)
+
+    main_following, network_data = measure(
+        'load_network_data', lambda: load_network_data(main_json_path, network_dir), results, memory)
+    G = measure('create_network_graph',
+                lambda: create_network_graph(main_following, network_data, interner=NodeInterner()), results, memory)
+    G_extended = measure('create_network_graph (extended)',
+                         lambda: create_network_graph(main_following, network_data, include_secondary_follows=True,
+                                                      interner=NodeInterner()), results, memory)
+    measure('recommend_accounts', lambda: recommend_accounts(G_extended, source_user="user"), results, memory)
+    communities = measure('detect_communities', lambda: detect_communities(G, state_file=None), results, memory)
+    betweenness = 'exact' if G.number_of_nodes() <= exact_betweenness_nodes else 'approximate'
+    cache_dir = os.path.join(work_dir, 'metrics_cache')
+    shutil.rmtree(cache_dir, ignore_errors=True)  # Time computing the metrics, not loading cached ones
+    cache = MetricsCache(cache_dir)
+    measure(f'export_nodes ({betweenness} betweenness)',
+            lambda: export_nodes(G, communities, os.path.join(work_dir, 'nodes_info.csv'), cache=cache,
+                                 betweenness=betweenness), results, memory)
+    measure('export_to_graphml (extended)', lambda: export_to_graphml(G_extended, work_dir, 'network.graphml'),
+            results, memory)
+    positions_file = os.path.join(work_dir, 'layout_positions.json')
+    if os.path.exists(positions_file):
+        os.remove(positions_file)  # Time a cold layout, not a warm start
+    measure(f'layout ({layout_iterations} iterations)',
+            lambda: compute_layout(G, positions_file, iterations=layout_iterations), results, memory)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(scales=('1k', '10k'), data_root='benchmark_data', results_dir='benchmark_results',
+                   memory=True, layout_iterations=100, seed=42):
+    """
+    Benchmark the pipeline at each scale and save the results as
+    results_dir/<timestamp>-<commit>.json. Generated datasets are kept in
+    data_root and reused by later runs.
+    """
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'memory_profiled': memory,
+        'scales': {},
+    }
+    for scale in scales:
+        data_dir = os.path.join(data_root, scale)
+        if not os.path.exists(os.path.join(data_dir, "following.json")):
+            print(f"Generating {scale} dataset...")
+            info = generate_dataset(data_dir, SCALES[scale], seed=seed)
+            with open(os.path.join(data_dir, "dataset.json"), "w", encoding="utf-8") as f:
+                json.dump(info, f)
+        with open(os.path.join(data_dir, "dataset.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        print(f"\n{scale}: {info['following']} followed accounts, {info['edges']} edges")
+        stages = run_scale(data_dir, os.path.join(data_root, f"{scale}_work"), memory, layout_iterations)
+        report['scales'][scale] = {'dataset': info, 'stages': stages}
+
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = os.path.join(results_dir, f"{stamp}-{report['commit']}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results saved to '{output_file}'")
+    return report
+
+
+def compare_results(old_file, new_file):
+    """Print the time and memory of every stage in two result files side by side"""
+    with open(old_file, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_file, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    for scale, entry in new['scales'].items():
+        if scale not in old['scales']:
+            continue
+        print(f"\n{scale}")
+        before = {stage['stage']: stage for stage in old['scales'][scale]['stages']}
+        for stage in entry['stages']:
+            previous = before.get(stage['stage'])
+            if previous is None:
+                continue
+            ratio = stage['seconds'] / previous['seconds'] if previous['seconds'] else float('inf')
+            line = f"  {stage['stage']:<40} {previous['seconds']:9.3f}s -> {stage['seconds']:9.3f}s ({ratio:5.2f}x)"
+            if stage['peak_traced_mb'] is not None and previous['peak_traced_mb'] is not None:
+                line += f"  {previous['peak_traced_mb']:8.1f} -> {stage['peak_traced_mb']:8.1f} MB"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic crawl data")
+    parser.add_argument('--scales', nargs='+', default=['1k', '10k'], choices=list(SCALES))
+    parser.add_argument('--no-memory', action='store_true', help="Skip tracemalloc (it slows Python-heavy stages)")
+    parser.add_argument('--layout-iterations', type=int, default=100)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two saved result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        run_benchmarks(args.scales, memory=not args.no_memory, layout_iterations=args.layout_iterations)
@@ -0,0 +1,66 @@
+import os
+import time
+from atproto import AsyncClient, Client
+from atproto_client.exceptions import RequestErrorBase
+from atproto_client.request import AsyncRequest, Request
+
+from instrumentation import observe_call
+
+# Point every client at another XRPC server, e.g. http://127.0.0.1:8765/xrpc for fake_bluesky_server.py
+BASE_URL_VARIABLE = 'BLUESKY_BASE_URL'
+# Seconds before a request times out (httpx's default otherwise), e.g. to hit the fake server's stalls sooner
+TIMEOUT_VARIABLE = 'BLUESKY_TIMEOUT'
+
+
+def base_url():
+    """XRPC base URL from BLUESKY_BASE_URL, or None for the real service"""
+    return os.environ.get(BASE_URL_VARIABLE) or None
+
+
+def _request_options():
+    timeout = os.environ.get(TIMEOUT_VARIABLE)
+    return {'timeout': float(timeout)} if timeout else {}
+
+
+def _status(error):
+    return error.response.status_code if isinstance(error, RequestErrorBase) and error.response else 'error'
+
+
+class InstrumentedRequest(Request):
+    """Request that records the latency and status of every XRPC call in instrumentation.METRICS"""
+
+    def _send_request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super()._send_request(method, url, **kwargs)
+        except Exception as e:
+            observe_call(url.rsplit('/', 1)[-1], _status(e), time.perf_counter() - start)
+            raise
+        observe_call(url.rsplit('/', 1)[-1], response.status_code, time.perf_counter() - start)
+        return response
+
+
+class InstrumentedAsyncRequest(AsyncRequest):
+    """Async version of InstrumentedRequest"""
+
+    async def _send_request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await super()._send_request(method, url, **kwargs)
+        except Exception as e:
+            observe_call(url.rsplit('/', 1)[-1], _status(e), time.perf_counter() - start)
+            raise
+        observe_call(url.rsplit('/', 1)[-1], response.status_code, time.perf_counter() - start)
+        return response
+
+
+def create_client():
+    return Client(base_url(), request=InstrumentedRequest(**_request_options()))
+
+
+def create_async_client():
+    """
+    Async client for the same server; after login(session_string=...) the
+    client follows the PDS endpoint stored in the session anyway.
+    """
+    return AsyncClient(base_url(), request=InstrumentedAsyncRequest(**_request_options()))
@@ -1,42 +1,76 @@
 import os
 import json
 import time
+import argparse
 from datetime import datetime
-from atproto import Client, models
+from atproto import models
 
-def get_follows_for_user(client, username):
-    """Helper function to get follows for a specific user"""
-    follows = []
-    cursor = None
+from async_crawler import call_with_retries_sync, crawl_following_network
+from bluesky_client import create_client
+from build_graph import load_network_data, load_network_data_from_store
+from crawl_journal import CrawlJournal, needs_crawl
+from crawl_store import CrawlStore, follows_saved, save_actor_follows, saved_follow_lists
+from delta_crawl import plan_refresh, update_snapshot
+from instrumentation import count, save_metrics, stage
+from profile_cache import ProfileCache, refresh_profiles
+
+def get_follows_for_user(client, username, journal=None):
+    """
+    Helper function to get follows for a specific user.
+
+    With a journal, every page is checkpointed and an interrupted crawl resumes
+    from the last recorded cursor.
+
+    :return: (follows, complete) where `complete` is False if pagination stopped on an error
+    """
+    follows, cursor, finished = journal.resume(username) if journal else ([], None, False)
+    if finished:
+        return follows, True
     try:
         while True:
             params = {'actor': username, 'limit': 100}
             if cursor:
                 params['cursor'] = cursor
-            response = client.app.bsky.graph.get_follows(params)
-            follows.extend([follow.model_dump() for follow in response.follows])
+            response = call_with_retries_sync(client.app.bsky.graph.get_follows, params)
+            page = [follow.model_dump() for follow in response.follows]
+            count('pages', endpoint='app.bsky.graph.getFollows')
+            follows.extend(page)
+            if journal:
+                journal.record_page(username, page, response.cursor)
             if not response.cursor:
                 break
             cursor = response.cursor
+            count('rate_limit_sleep_seconds', 0.5)
             time.sleep(0.5)  # Rate limiting
     except Exception as e:
         print(f"Error fetching follows for {username}: {str(e)}")
-    return follows
+        if journal:
+            journal.mark_incomplete(username, e)
+        return follows, False
+    return follows, True
 
-def download_bluesky_network(username, password, output_dir=None):
+def download_bluesky_network(username, password, output_dir=None, concurrency=None, rate_limit=8.0,
+                             store_path=None, refresh=False, hydrate=False):
     """
     Download social network data from Bluesky.
     
     :param username: Your Bluesky username (handle)
     :param password: Your Bluesky password
     :param output_dir: Directory to save downloaded data (defaults to ./bluesky_data)
+    :param concurrency: If set, crawl the following network asynchronously with this many accounts in flight
+    :param rate_limit: Requests per second shared by the async crawl workers
+    :param store_path: If set, save the following network to this SQLite crawl store instead of per-handle JSON files
+    :param refresh: Refetch the follows of accounts whose follows_count changed since the last run
+                    (see delta_crawl.plan_refresh); other saved follow lists are kept
+    :param hydrate: Fetch the full profiles (followers/follows/posts counts, creation date) of every
+                    account in the extended network into profile_cache.json, 25 per request
     """
     # Create client and login
-    client = Client()
+    client = create_client()
     client.login(username, password)
 
     # Get profile information
-    profile = client.app.bsky.actor.get_profile({'actor': username})
+    profile = call_with_retries_sync(client.app.bsky.actor.get_profile, {'actor': username})
     
     # Determine output directory
     if output_dir is None:
@@ -54,15 +88,17 @@ def download_bluesky_network(username, password, output_dir=None):
     # Download followers
     followers = []
     cursor = None
-    while True:
-        params = {'actor': username, 'limit': 100}
-        if cursor:
-            params['cursor'] = cursor
-        response = client.app.bsky.graph.get_followers(params)
-        followers.extend([follower.model_dump() for follower in response.followers])
-        if not response.cursor:
-            break
-        cursor = response.cursor
+    with stage('download_followers'):
+        while True:
+            params = {'actor': username, 'limit': 100}
+            if cursor:
+                params['cursor'] = cursor
+            response = call_with_retries_sync(client.app.bsky.graph.get_followers, params)
+            count('pages', endpoint='app.bsky.graph.getFollowers')
+            followers.extend([follower.model_dump() for follower in response.followers])
+            if not response.cursor:
+                break
+            cursor = response.cursor
     
     with open(os.path.join(output_dir, "followers.json"), "w", encoding="utf-8") as f:
         json.dump(followers, f, indent=2, ensure_ascii=False)
@@ -70,15 +106,17 @@ def download_bluesky_network(username, password, output_dir=None):
     # Download following
     following = []
     cursor = None
-    while True:
-        params = {'actor': username, 'limit': 100}
-        if cursor:
-            params['cursor'] = cursor
-        response = client.app.bsky.graph.get_follows(params)
-        following.extend([follow.model_dump() for follow in response.follows])
-        if not response.cursor:
-            break
-        cursor = response.cursor
+    with stage('download_following'):
+        while True:
+            params = {'actor': username, 'limit': 100}
+            if cursor:
+                params['cursor'] = cursor
+            response = call_with_retries_sync(client.app.bsky.graph.get_follows, params)
+            count('pages', endpoint='app.bsky.graph.getFollows')
+            following.extend([follow.model_dump() for follow in response.follows])
+            if not response.cursor:
+                break
+            cursor = response.cursor
     
     with open(os.path.join(output_dir, "following.json"), "w", encoding="utf-8") as f:
         json.dump(following, f, indent=2, ensure_ascii=False)
@@ -86,37 +124,81 @@ def download_bluesky_network(username, password, output_dir=None):
     # Download following network (who your follows follow)
     print("\nDownloading following network (this may take a while)...")
     following_network = {}
-    for i, follow in enumerate(following, 1):
-        handle = follow['handle']
-        output_file = os.path.join(output_dir, "following_network", f"{handle}.json")
-        
-        if os.path.exists(output_file):
-            print(f"Skipping {i}/{len(following)}: {handle} (already exists)")
+    journal = CrawlJournal(output_dir)
+    store = CrawlStore(store_path) if store_path else None
+    if store is not None:
+        store.set_root(profile.model_dump(), following)
+    to_crawl = following
+    if refresh:
+        with stage('plan_refresh'):
+            counts, changed = plan_refresh(client, following, output_dir, journal, rate_limit=rate_limit,
+                                           saved=saved_follow_lists(output_dir, store))
+        # Changed accounts further out are refetched after the followed accounts
+        first_hop = {follow['did'] for follow in following}
+        to_crawl = following + [{'did': did, 'handle': handle} for did, handle in changed.items() if did not in first_hop]
+    with stage('download_following_network'):
+        if concurrency:
+            following_network = crawl_following_network(client.export_session_string(), to_crawl, output_dir,
+                                                         journal, store, concurrency=concurrency,
+                                                         rate_limit=rate_limit)
         else:
-            print(f"Processing {i}/{len(following)}: {handle}")
-            following_network[handle] = get_follows_for_user(client, handle)
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(following_network[handle], f, indent=2, ensure_ascii=False)
-            time.sleep(1)  # Rate limiting between users
+            for i, follow in enumerate(to_crawl, 1):
+                handle = follow['handle']
+                
+                if not needs_crawl(journal, handle, follows_saved(output_dir, store, follow)):
+                    print(f"Skipping {i}/{len(to_crawl)}: {handle} (already exists)")
+                else:
+                    print(f"Processing {i}/{len(to_crawl)}: {handle}")
+                    follows, complete = get_follows_for_user(client, handle, journal)
+                    if complete:
+                        save_actor_follows(output_dir, store, follow, follows)
+                        journal.mark_done(handle)
+                        following_network[handle] = follows
+                    else:
+                        print(f"Follows for {handle} are incomplete, they will be resumed on the next run")
+                    count('rate_limit_sleep_seconds', 1)
+                    time.sleep(1)  # Rate limiting between users
 
-    # Save complete following network
-    with open(os.path.join(output_dir, "following_network.json"), "w", encoding="utf-8") as f:
-        json.dump(following_network, f, indent=2, ensure_ascii=False)
+    if refresh:
+        update_snapshot(output_dir, journal, counts, changed)
+
+    if store is not None:
+        store.close()
+    else:
+        # Save complete following network
+        with open(os.path.join(output_dir, "following_network.json"), "w", encoding="utf-8") as f:
+            json.dump(following_network, f, indent=2, ensure_ascii=False)
+
+    if hydrate:
+        print("\nFetching full profiles of the network...")
+        with stage('hydrate_profiles'):
+            if store_path:
+                main_following, network_data = load_network_data_from_store(store_path)
+            else:
+                main_following, network_data = load_network_data(os.path.join(output_dir, "following.json"),
+                                                                 os.path.join(output_dir, "following_network"))
+            actors = {follow['did'] for follow in main_following}
+            for follows in network_data.values():
+                actors.update(follow['did'] for follow in follows)
+            refresh_profiles(client.export_session_string(), sorted(actors),
+                             ProfileCache(os.path.join(output_dir, "profile_cache.json")), rate_limit=rate_limit)
 
     # Download recent posts
     posts = []
     cursor = None
-    while True:
-        params = {'actor': username, 'limit': 100}
-        if cursor:
-            params['cursor'] = cursor
-        response = client.app.bsky.feed.get_author_feed(params)
-        posts.extend([post.model_dump() for post in response.feed])
-        if not response.cursor:
-            break
-        cursor = response.cursor
-        if len(posts) >= 500:  # Limit to last 500 posts to avoid too much data
-            break
+    with stage('download_posts'):
+        while True:
+            params = {'actor': username, 'limit': 100}
+            if cursor:
+                params['cursor'] = cursor
+            response = call_with_retries_sync(client.app.bsky.feed.get_author_feed, params)
+            count('pages', endpoint='app.bsky.feed.getAuthorFeed')
+            posts.extend([post.model_dump() for post in response.feed])
+            if not response.cursor:
+                break
+            cursor = response.cursor
+            if len(posts) >= 500:  # Limit to last 500 posts to avoid too much data
+                break
     
     with open(os.path.join(output_dir, "posts.json"), "w", encoding="utf-8") as f:
         json.dump(posts, f, indent=2, ensure_ascii=False)
@@ -131,6 +213,16 @@ def download_bluesky_network(username, password, output_dir=None):
     print(f"- posts.json ({len(posts)} posts)")
 
 def main():
+    parser = argparse.ArgumentParser(description="Download your Bluesky profile, follows and following network")
+    parser.add_argument('--concurrency', type=int,
+                        help="Crawl the following network asynchronously with this many accounts in flight")
+    parser.add_argument('--rate-limit', type=float, default=8.0, help="Requests per second of the async crawl")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Refetch the follow lists of accounts whose follows_count changed since the last run")
+    parser.add_argument('--hydrate', action='store_true',
+                        help="Fetch the full profiles of the extended network into profile_cache.json")
+    args = parser.parse_args()
+
     print("Welcome to Bluesky Network Downloader!")
     print("\nNOTE: Your username should be in the format 'handle.bsky.social'")
     print("For example, if your handle is 'alice', enter 'alice.bsky.social'")
@@ -139,7 +231,9 @@ def main():
     username = input("Enter your Bluesky handle (e.g., username.bsky.social): ").strip()
     password = input("Enter your Bluesky App Password (create one at Settings > App Passwords): ").strip()
 
-    download_bluesky_network(username, password)
+    download_bluesky_network(username, password, concurrency=args.concurrency, rate_limit=args.rate_limit,
+                             refresh=args.refresh, hydrate=args.hydrate)
+    save_metrics('bluesky_download')
 
 if __name__ == "__main__":
     main()
@@ -1,70 +1,153 @@
 import networkx as nx
+import numpy as np
 import json
 import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from crawl_store import CrawlStore
+from csr_graph import NODE_TYPES, CSRGraph
+from graph_export import export_graph
+from interning import SOURCE_USER, NodeInterner
+
+# Profile fields the graph builders use; everything else is dropped while loading
+GRAPH_FIELDS = ('did', 'handle', 'display_name', 'description')
+
+def create_network_graph(main_following, network_data, include_secondary_follows=False, interner=None):
+    """
+    Create a NetworkX graph from the follow data.
+
+    Nodes are dense integer IDs assigned once per DID by `interner` (a
+    NodeInterner, a fresh one by default). Handles, display names and
+    descriptions are kept in the interner's side tables (available as
+    G.graph['interner']) instead of on every node, so an account that changed
+    its handle is still one node.
+
+    :param network_data: Dict of follower -> follows, an iterable of
+                         (follower, follows) pairs, or a stream_network_data() stream
+    """
+    if interner is None:
+        interner = NodeInterner()
+    G = nx.DiGraph(interner=interner)
 
-def create_network_graph(main_following, network_data, include_secondary_follows=False):
-    """Create a NetworkX graph from the follow data"""
-    G = nx.DiGraph()  # Create a directed graph
-    
     # Add main user and their follows
-    source_user = "user"  # This represents the main user
+    source_user = interner.intern(SOURCE_USER, handle=SOURCE_USER)
     G.add_node(source_user, node_type="source")
-    
-    # Add edges from the source user to all their follows
+
     for follow in main_following:
-        handle = follow['handle']
-        G.add_node(handle, 
-                   node_type="following",
-                   display_name=follow.get('display_name', handle),
-                   description=follow.get('description', ''))
-        G.add_edge(source_user, handle)
-    
+        node = interner.intern_profile(follow)
+        G.add_node(node, node_type="following")
+        G.add_edge(source_user, node)
+
     # Add edges between following accounts
-    for account, following_list in network_data.items():
+    for account, following_list in _resolved_follow_lists(network_data, interner,
+                                                          first_hop_only=not include_secondary_follows):
+        if include_secondary_follows:
+            # Followers are keyed by handle (filename) or DID (crawl store); resolve to the DID's ID
+            follower = interner.intern_key(account)
+        else:
+            # Only accounts already in the graph count; others are not interned at all
+            follower = interner.id_for(account)
+            if follower is None or follower not in G:
+                continue
         for follow in following_list:
-            follower_handle = account
-            followee_handle = follow['handle']
-            
             if include_secondary_follows:
-                # If followee is not already in the graph, add it
-                if not G.has_node(followee_handle):
-                    G.add_node(followee_handle, 
-                               node_type="following",
-                               display_name=follow.get('display_name', followee_handle),
-                               description=follow.get('description', ''))
-                # Add edges from the follower to the followee
-                G.add_edge(follower_handle, followee_handle)
+                followee = interner.intern_profile(follow)
+                if followee not in G:
+                    G.add_node(followee, node_type="following")
+                G.add_edge(follower, followee)
             else:
                 # Only add edges if both nodes are already in the graph
-                if G.has_node(follower_handle) and G.has_node(followee_handle):
-                    G.add_edge(follower_handle, followee_handle)
-    
+                followee = interner.id_for(follow['did'])
+                if followee is not None and followee in G:
+                    G.add_edge(follower, followee)
+
     return G
 
+def _follow_lists(network_data):
+    if isinstance(network_data, NetworkStream):
+        return network_data.follow_lists()
+    return network_data.items() if isinstance(network_data, dict) else network_data
+
+def _resolved_follow_lists(network_data, interner, first_hop_only=False):
+    """
+    Like _follow_lists, but lists are keyed by the follower's DID where a
+    handle does not identify it.
+
+    following_network/ files are named by handle only, and handles change.
+    Lists keyed by a handle the interner does not know are held back until all
+    others are read, then looked up in the handle -> DID table of every
+    profile seen in the follow lists. The account resolves to its DID instead
+    of becoming a second node (or, for the first-hop graph, losing its edges).
+    With `first_hop_only`, held-back lists keep only follows of accounts the
+    interner already knows, so depth-2 files do not pile up in memory.
+    """
+    handle_dids = {}
+    unresolved = []
+    for account, following_list in _follow_lists(network_data):
+        for follow in following_list:
+            handle_dids[follow['handle']] = follow['did']
+        if interner.id_for(account) is None and not account.startswith('did:'):
+            if first_hop_only:
+                following_list = [follow for follow in following_list if interner.id_for(follow['did']) is not None]
+            unresolved.append((account, following_list))
+        else:
+            yield account, following_list
+    for account, following_list in unresolved:
+        yield handle_dids.get(account, account), following_list
+
+def create_csr_graph(main_following, network_data, include_secondary_follows=False, interner=None):
+    """
+    Create the follow graph as a CSRGraph, building the sparse adjacency in bulk.
+
+    Same nodes and edges as create_network_graph, without
+    allocating a Python object per node and edge. Call .to_networkx() on the
+    result where NetworkX is needed. Pass a fresh interner: node positions are
+    the interner IDs.
+    """
+    if interner is None:
+        interner = NodeInterner()
+    src = array('i')
+    dst = array('i')
+
+    source_user = interner.intern(SOURCE_USER, handle=SOURCE_USER)
+    for follow in main_following:
+        src.append(source_user)
+        dst.append(interner.intern_profile(follow))
+    num_first_hop = len(interner)
+
+    for account, following_list in _resolved_follow_lists(network_data, interner,
+                                                          first_hop_only=not include_secondary_follows):
+        if include_secondary_follows:
+            follower = interner.intern_key(account)
+            for follow in following_list:
+                src.append(follower)
+                dst.append(interner.intern_profile(follow))
+        else:
+            # Only keep edges between the source user's follows
+            follower = interner.id_for(account)
+            if follower is None or follower >= num_first_hop:
+                continue
+            for follow in following_list:
+                followee = interner.id_for(follow['did'])
+                if followee is not None and followee < num_first_hop:
+                    src.append(follower)
+                    dst.append(followee)
+
+    num_nodes = len(interner) if include_secondary_follows else num_first_hop
+    node_type = np.full(num_nodes, NODE_TYPES.index('following'), dtype=np.int8)
+    node_type[source_user] = NODE_TYPES.index('source')
+    return CSRGraph.from_edges(np.frombuffer(src, dtype=np.int32), np.frombuffer(dst, dtype=np.int32),
+                               num_nodes, node_type=node_type, interner=interner)
+
 def export_to_graphml(G, output_folder='output_data', output_file='bluesky_network.graphml'):
-    """Export the network to GraphML format"""
-    # Create output directory if it doesn't exist
-    output_file = os.path.join(output_folder, output_file)
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    
-    # Create a copy of the graph to modify attributes
-    H = G.copy()
-    
-    # Replace None values with empty strings in node attributes
-    for node in H.nodes():
-        for key in H.nodes[node]:
-            if H.nodes[node][key] is None:
-                H.nodes[node][key] = ""
-    
-    # Replace None values with empty strings in edge attributes
-    for u, v in H.edges():
-        for key in H.edges[u, v]:
-            if H.edges[u, v][key] is None:
-                H.edges[u, v][key] = ""
-    
-    # Export the modified graph
-    nx.write_graphml(H, output_file)
-    print(f"\nNetwork data exported to '{output_file}'")
+    """Export the network to GraphML format (streamed by graph_export, see export_graph for other formats)"""
+    export_graph(G, os.path.join(output_folder, output_file), format='graphml')
 
 def load_network_data(main_json_path, network_dir):
     """Load the network data from the JSON files"""
@@ -82,6 +165,90 @@ def load_network_data(main_json_path, network_dir):
     
     return main_following, network_data
 
+def _read_json(path):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read()) if orjson is not None else json.load(f)
+
+def _load_follow_file(path):
+    """Parse one following_network file into a GRAPH_FIELDS tuple per profile"""
+    return [tuple(follow.get(field) for field in GRAPH_FIELDS) for follow in _read_json(path)]
+
+class NetworkStream:
+    """
+    Follow lists of a following_network/ directory, parsed lazily.
+
+    Iterating yields one (follower handle, [followee DID, ...]) batch per
+    file. Followee profiles, trimmed to GRAPH_FIELDS, are kept once per DID in
+    `profiles` as the files are read, so memory grows with the number of edges
+    and accounts rather than with edges times profile text. At most `window`
+    files are in flight. Uses orjson when it is installed.
+
+    :param processes: Parse files in a pool of this many processes (defaults
+                      to one per CPU when there are more files than `window`; 1 parses in-process)
+    """
+
+    def __init__(self, network_dir, processes=None, window=256):
+        self.network_dir = network_dir
+        self.processes = processes
+        self.window = window
+        self.profiles = {}
+
+    def _parsed_files(self):
+        filenames = sorted(filename for filename in os.listdir(self.network_dir) if filename.endswith('.json'))
+        paths = [os.path.join(self.network_dir, filename) for filename in filenames]
+        processes = self.processes
+        if processes is None:
+            processes = (os.cpu_count() or 1) if len(paths) > self.window else 1
+
+        if processes <= 1:
+            for filename, path in zip(filenames, paths):
+                yield filename[:-len('.json')], _load_follow_file(path)
+            return
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for start in range(0, len(paths), self.window):
+                chunk = paths[start:start + self.window]
+                results = pool.map(_load_follow_file, chunk, chunksize=max(1, len(chunk) // (4 * processes)))
+                for filename, rows in zip(filenames[start:start + self.window], results):
+                    yield filename[:-len('.json')], rows
+
+    def __iter__(self):
+        for follower, rows in self._parsed_files():
+            dids = []
+            for row in rows:
+                profile = self.profiles.get(row[0])
+                if profile is None:
+                    profile = dict(zip(GRAPH_FIELDS, row))
+                    self.profiles[profile['did']] = profile
+                dids.append(profile['did'])  # The stored DID string, shared by every list naming it
+            yield follower, dids
+
+    def follow_lists(self):
+        """Yield (follower handle, [followee profile, ...]) pairs; each profile dict is shared by all lists"""
+        for follower, dids in self:
+            yield follower, [self.profiles[did] for did in dids]
+
+def stream_network_data(network_dir, processes=None, window=256):
+    """Stream the follow lists of following_network/ as (follower handle, followee DIDs) batches (see NetworkStream)"""
+    return NetworkStream(network_dir, processes, window)
+
+def load_network_data_from_store(store_path):
+    """Load the network data from a crawl store, in the same shape as load_network_data"""
+    with CrawlStore(store_path) as store:
+        profiles = store.profiles()
+        root_id = store.actor_id(store.root_did())
+
+        main_following = []
+        network_data = {profiles[actor]['handle']: [] for actor in store.crawled_actors() if actor != root_id}
+        for edges in store.iter_edges():
+            for src, dst in edges:
+                if src == root_id:
+                    main_following.append(profiles[dst])
+                else:
+                    network_data.setdefault(profiles[src]['handle'], []).append(profiles[dst])
+
+    return main_following, network_data
+
 
 if __name__ == "__main__":
     """Main function to run the network analysis"""
@@ -89,14 +256,17 @@ if __name__ == "__main__":
     main_json_path = 'bluesky_data/following.json'
     network_dir = 'bluesky_data/following_network'
     
-    # Load the data
-    main_following, network_data = load_network_data(main_json_path, network_dir)
+    # Load the main user's follows; each graph streams the network files, keeping only its own edges
+    with open(main_json_path, 'r', encoding='utf-8') as f:
+        main_following = json.load(f)
+    network_data = stream_network_data(network_dir)
     
     # Create and export the basic network graph
-    G = create_network_graph(main_following, network_data)
+    G = create_network_graph(main_following, network_data, interner=NodeInterner())
     export_to_graphml(G)
 
     # Create and export the extended network graph
-    G = create_network_graph(main_following, network_data, include_secondary_follows=True)
+    G = create_network_graph(main_following, network_data, include_secondary_follows=True,
+                             interner=NodeInterner())
     export_to_graphml(G, output_file='bluesky_network_extended.graphml')
 
@@ -0,0 +1,243 @@
+import os
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+from csr_graph import CSRGraph
+from metrics import hash_keys, stable_key
+
+
+def symmetric_adjacency(graph):
+    """Weighted undirected adjacency of a follow graph: reciprocal follows weigh 2, self-follows are dropped"""
+    if isinstance(graph, CSRGraph):
+        A = graph.out_adj
+    elif graph.number_of_nodes() == 0:
+        A = sparse.csr_matrix((0, 0))
+    else:
+        A = nx.to_scipy_sparse_array(graph, weight=None, dtype=float, format='csr')
+    A = sparse.csr_matrix(A, dtype=np.float64)
+    A = (A + A.T).tocsr()
+    A.setdiag(0)
+    A.eliminate_zeros()
+    return A
+
+
+def _modularity(A, membership, k, two_m, resolution):
+    same = membership[A.indices] == np.repeat(membership, np.diff(A.indptr))
+    inside = A.data[same].sum()
+    tot = np.bincount(membership, weights=k)
+    return (inside - resolution * (tot ** 2).sum() / two_m) / two_m
+
+
+def _local_moves(A, membership, resolution, rng, threshold, max_sweeps=100):
+    """
+    Louvain local-moving phase, vectorized over all nodes of a CSR adjacency.
+
+    Each sweep computes, with one sparse product, every node's link weight to
+    each neighboring community and the modularity gain of moving there. A
+    seeded random share of the improving nodes is then moved at once; the share
+    is halved whenever a sweep fails to raise modularity, which keeps
+    simultaneous moves from oscillating. Returns True if modularity improved.
+    """
+    n = A.shape[0]
+    k = np.asarray(A.sum(axis=1)).ravel()
+    two_m = k.sum()
+    if two_m == 0:
+        return False
+    self_loops = A.diagonal()
+
+    quality = _modularity(A, membership, k, two_m, resolution)
+    start_quality = quality
+    share = 1.0
+    for _ in range(max_sweeps):
+        tot = np.bincount(membership, weights=k, minlength=n)
+        assignment = sparse.csr_matrix((np.ones(n), (np.arange(n), membership)), shape=(n, n))
+        links = (A @ assignment).tocsr()
+        links.sum_duplicates()
+        link_rows = np.repeat(np.arange(n), np.diff(links.indptr))
+        own = links.indices == membership[link_rows]
+        # Gain of joining each neighboring community, with the node itself taken out of its own
+        weight = links.data - np.where(own, self_loops[link_rows], 0.0)
+        community_tot = tot[links.indices] - np.where(own, k[link_rows], 0.0)
+        gain = weight - resolution * community_tot * k[link_rows] / two_m
+
+        stay = -resolution * (tot[membership] - k) * k / two_m
+        stay[link_rows[own]] = gain[own]
+
+        # Best community per node (ties go to the lowest community label)
+        order = np.lexsort((links.indices, -gain, link_rows))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = link_rows[order][1:] != link_rows[order][:-1]
+        best_entry = order[first]
+        best_rows = link_rows[best_entry]
+        improving = gain[best_entry] > stay[best_rows] + threshold
+        candidates = best_rows[improving]
+        targets = links.indices[best_entry][improving]
+        if len(candidates) == 0:
+            break
+
+        chosen = rng.random(len(candidates)) < share
+        if not chosen.any():
+            chosen[rng.integers(len(candidates))] = True
+        proposal = membership.copy()
+        proposal[candidates[chosen]] = targets[chosen]
+        new_quality = _modularity(A, proposal, k, two_m, resolution)
+        if new_quality > quality + threshold:
+            membership[:] = proposal
+            quality = new_quality
+        else:
+            share /= 2
+            if share < 1 / 64:
+                break
+    return quality > start_quality + threshold
+
+
+def _relabel(membership):
+    """Renumber community labels densely as 0..c-1"""
+    _, dense = np.unique(membership, return_inverse=True)
+    return dense
+
+
+def louvain(A, resolution=1.0, seed=42, initial=None, threshold=1e-7, max_levels=20):
+    """
+    Louvain community detection on a symmetric weighted CSR adjacency.
+
+    :param initial: Optional starting community label per node (-1 for none);
+                    used to refine a previous partition instead of starting from singletons
+    :return: Array of community labels (0..c-1) per node
+    """
+    rng = np.random.default_rng(seed)
+    n = A.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if initial is None:
+        membership = np.arange(n)
+    else:
+        membership = np.asarray(initial).copy()
+        unassigned = membership < 0
+        membership[unassigned] = membership.max(initial=-1) + 1 + np.arange(unassigned.sum())
+        membership = _relabel(membership)
+
+    node_community = np.arange(n)  # Community of each original node at the current level
+    level_adjacency = A
+    for _ in range(max_levels):
+        improved = _local_moves(level_adjacency, membership, resolution, rng, threshold)
+        membership = _relabel(membership)
+        node_community = membership[node_community]
+        if not improved and level_adjacency is not A:
+            break
+        # Aggregate communities into super-nodes: A' = P^T A P
+        assignment = sparse.csr_matrix((np.ones(len(membership)), (np.arange(len(membership)), membership)),
+                                       shape=(len(membership), membership.max() + 1))
+        aggregated = (assignment.T @ level_adjacency @ assignment).tocsr()
+        if aggregated.shape[0] == level_adjacency.shape[0]:
+            break
+        level_adjacency = aggregated
+        membership = np.arange(aggregated.shape[0])
+    return node_community
+
+
+def _edge_hashes(A, key_hashes):
+    """Sorted hashes of the undirected edges, for measuring how much the graph changed"""
+    upper = sparse.triu(A, k=1).tocoo()
+    u, v = key_hashes[upper.row], key_hashes[upper.col]
+    lo, hi = np.minimum(u, v), np.maximum(u, v)
+    with np.errstate(over='ignore'):
+        return np.sort(lo * np.uint64(0x9E3779B97F4A7C15) ^ hi)
+
+
+def _stable_labels(membership, previous):
+    """
+    Renumber communities so each keeps the ID of the previous community it overlaps most.
+
+    `previous` holds the old community ID per node (-1 for new nodes). Unmatched
+    communities take the lowest free IDs, reusing those of retired communities,
+    so the ID range stays close to the current number of communities.
+    """
+    result = np.empty_like(membership)
+    used = set()
+    unmatched = []
+    order = np.argsort(membership, kind='stable')
+    bounds = np.flatnonzero(np.diff(membership[order])) + 1
+    groups = np.split(order, bounds) if len(order) else []
+    for members in sorted(groups, key=len, reverse=True):
+        old = previous[members]
+        old = old[old >= 0]
+        label = None
+        if len(old):
+            ids, counts = np.unique(old, return_counts=True)
+            for idx in np.argsort(-counts, kind='stable'):
+                if ids[idx] not in used:
+                    label = int(ids[idx])
+                    break
+        if label is None:
+            unmatched.append(members)
+            continue
+        used.add(label)
+        result[members] = label
+
+    next_id = 0
+    for members in unmatched:
+        while next_id in used:
+            next_id += 1
+        used.add(next_id)
+        result[members] = next_id
+    return result
+
+
+def detect_communities_csr(G, seed=42, resolution=1.0, state_file='output_data/communities_state.npz',
+                           incremental_threshold=0.05):
+    """
+    Seeded Louvain communities on the array-backed adjacency, reusing the previous run's partition.
+
+    When a previous partition is saved in `state_file` and less than
+    `incremental_threshold` of the edges changed, the previous communities are
+    the starting point instead of singletons. Community IDs are matched to the
+    previous ones, so unchanged groups keep their ID in nodes_info.csv.
+
+    :param G: nx.DiGraph or CSRGraph
+    :return: List of node sets, where the position in the list is the community ID
+             (IDs retired since the previous run and not reused are empty sets)
+    """
+    if isinstance(G, CSRGraph):
+        nodes = list(range(G.number_of_nodes()))
+        keys = [G.interner.dids[node_id] if G.interner is not None else G.label(i)
+                for i, node_id in enumerate(G.node_ids)]
+    else:
+        nodes = list(G.nodes())
+        keys = [stable_key(G, node) for node in nodes]
+    A = symmetric_adjacency(G)
+    key_hashes = hash_keys(keys)
+    edges = _edge_hashes(A, key_hashes)
+
+    previous = np.full(len(nodes), -1, dtype=np.int64)
+    initial = None
+    if state_file and os.path.exists(state_file):
+        with np.load(state_file) as state:
+            old_keys, old_labels, old_edges = state['keys'], state['labels'], state['edges']
+    else:
+        old_keys = np.zeros(0, dtype=np.uint64)
+    if len(old_keys):
+        order = np.argsort(old_keys)
+        position = np.searchsorted(old_keys[order], key_hashes)
+        position = np.minimum(position, len(order) - 1)
+        found = old_keys[order][position] == key_hashes
+        previous[found] = old_labels[order][position[found]]
+
+        shared = len(np.intersect1d(edges, old_edges, assume_unique=False))
+        changed = 1 - shared / max(len(edges), len(old_edges), 1)
+        if changed < incremental_threshold:
+            print(f"{changed:.1%} of edges changed, refining the previous partition")
+            initial = previous
+
+    membership = louvain(A, resolution=resolution, seed=seed, initial=initial)
+    labels = _stable_labels(membership, previous)
+
+    if state_file:
+        os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+        np.savez_compressed(state_file, keys=key_hashes, labels=labels, edges=edges)
+
+    communities = [set() for _ in range(int(labels.max(initial=-1)) + 1)]
+    for node, label in zip(nodes, labels):
+        communities[label].add(node)
+    return communities
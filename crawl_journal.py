@@ -0,0 +1,150 @@
+import os
+import json
+import threading
+
+
+class CrawlJournal:
+    """
+    Durable record of how far the pagination of each actor got.
+
+    Every fetched page is appended to `following_network/.partial/<actor>.jsonl`
+    and then a line with the actor's next cursor and page count is appended to
+    `crawl_journal.jsonl`. Both files are fsync'd, so after a crash the crawl
+    can continue from the page that was in flight. Replaying the journal gives
+    the latest state of every actor (the last line for an actor wins).
+    """
+
+    def __init__(self, output_dir, filename="crawl_journal.jsonl"):
+        self.path = os.path.join(output_dir, filename)
+        self.partial_dir = os.path.join(output_dir, "following_network", ".partial")
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.entries = {}
+        self._checked = set()  # Actors whose partial file is known to match the journal
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, "rb+") as f:
+                valid = 0
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        entry = None
+                    if entry is None or not line.endswith(b"\n"):
+                        # Torn write at the end of the journal; cut it off so the next entry starts on its own line
+                        f.truncate(valid)
+                        break
+                    self.entries[entry['actor']] = entry
+                    valid += len(line)
+
+    def _append(self, path, record):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _partial_path(self, actor):
+        return os.path.join(self.partial_dir, f"{actor}.jsonl")
+
+    def _write_entry(self, actor, **state):
+        entry = {'actor': actor, **state}
+        self._append(self.path, entry)
+        self.entries[actor] = entry
+
+    def state(self, actor):
+        """Latest journal entry for an actor, or None if it was never crawled"""
+        return self.entries.get(actor)
+
+    def is_done(self, actor):
+        entry = self.entries.get(actor)
+        return bool(entry and entry.get('done'))
+
+    def resume(self, actor):
+        """
+        Return the follows already fetched for an actor and the cursor to continue from.
+
+        :return: (follows, cursor, finished) where `finished` means the last page was already fetched
+        """
+        entry = self.entries.get(actor)
+        if not entry or entry.get('done') or not entry.get('pages'):
+            return [], None, False
+        if not os.path.exists(self._partial_path(actor)):
+            self.reset(actor)
+            return [], None, False
+
+        follows = []
+        pages = 0
+        with open(self._partial_path(actor), "r", encoding="utf-8") as f:
+            for line in f:
+                if pages == entry['pages']:
+                    break  # Page written but never acknowledged in the journal
+                follows.extend(json.loads(line))
+                pages += 1
+        return follows, entry['cursor'], entry['cursor'] is None
+
+    def record_page(self, actor, page, cursor):
+        """Persist one fetched page and the cursor of the next one (None when pagination ended)"""
+        with self._lock:
+            entry = self.entries.get(actor) or {}
+            pages = 0 if entry.get('done') else entry.get('pages', 0)
+            path = self._partial_path(actor)
+            if actor not in self._checked:
+                if pages == 0 and os.path.exists(path):
+                    os.remove(path)
+                elif pages:
+                    self._truncate_pages(path, pages)
+                self._checked.add(actor)
+            self._append(path, page)
+            self._write_entry(actor, cursor=cursor, pages=pages + 1, done=False)
+
+    def _truncate_pages(self, path, pages):
+        """Drop pages past the acknowledged count, left behind by a crash between the two appends"""
+        with open(path, "rb+") as f:
+            for _ in range(pages):
+                f.readline()
+            f.truncate()
+
+    def mark_incomplete(self, actor, error):
+        """Record that the crawl of an actor stopped early, keeping the pages fetched so far"""
+        with self._lock:
+            entry = self.entries.get(actor) or {}
+            self._write_entry(actor, cursor=entry.get('cursor'), pages=entry.get('pages', 0),
+                              done=False, error=str(error))
+
+    def mark_done(self, actor):
+        """Record that the full follow list of an actor has been saved, and drop its partial pages"""
+        with self._lock:
+            self._write_entry(actor, cursor=None, pages=0, done=True)
+            self._checked.discard(actor)
+            path = self._partial_path(actor)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def reset(self, actor):
+        """Forget any progress for an actor so the next crawl fetches it from the first page"""
+        with self._lock:
+            self._write_entry(actor, cursor=None, pages=0, done=False)
+            self._checked.discard(actor)
+            path = self._partial_path(actor)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def save_follows(output_file, follows):
+    """Atomically write a complete follow list, so a crash never leaves a truncated file behind"""
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(follows, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, output_file)
+
+
+def needs_crawl(journal, actor, saved):
+    """
+    Decide whether an actor still has to be fetched.
+
+    Follow lists saved before the journal existed are trusted as complete;
+    anything the journal knows about is only skipped once it was marked done.
+    """
+    if journal.state(actor) is None:
+        return not saved
+    return not journal.is_done(actor)
@@ -0,0 +1,241 @@
+import os
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+from crawl_journal import save_follows
+from interning import SOURCE_USER
+
+# Profile fields kept in the store; everything else in model_dump() (avatar
+# URLs, labels, viewer state...) is dropped, and each profile is stored once.
+PROFILE_FIELDS = ('did', 'handle', 'display_name', 'description', 'created_at')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actors (
+    id INTEGER PRIMARY KEY,
+    did TEXT NOT NULL UNIQUE,
+    handle TEXT,
+    display_name TEXT,
+    description TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS actors_handle ON actors (handle);
+CREATE TABLE IF NOT EXISTS follows (
+    src INTEGER NOT NULL,
+    dst INTEGER NOT NULL,
+    PRIMARY KEY (src, dst)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS crawled (
+    actor INTEGER PRIMARY KEY,
+    fetched_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class CrawlStore:
+    """
+    SQLite crawl store: profiles keyed once by DID, follows as (src, dst) actor ID pairs.
+
+    Replaces the per-handle following_network/*.json files, where the same
+    profile was repeated in every file that mentions it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def upsert_profiles(self, profiles):
+        """Insert or update profiles and return their actor IDs in the same order"""
+        rows = [tuple(profile.get(field) for field in PROFILE_FIELDS) for profile in profiles]
+        with self.conn:
+            self.conn.executemany(
+                """INSERT INTO actors (did, handle, display_name, description, created_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (did) DO UPDATE SET
+                       handle = excluded.handle,
+                       display_name = COALESCE(excluded.display_name, display_name),
+                       description = COALESCE(excluded.description, description),
+                       created_at = COALESCE(excluded.created_at, created_at)""",
+                rows)
+        return [self.actor_id(profile['did']) for profile in profiles]
+
+    def actor_id(self, did):
+        row = self.conn.execute("SELECT id FROM actors WHERE did = ?", (did,)).fetchone()
+        return row[0] if row else None
+
+    def did_for_handle(self, handle):
+        row = self.conn.execute("SELECT did FROM actors WHERE handle = ?", (handle,)).fetchone()
+        return row[0] if row else None
+
+    def set_follows(self, profile, follows):
+        """Replace the complete follow list of an actor"""
+        src = self.upsert_profiles([profile])[0]
+        dst_ids = self.upsert_profiles(follows)
+        with self.conn:
+            self.conn.execute("DELETE FROM follows WHERE src = ?", (src,))
+            self.conn.executemany("INSERT OR IGNORE INTO follows (src, dst) VALUES (?, ?)",
+                                  [(src, dst) for dst in dst_ids])
+            self.conn.execute("INSERT OR REPLACE INTO crawled (actor, fetched_at) VALUES (?, ?)",
+                              (src, datetime.now(timezone.utc).isoformat()))
+
+    def set_root(self, profile, following):
+        """Record the account the crawl started from, together with its follows"""
+        self.set_follows(profile, following)
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('root_did', ?)",
+                              (profile['did'],))
+
+    def root_did(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'root_did'").fetchone()
+        return row[0] if row else None
+
+    def has_follows(self, did):
+        """True if the complete follow list of this actor has been stored"""
+        row = self.conn.execute(
+            "SELECT 1 FROM crawled JOIN actors ON actors.id = crawled.actor WHERE actors.did = ?",
+            (did,)).fetchone()
+        return row is not None
+
+    def profiles(self):
+        """Return a dict of actor ID -> profile dict for every stored actor"""
+        cursor = self.conn.execute(f"SELECT id, {', '.join(PROFILE_FIELDS)} FROM actors")
+        return {row[0]: dict(zip(PROFILE_FIELDS, row[1:])) for row in cursor}
+
+    def iter_profiles(self, batch_size=100000):
+        """Yield profile dicts of every stored actor, in lists of at most `batch_size`"""
+        cursor = self.conn.execute(f"SELECT {', '.join(PROFILE_FIELDS)} FROM actors ORDER BY id")
+        for rows in _batches(cursor, batch_size):
+            yield [dict(zip(PROFILE_FIELDS, row)) for row in rows]
+
+    def iter_edges(self, batch_size=100000):
+        """Yield follow edges as lists of (src, dst) actor ID pairs, grouped by follower"""
+        cursor = self.conn.execute("SELECT src, dst FROM follows ORDER BY src")
+        yield from _batches(cursor, batch_size)
+
+    def iter_did_edges(self, batch_size=100000):
+        """Yield follow edges as lists of (src DID, dst DID) pairs, grouped by follower"""
+        cursor = self.conn.execute(
+            """SELECT a.did, b.did FROM follows
+               JOIN actors a ON a.id = follows.src
+               JOIN actors b ON b.id = follows.dst
+               ORDER BY follows.src""")
+        yield from _batches(cursor, batch_size)
+
+    def crawled_actors(self):
+        """Actor IDs whose follow lists are stored"""
+        return {row[0] for row in self.conn.execute("SELECT actor FROM crawled")}
+
+    def crawled_profiles(self):
+        """DID and handle of every actor whose follow list is stored, the root included"""
+        cursor = self.conn.execute("SELECT did, handle FROM crawled JOIN actors ON actors.id = crawled.actor")
+        return [{'did': did, 'handle': handle} for did, handle in cursor]
+
+
+def _batches(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def follows_saved(output_dir, store, profile):
+    """True if the follows of `profile` are already saved, in the store or as a JSON file"""
+    if store is not None:
+        return store.has_follows(profile['did'])
+    return os.path.exists(os.path.join(output_dir, "following_network", f"{profile['handle']}.json"))
+
+
+def saved_follow_lists(output_dir, store):
+    """
+    Actors whose follow lists are saved, at any depth: profiles from the store
+    (the root left out), or {'handle': ...} for each following_network/<handle>.json
+    """
+    if store is not None:
+        root = store.root_did()
+        return [profile for profile in store.crawled_profiles() if profile['did'] != root]
+    network_dir = os.path.join(output_dir, "following_network")
+    if not os.path.isdir(network_dir):
+        return []
+    return [{'handle': filename[:-len('.json')]} for filename in sorted(os.listdir(network_dir))
+            if filename.endswith('.json')]
+
+
+def save_actor_follows(output_dir, store, profile, follows):
+    """Save a complete follow list to the store, or to following_network/<handle>.json without one"""
+    if store is not None:
+        store.set_follows(profile, follows)
+    else:
+        save_follows(os.path.join(output_dir, "following_network", f"{profile['handle']}.json"), follows)
+
+
+def import_json_layout(data_dir, store_path):
+    """
+    Import an existing bluesky_data directory (profile.json, following.json and
+    following_network/*.json) into a crawl store.
+
+    Without profile.json, the root is recorded as the SOURCE_USER pseudo-account.
+    """
+    with open(os.path.join(data_dir, "following.json"), "r", encoding="utf-8") as f:
+        following = json.load(f)
+
+    with CrawlStore(store_path) as store:
+        profile_path = os.path.join(data_dir, "profile.json")
+        if os.path.exists(profile_path):
+            with open(profile_path, "r", encoding="utf-8") as f:
+                store.set_root(json.load(f), following)
+        else:
+            store.set_root({'did': SOURCE_USER, 'handle': SOURCE_USER}, following)
+
+        # Files are named by handle, so map handles back to DIDs. A depth-2 handle
+        # is only known once a list naming it was imported; such files are retried
+        # after the others, until a pass resolves nothing new
+        handle_to_profile = {follow['handle']: follow for follow in following}
+        network_dir = os.path.join(data_dir, "following_network")
+        pending = sorted(filename for filename in os.listdir(network_dir) if filename.endswith('.json'))
+        imported = 0
+        unresolved = []
+        while pending:
+            unresolved = []
+            for filename in pending:
+                handle = filename[:-len('.json')]
+                profile = handle_to_profile.get(handle)
+                if profile is None:
+                    did = store.did_for_handle(handle)
+                    if did is None:
+                        unresolved.append(filename)
+                        continue
+                    profile = {'did': did, 'handle': handle}
+                with open(os.path.join(network_dir, filename), "r", encoding="utf-8") as f:
+                    store.set_follows(profile, json.load(f))
+                imported += 1
+            if len(unresolved) == len(pending):
+                break
+            pending = unresolved
+        for filename in unresolved:
+            print(f"Skipping {filename}: unknown handle {filename[:-len('.json')]}")
+
+    print(f"Imported {imported} follow lists into '{store_path}'")
+
+
+if __name__ == "__main__":
+    import_json_layout('bluesky_data', 'bluesky_data/crawl.sqlite')
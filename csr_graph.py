@@ -0,0 +1,152 @@
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+NODE_TYPES = ('source', 'following')
+
+
+class CSRGraph:
+    """
+    Compact directed follow graph backed by scipy sparse arrays.
+
+    Out-edges are stored as a CSR matrix and in-edges as its CSC counterpart,
+    so successor, predecessor and degree queries are array slices instead of
+    dict lookups. Nodes are integer positions 0..n-1; `node_ids` maps them
+    back to the interner IDs they were built from (identity for full graphs).
+    """
+
+    def __init__(self, adjacency, node_type=None, interner=None, node_ids=None, labels=None):
+        adjacency = sparse.csr_matrix(adjacency, dtype=np.float32)
+        adjacency.sum_duplicates()
+        adjacency.data[:] = 1.0
+        self._init(adjacency, adjacency.tocsc(), node_type, interner, node_ids, labels)
+
+    def _init(self, out_adj, in_adj, node_type, interner, node_ids, labels):
+        self.out_adj = out_adj
+        self.in_adj = in_adj
+        n = out_adj.shape[0]
+        self.node_type = (np.asarray(node_type, dtype=np.int8) if node_type is not None
+                          else np.full(n, NODE_TYPES.index('following'), dtype=np.int8))
+        self.node_ids = np.arange(n) if node_ids is None else np.asarray(node_ids)
+        self.interner = interner
+        self.labels = labels  # Node keys of a graph converted from a handle-keyed nx.DiGraph
+        self.graph = {'interner': interner}
+        self._undirected = None
+
+    @classmethod
+    def from_edges(cls, src, dst, num_nodes, node_type=None, interner=None):
+        """Build the graph in bulk from parallel arrays of follower and followee IDs"""
+        src = np.asarray(src, dtype=np.int32)
+        dst = np.asarray(dst, dtype=np.int32)
+        adjacency = sparse.coo_matrix((np.ones(len(src), dtype=np.float32), (src, dst)),
+                                      shape=(num_nodes, num_nodes))
+        return cls(adjacency, node_type=node_type, interner=interner)
+
+    @classmethod
+    def from_arrays(cls, out_adj, in_adj, node_type, interner=None):
+        """
+        Wrap prebuilt CSR (out-edges) and CSC (in-edges) matrices without copying
+        or validating them, e.g. the memory-mapped arrays of a graph snapshot.
+        Both must already hold each edge once with weight 1.
+        """
+        graph = cls.__new__(cls)
+        graph._init(out_adj, in_adj, node_type, interner, None, None)
+        return graph
+
+    @classmethod
+    def from_networkx(cls, G):
+        """Convert a NetworkX graph; nodes are numbered in G.nodes() order"""
+        nodes = list(G.nodes())
+        interner = G.graph.get('interner')
+        adjacency = nx.to_scipy_sparse_array(G, nodelist=nodes, dtype=np.float32, weight=None, format='csr')
+        node_type = [NODE_TYPES.index(G.nodes[node].get('node_type', 'following')) for node in nodes]
+        if interner is not None:
+            return cls(adjacency, node_type=node_type, interner=interner, node_ids=nodes)
+        return cls(adjacency, node_type=node_type, labels=nodes)
+
+    def number_of_nodes(self):
+        return self.out_adj.shape[0]
+
+    def number_of_edges(self):
+        return self.out_adj.nnz
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+    def successors(self, node):
+        """Accounts followed by `node`"""
+        return self.out_adj.indices[self.out_adj.indptr[node]:self.out_adj.indptr[node + 1]]
+
+    def predecessors(self, node):
+        """Accounts following `node`"""
+        return self.in_adj.indices[self.in_adj.indptr[node]:self.in_adj.indptr[node + 1]]
+
+    def neighbors(self, node):
+        """Neighbors of `node` in the undirected view of the graph"""
+        adj = self.undirected_adjacency()
+        return adj.indices[adj.indptr[node]:adj.indptr[node + 1]]
+
+    def has_edge(self, u, v):
+        return v in self.successors(u)
+
+    def out_degree(self):
+        return np.diff(self.out_adj.indptr)
+
+    def in_degree(self):
+        return np.diff(self.in_adj.indptr)
+
+    def degree(self):
+        """Total degree (in + out), matching DiGraph.degree"""
+        return self.out_degree() + self.in_degree()
+
+    def undirected_adjacency(self):
+        """Symmetric 0/1 CSR adjacency without self-loops, as used by to_undirected() (cached)"""
+        if self._undirected is None:
+            adj = (self.out_adj + self.out_adj.T).tocsr()
+            adj.setdiag(0)
+            adj.eliminate_zeros()
+            adj.data[:] = 1.0
+            self._undirected = adj
+        return self._undirected
+
+    def adjacency_matrix(self):
+        """Directed adjacency matrix, as returned by nx.adjacency_matrix"""
+        return self.out_adj
+
+    def subgraph(self, nodes):
+        """Induced subgraph on `nodes` (positions in this graph), renumbered 0..len(nodes)-1"""
+        nodes = np.asarray(nodes)
+        adjacency = self.out_adj[nodes][:, nodes]
+        labels = [self.labels[i] for i in nodes] if self.labels is not None else None
+        return CSRGraph(adjacency, node_type=self.node_type[nodes], interner=self.interner,
+                        node_ids=self.node_ids[nodes], labels=labels)
+
+    def label(self, node):
+        """Handle of the node at position `node`"""
+        if self.interner is not None:
+            return self.interner.handles[self.node_ids[node]]
+        return self.labels[node] if self.labels is not None else int(self.node_ids[node])
+
+    def index_of(self, key):
+        """Position of the node with a given handle or DID"""
+        if self.interner is not None:
+            node_id = self.interner.id_for(key)
+            matches = np.flatnonzero(self.node_ids == node_id) if node_id is not None else []
+        else:
+            matches = [i for i, label in enumerate(self.labels or []) if label == key]
+        if len(matches) == 0:
+            raise KeyError(f"Unknown account: {key}")
+        return int(matches[0])
+
+    def to_networkx(self):
+        """Convert to an nx.DiGraph keyed by the original node IDs (only when a caller needs NetworkX)"""
+        G = nx.DiGraph()
+        if self.interner is not None:
+            G.graph['interner'] = self.interner
+            keys = [int(node_id) for node_id in self.node_ids]
+        else:
+            keys = [self.label(i) for i in range(self.number_of_nodes())]
+        G.add_nodes_from((key, {'node_type': NODE_TYPES[t]}) for key, t in zip(keys, self.node_type))
+        coo = self.out_adj.tocoo()
+        G.add_edges_from(zip((keys[i] for i in coo.row), (keys[j] for j in coo.col)))
+        return G
@@ -0,0 +1,108 @@
+import os
+import json
+
+from async_crawler import call_with_retries_sync
+from rate_limit import TokenBucket
+
+SNAPSHOT_FILE = "crawl_snapshot.json"
+PROFILES_PER_REQUEST = 25  # Maximum number of actors accepted by app.bsky.actor.getProfiles
+
+
+def fetch_follows_counts(client, actors, limiter=None):
+    """
+    Current follows_count of many actors, 25 per app.bsky.actor.get_profiles request.
+
+    :param actors: DIDs or handles
+    :return: Dict mapping DID -> {'handle': ..., 'follows_count': ...}; actors
+             that no longer resolve (deleted, suspended) and actors of batches
+             that still failed after retries are left out
+    """
+    counts = {}
+    for start in range(0, len(actors), PROFILES_PER_REQUEST):
+        batch = actors[start:start + PROFILES_PER_REQUEST]
+        try:
+            response = call_with_retries_sync(client.app.bsky.actor.get_profiles, {'actors': batch},
+                                              limiter=limiter)
+        except Exception as e:
+            print(f"Error fetching profiles {start + 1}-{start + len(batch)}, "
+                  f"they are checked again on the next refresh: {str(e)}")
+            continue
+        for profile in response.profiles:
+            counts[profile.did] = {'handle': profile.handle, 'follows_count': profile.follows_count}
+    return counts
+
+
+def load_snapshot(output_dir):
+    """follows_count of every actor at the time its follows were last saved, by DID"""
+    path = os.path.join(output_dir, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_snapshot(output_dir, snapshot):
+    path = os.path.join(output_dir, SNAPSHOT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def changed_actors(snapshot, counts):
+    """
+    DIDs whose follows_count differs from the snapshot. Actors missing from
+    the snapshot are included: their saved list may predate any change.
+    """
+    return [did for did, current in counts.items()
+            if did not in snapshot or snapshot[did]['follows_count'] != current['follows_count']]
+
+
+def plan_refresh(client, following, output_dir, journal, rate_limit=8.0, saved=()):
+    """
+    Mark the accounts whose follow lists changed since the last crawl for refetching.
+
+    follows_count of every followed account, and of every deeper account in
+    `saved`, is fetched in bulk and compared with the snapshot; changed accounts
+    are reset in the journal, so the crawl re-paginates them from the first page,
+    while unchanged accounts are skipped as usual. Accounts without a snapshot
+    entry (all of them on the first refresh) are refetched too, since their
+    saved list may be out of date. Accounts whose count could not be fetched are
+    left as they are.
+
+    :param saved: Profiles of every account with a saved follow list (see
+                  crawl_store.saved_follow_lists); a 'did' is optional, the
+                  handle is looked up otherwise
+    :return: (counts, changed) where `changed` maps the DID of each changed account to its handle
+    """
+    print("\nChecking which follow lists changed...")
+    limiter = TokenBucket(rate_limit)
+    first_hop = {follow['did'] for follow in following} | {follow['handle'] for follow in following}
+    deeper = [profile for profile in saved
+              if profile.get('did') not in first_hop and profile['handle'] not in first_hop]
+    actors = [follow['did'] for follow in following] + [profile.get('did') or profile['handle'] for profile in deeper]
+    counts = fetch_follows_counts(client, actors, limiter)
+    snapshot = load_snapshot(output_dir)
+    # The journal and the saved files know an account by the handle it was crawled under
+    handles = {profile['did']: profile['handle'] for profile in following + deeper if 'did' in profile}
+    changed = {did: handles.get(did, counts[did]['handle']) for did in changed_actors(snapshot, counts)}
+    for handle in changed.values():
+        # Accounts already mid-pagination keep their progress; they are refetched anyway
+        if journal.state(handle) is None or journal.is_done(handle):
+            journal.reset(handle)
+    unknown = sum(1 for did in counts if did not in snapshot)
+    print(f"{len(changed)} of {len(counts)} follow lists changed or unknown ({unknown} without a snapshot yet)")
+    if len(counts) < len(actors):
+        print(f"{len(actors) - len(counts)} accounts were not found or could not be checked")
+    return counts, changed
+
+
+def update_snapshot(output_dir, journal, counts, changed):
+    """
+    Record the counts of every account that is now up to date; changed accounts
+    count only once fetched, and accounts whose count could not be fetched are not recorded.
+    """
+    snapshot = load_snapshot(output_dir)
+    for did, current in counts.items():
+        if did not in changed or journal.is_done(changed[did]):
+            snapshot[did] = current
+    save_snapshot(output_dir, snapshot)
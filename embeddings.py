@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import svds
+
+from csr_graph import CSRGraph
+from graph_snapshot import StringTable, read_manifest
+from metrics import hash_keys
+
+INDEX_VERSION = 1
+ARRAYS = ('source', 'target', 'singular_values', 'key_hashes', 'out_signatures', 'in_signatures',
+          'following_indptr', 'following_indices')
+
+
+def _node_keys(graph):
+    """Stable key (DID, or handle on non-interned graphs) and handle of every node"""
+    if graph.interner is not None:
+        keys = [graph.interner.dids[node_id] for node_id in graph.node_ids]
+    else:
+        keys = [str(graph.label(i)) for i in range(graph.number_of_nodes())]
+    return keys, [str(graph.label(i)) for i in range(graph.number_of_nodes())]
+
+
+def _normalized_adjacency(graph):
+    """Follow matrix scaled by D_out^-1/2 A D_in^-1/2, so popular accounts do not dominate every vector"""
+    A = sparse.csr_matrix(graph.out_adj, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        out_scale = np.where(graph.out_degree() > 0, 1 / np.sqrt(graph.out_degree()), 0.0)
+        in_scale = np.where(graph.in_degree() > 0, 1 / np.sqrt(graph.in_degree()), 0.0)
+    return (sparse.diags(out_scale) @ A @ sparse.diags(in_scale)).tocsr()
+
+
+def _row_signatures(indptr, indices, key_hashes):
+    """Order-independent hash of each row's neighbor keys, to find nodes whose follows changed"""
+    with np.errstate(over='ignore'):
+        mixed = key_hashes[indices] * np.uint64(0x9E3779B97F4A7C15)
+        cumulative = np.concatenate(([np.uint64(0)], np.cumsum(mixed, dtype=np.uint64)))
+        return cumulative[indptr[1:]] - cumulative[indptr[:-1]]
+
+
+def spectral_embedding(graph, dim=64, seed=42):
+    """
+    Truncated SVD of the degree-normalized follow matrix.
+
+    Every account gets a source vector (whom it follows) and a target vector
+    (who follows it); source_i . target_j estimates how likely i is to follow j.
+
+    :return: (source vectors, target vectors, singular values), largest singular value first
+    """
+    M = _normalized_adjacency(graph)
+    k = max(1, min(dim, min(M.shape) - 1))
+    v0 = np.random.default_rng(seed).uniform(-1, 1, min(M.shape))
+    U, S, Vt = svds(M, k=k, v0=v0)
+    order = np.argsort(-S)
+    U, S, Vt = U[:, order], S[order], Vt[order]
+    scale = np.sqrt(S)
+    return (U * scale).astype(np.float32), (Vt.T * scale).astype(np.float32), S.astype(np.float32)
+
+
+def _nearest_centroid(vectors, centroids, chunk_size=65536):
+    """Index of the nearest centroid (L2) of every vector, computed in chunks to bound memory"""
+    half_norms = (centroids ** 2).sum(axis=1) / 2
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size])
+        assignment[start:start + chunk_size] = np.argmax(chunk @ centroids.T - half_norms, axis=1)
+    return assignment
+
+
+def kmeans(vectors, num_clusters, seed=42, iterations=10, sample_size=256):
+    """Lloyd's k-means on a sample of at most `sample_size` vectors per cluster; returns the centroids"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample = vectors[np.sort(rng.choice(n, min(n, sample_size * num_clusters), replace=False))]
+    centroids = sample[rng.choice(len(sample), num_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = _nearest_centroid(sample, centroids)
+        counts = np.bincount(assignment, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        filled = counts > 0  # Empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class VectorIndex:
+    """
+    Inverted-file nearest-neighbor index over the rows of a matrix.
+
+    Vectors are grouped by their nearest k-means centroid and stored list by
+    list. A query scores the centroids, then only the vectors of the
+    `nprobe` best lists, by inner product. The arrays are .npy files that
+    are memory-mapped when the index is opened.
+    """
+
+    def __init__(self, centroids, offsets, rows, vectors):
+        self.centroids = centroids
+        self.offsets = offsets  # Vectors of list l are vectors[offsets[l]:offsets[l + 1]]
+        self.rows = rows  # Original row of each stored vector
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, vectors, centroids):
+        assignment = _nearest_centroid(vectors, centroids)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, offsets, order.astype(np.int64), np.ascontiguousarray(vectors[order]))
+
+    def save(self, prefix):
+        for name in ('centroids', 'offsets', 'rows', 'vectors'):
+            np.save(f"{prefix}_{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        return cls(*(np.load(f"{prefix}_{name}.npy", mmap_mode=mmap_mode)
+                     for name in ('centroids', 'offsets', 'rows', 'vectors')))
+
+    def search(self, query, k=10, nprobe=8, exclude=()):
+        """Rows with the largest inner product with `query`, as (rows, scores), best first"""
+        lists = np.argsort(-(self.centroids @ query))[:nprobe]
+        spans = [(self.offsets[l], self.offsets[l + 1]) for l in lists]
+        rows = np.concatenate([self.rows[start:end] for start, end in spans])
+        scores = np.concatenate([self.vectors[start:end] @ query for start, end in spans])
+        keep = ~np.isin(rows, np.asarray(list(exclude), dtype=np.int64))
+        rows, scores = rows[keep], scores[keep]
+        best = np.argsort(-scores, kind='stable')[:k]
+        return rows[best], scores[best]
+
+
+def _save_index(index_dir, graph, source, target, singular_values, keys, handles, dim, centroids=None, seed=42):
+    """Write the vectors, the two nearest-neighbor indexes and the manifest (last, as in compile_snapshot)"""
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    key_hashes = hash_keys(keys)
+    out_adj = graph.out_adj
+    out_adj.sort_indices()
+    arrays = {
+        'source': source, 'target': target, 'singular_values': singular_values, 'key_hashes': key_hashes,
+        'out_signatures': _row_signatures(out_adj.indptr, out_adj.indices, key_hashes),
+        'in_signatures': _row_signatures(graph.in_adj.indptr, graph.in_adj.indices, key_hashes),
+        'following_indptr': out_adj.indptr, 'following_indices': out_adj.indices,
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(index_dir, f"{name}.npy"), values)
+    StringTable.save(os.path.join(index_dir, 'keys'), keys)
+    StringTable.save(os.path.join(index_dir, 'handles'), handles)
+
+    # "Similar accounts" compares whole profiles (cosine of both vectors);
+    # "recommendations" ranks target vectors by inner product with a source vector
+    similar = _similarity_vectors(source, target)
+    if centroids is None:
+        nlist = int(np.clip(np.sqrt(len(keys)), 1, 4096))
+        centroids = (kmeans(similar, nlist, seed), kmeans(target, nlist, seed))
+    VectorIndex.build(similar, centroids[0]).save(os.path.join(index_dir, 'similar'))
+    VectorIndex.build(target, centroids[1]).save(os.path.join(index_dir, 'targets'))
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'nodes': len(keys), 'edges': graph.number_of_edges(),
+                   'dim': dim, 'lists': len(centroids[0])}, f, indent=2)
+
+
+def _similarity_vectors(source, target):
+    vectors = np.hstack((source, target))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+
+def build_index(graph, index_dir='output_data/embedding_index', dim=64, seed=42):
+    """
+    Embed every account and write the nearest-neighbor index.
+
+    :param graph: CSRGraph (e.g. from graph_snapshot.open_graph) or nx.DiGraph
+    """
+    graph = graph if isinstance(graph, CSRGraph) else CSRGraph.from_networkx(graph)
+    print(f"Embedding {graph.number_of_nodes()} accounts ({dim} dimensions)...")
+    source, target, singular_values = spectral_embedding(graph, dim, seed)
+    keys, handles = _node_keys(graph)
+    _save_index(index_dir, graph, source, target, singular_values, keys, handles, dim, seed=seed)
+    print(f"Embedding index written to '{index_dir}'")
+
+
+def update_index(graph, index_dir='output_data/embedding_index', dim=64, max_changed=0.2, seed=42):
+    """
+    Refresh the index after a re-crawl without a new SVD when the graph changed little.
+
+    Accounts whose follows or followers changed, and new accounts, are folded
+    into the existing embedding: their target vectors are projected from the
+    source vectors of their followers, then their source vectors from the
+    target vectors of the accounts they follow. Unchanged accounts keep their
+    vectors and the k-means centroids are reused. If more than `max_changed`
+    of the accounts changed, or there is no index yet (or it was built with
+    another `dim` or INDEX_VERSION), the index is rebuilt.
+
+    :return: Number of accounts that were re-embedded
+    """
+    graph = graph if isinstance(graph, CSRGraph) else CSRGraph.from_networkx(graph)
+    manifest = read_manifest(index_dir)
+    if manifest is None or manifest['version'] != INDEX_VERSION or manifest['dim'] != dim:
+        build_index(graph, index_dir, dim, seed)
+        return graph.number_of_nodes()
+    old = {name: np.load(os.path.join(index_dir, f"{name}.npy")) for name in ARRAYS}
+
+    keys, handles = _node_keys(graph)
+    key_hashes = hash_keys(keys)
+    order = np.argsort(old['key_hashes'])
+    position = np.minimum(np.searchsorted(old['key_hashes'][order], key_hashes), len(order) - 1)
+    found = old['key_hashes'][order][position] == key_hashes
+    old_row = np.where(found, order[position], -1)
+
+    out_adj, in_adj = graph.out_adj, graph.in_adj
+    out_adj.sort_indices()
+    out_signatures = _row_signatures(out_adj.indptr, out_adj.indices, key_hashes)
+    in_signatures = _row_signatures(in_adj.indptr, in_adj.indices, key_hashes)
+    changed = ~found
+    changed[found] = ((old['out_signatures'][old_row[found]] != out_signatures[found])
+                      | (old['in_signatures'][old_row[found]] != in_signatures[found]))
+    share = changed.mean() if len(changed) else 0.0
+    if share > max_changed:
+        print(f"{share:.1%} of accounts changed, rebuilding the embedding index")
+        build_index(graph, index_dir, dim, seed)
+        return graph.number_of_nodes()
+
+    singular_values = old['singular_values']
+    source = np.zeros((len(keys), len(singular_values)), dtype=np.float32)
+    target = np.zeros_like(source)
+    source[found] = old['source'][old_row[found]]
+    target[found] = old['target'][old_row[found]]
+    # M ~= source @ target.T with source = U sqrt(S), target = V sqrt(S), so a row m of M
+    # folds in as m @ target / S (and a column as m.T @ source / S)
+    M = _normalized_adjacency(graph)
+    rows = np.flatnonzero(changed)
+    target[rows] = (M[:, rows].T @ source) / singular_values
+    source[rows] = (M[rows] @ target) / singular_values
+    print(f"Folded {len(rows)} changed or new accounts ({share:.1%}) into the embedding index")
+
+    centroids = (np.load(os.path.join(index_dir, 'similar_centroids.npy')),
+                 np.load(os.path.join(index_dir, 'targets_centroids.npy')))
+    _save_index(index_dir, graph, source, target, singular_values, keys, handles, dim, centroids, seed)
+    return len(rows)
+
+
+class EmbeddingIndex:
+    """Memory-mapped embedding index answering similar-account and recommendation queries"""
+
+    def __init__(self, index_dir='output_data/embedding_index', mmap_mode='r'):
+        manifest_path = os.path.join(index_dir, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No embedding index in '{index_dir}'")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.source = np.load(os.path.join(index_dir, 'source.npy'), mmap_mode=mmap_mode)
+        self.target = np.load(os.path.join(index_dir, 'target.npy'), mmap_mode=mmap_mode)
+        self.following_indptr = np.load(os.path.join(index_dir, 'following_indptr.npy'), mmap_mode=mmap_mode)
+        self.following_indices = np.load(os.path.join(index_dir, 'following_indices.npy'), mmap_mode=mmap_mode)
+        self.keys = StringTable.load(os.path.join(index_dir, 'keys'), mmap_mode)
+        self.handles = StringTable.load(os.path.join(index_dir, 'handles'), mmap_mode)
+        self.similar_index = VectorIndex.load(os.path.join(index_dir, 'similar'), mmap_mode)
+        self.targets_index = VectorIndex.load(os.path.join(index_dir, 'targets'), mmap_mode)
+        self._rows = None
+
+    def row_of(self, account):
+        """Row of an account given by DID or handle"""
+        if self._rows is None:
+            # Handles first, so a DID wins if a handle ever equals another account's DID
+            self._rows = {handle: i for i, handle in enumerate(self.handles)}
+            self._rows.update((key, i) for i, key in enumerate(self.keys))
+        if account not in self._rows:
+            raise KeyError(f"Unknown account: {account}")
+        return self._rows[account]
+
+    def _results(self, rows, scores):
+        return [(self.handles[row], float(score)) for row, score in zip(rows, scores)]
+
+    def similar(self, account, k=10, nprobe=8):
+        """Accounts whose follows and followers look most like those of `account`, as (handle, cosine) pairs"""
+        row = self.row_of(account)
+        query = _similarity_vectors(self.source[row:row + 1], self.target[row:row + 1])[0]
+        return self._results(*self.similar_index.search(query, k, nprobe, exclude=[row]))
+
+    def recommend(self, account, k=10, nprobe=8):
+        """
+        Accounts `account` is most likely to follow but does not yet, as (handle, score) pairs.
+
+        Accounts whose follows were not crawled have no source vector; for them
+        the accounts most often followed together with them are returned.
+        """
+        row = self.row_of(account)
+        followed = self.following_indices[self.following_indptr[row]:self.following_indptr[row + 1]]
+        query = np.asarray(self.source[row])
+        if not query.any():
+            query = np.asarray(self.target[row])
+        return self._results(*self.targets_index.search(query, k, nprobe, exclude=np.append(followed, row)))
+
+
+if __name__ == "__main__":
+    from graph_snapshot import open_graph
+
+    # Embed the extended network; after a re-crawl only the changed accounts are re-embedded
+    graph = open_graph('bluesky_data/following.json', 'bluesky_data/following_network', include_secondary_follows=True)
+    update_index(graph)
+
+    index = EmbeddingIndex()
+    start = time.perf_counter()
+    recommendations = index.recommend("user")
+    print(f"\nRecommended accounts for user ({(time.perf_counter() - start) * 1000:.1f} ms):")
+    for handle, score in recommendations:
+        print(handle, round(score, 4))
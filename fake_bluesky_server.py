@@ -0,0 +1,348 @@
+import os
+import json
+import time
+import base64
+import random
+import zlib
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bluesky_client import BASE_URL_VARIABLE
+
+MAX_PAGE = 100
+MAX_PROFILES = 25
+
+
+class FakeDataset:
+    """
+    Accounts, follow lists and posts served by FakeBlueskyServer.
+
+    Profiles are kept as saved by bluesky_download.py (snake_case
+    model_dump() dicts) and converted to XRPC JSON when served.
+    """
+
+    def __init__(self, profiles, follows, root_did, posts_per_actor=30):
+        self.profiles = profiles  # DID -> profile dict
+        self.follows = follows  # DID -> list of followed DIDs (only for crawled accounts)
+        self.root_did = root_did
+        self.posts_per_actor = posts_per_actor
+        self.handles = {profile['handle']: did for did, profile in profiles.items()}
+        self.followers = {}
+        for src, targets in follows.items():
+            for dst in targets:
+                self.followers.setdefault(dst, []).append(src)
+
+    @classmethod
+    def from_crawl(cls, data_dir, posts_per_actor=30):
+        """Replay a recorded crawl: profile.json, following.json and following_network/*.json"""
+        profiles = {}
+        root = {'did': 'did:plc:fakeroot', 'handle': 'root.fake.test'}
+        profile_path = os.path.join(data_dir, "profile.json")
+        if os.path.exists(profile_path):
+            with open(profile_path, "r", encoding="utf-8") as f:
+                root = json.load(f)
+        profiles[root['did']] = root
+
+        with open(os.path.join(data_dir, "following.json"), "r", encoding="utf-8") as f:
+            following = json.load(f)
+        profiles.update((profile['did'], profile) for profile in following)
+        follows = {root['did']: [profile['did'] for profile in following]}
+
+        handles = {profile['handle']: profile['did'] for profile in following}
+        network_dir = os.path.join(data_dir, "following_network")
+        for filename in sorted(os.listdir(network_dir)):
+            if not filename.endswith('.json'):
+                continue
+            handle = filename[:-len('.json')]
+            did = handles.get(handle, f"did:fake:{handle}")
+            profiles.setdefault(did, {'did': did, 'handle': handle})
+            with open(os.path.join(network_dir, filename), "r", encoding="utf-8") as f:
+                followees = json.load(f)
+            for profile in followees:
+                profiles.setdefault(profile['did'], profile)
+            follows[did] = [profile['did'] for profile in followees]
+        return cls(profiles, follows, root['did'], posts_per_actor)
+
+    @classmethod
+    def synthetic(cls, num_edges, seed=42, posts_per_actor=30):
+        """A power-law dataset generated with benchmark.generate_dataset"""
+        from benchmark import generate_dataset
+        with tempfile.TemporaryDirectory() as data_dir:
+            generate_dataset(data_dir, num_edges, seed=seed)
+            return cls.from_crawl(data_dir, posts_per_actor)
+
+    def resolve(self, actor):
+        """DID of an actor given by DID or handle, or None"""
+        if actor in self.profiles:
+            return actor
+        return self.handles.get(actor)
+
+    def profile_view(self, did, detailed=False):
+        profile = self.profiles[did]
+        view = {
+            'did': did,
+            'handle': profile['handle'],
+            'displayName': profile.get('display_name'),
+            'description': profile.get('description'),
+            'createdAt': profile.get('created_at'),
+            'indexedAt': profile.get('indexed_at'),
+        }
+        if detailed:
+            view.update(
+                followersCount=len(self.followers.get(did, [])),
+                followsCount=len(self.follows[did]) if did in self.follows else profile.get('follows_count', 0),
+                postsCount=self.posts_per_actor,
+            )
+        return {key: value for key, value in view.items() if value is not None}
+
+    def post_view(self, did, k):
+        handle = self.profiles[did]['handle']
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1700000000 - k * 3600))
+        return {
+            'post': {
+                'uri': f"at://{did}/app.bsky.feed.post/fake{k}",
+                'cid': f"bafyfake{zlib.crc32(f'{did}/{k}'.encode('utf-8')):08x}",
+                'author': {'did': did, 'handle': handle},
+                'record': {'$type': 'app.bsky.feed.post', 'text': f"Post {k} by {handle}", 'createdAt': created_at},
+                'indexedAt': created_at,
+                'likeCount': k % 7,
+                'repostCount': k % 3,
+                'replyCount': 0,
+            }
+        }
+
+
+def _fake_jwt(did):
+    """Unsigned JWT the client can decode; it expires in a year, so the client never refreshes it"""
+    def encode(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).rstrip(b'=').decode('ascii')
+    now = int(time.time())
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode({'sub': did, 'iat': now, 'exp': now + 365 * 86400, 'scope': 'com.atproto.access'})}.fake"
+
+
+class FakeBlueskyServer:
+    """
+    Local XRPC server that answers the requests made by the crawlers from a FakeDataset.
+
+    Serves com.atproto.server.createSession, app.bsky.actor.getProfile(s),
+    app.bsky.graph.getFollows/getFollowers and app.bsky.feed.getAuthorFeed
+    with cursor pagination. Faults can be injected: a fixed `latency` (plus
+    random `jitter`) per request, 429 responses above `rate_limit` requests
+    per second or with probability `rate_limit_probability`, responses with
+    one of `error_statuses` with probability `error_probability`, and with
+    probability `timeout_probability` a stall of `stall` seconds after which
+    the connection is closed unanswered (set the client timeout below it);
+    session requests and the logged-in account's own getProfile (made by
+    login) are never faulted. Requests are counted per method and status in
+    `stats`, stalls under the status 'timeout'.
+    """
+
+    def __init__(self, dataset, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, rate_limit=None,
+                 rate_limit_probability=0.0, error_probability=0.0, error_statuses=(502, 503),
+                 timeout_probability=0.0, stall=10.0, seed=42):
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_limit_probability = rate_limit_probability
+        self.error_probability = error_probability
+        self.error_statuses = error_statuses
+        self.timeout_probability = timeout_probability
+        self.stall = stall
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit or 0.0
+        self._updated = time.monotonic()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/xrpc"
+
+    def start(self):
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _is_login(self, method, params):
+        """True for session calls and for the profile lookup of the logged-in (root) account"""
+        if method.startswith('com.atproto.server.'):
+            return True
+        return (method == 'app.bsky.actor.getProfile'
+                and self.dataset.resolve(params.get('actor', [''])[0]) == self.dataset.root_did)
+
+    def _fault(self):
+        """Status code of an injected fault for the next request, 'timeout' for a stall, or None"""
+        with self._lock:
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._updated) * self.rate_limit)
+                self._updated = now
+                if self._tokens < 1:
+                    return 429
+                self._tokens -= 1
+            draw = self._random.random()
+            error_status = self._random.choice(self.error_statuses)
+        if draw < self.rate_limit_probability:
+            return 429
+        draw -= self.rate_limit_probability
+        if draw < self.error_probability:
+            return error_status
+        if draw - self.error_probability < self.timeout_probability:
+            return 'timeout'
+        return None
+
+    def _delay(self):
+        """Latency of the next response; the jitter is drawn under the lock so seeded runs repeat"""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def handle(self, method, params, body):
+        """Return (status, JSON body) of one XRPC call"""
+        data = self.dataset
+        if method == 'com.atproto.server.createSession':
+            did = data.resolve(body.get('identifier', '')) or data.root_did
+            return 200, {'did': did, 'handle': data.profiles[did]['handle'], 'accessJwt': _fake_jwt(did),
+                         'refreshJwt': _fake_jwt(did), 'active': True}
+        if method in ('com.atproto.server.getSession', 'com.atproto.server.refreshSession'):
+            did = data.root_did
+            return 200, {'did': did, 'handle': data.profiles[did]['handle'], 'accessJwt': _fake_jwt(did),
+                         'refreshJwt': _fake_jwt(did), 'active': True}
+
+        if method == 'app.bsky.actor.getProfiles':
+            actors = params.get('actors', [])
+            if len(actors) > MAX_PROFILES:
+                return 400, {'error': 'InvalidRequest', 'message': f"At most {MAX_PROFILES} actors"}
+            dids = [data.resolve(actor) for actor in actors]
+            return 200, {'profiles': [data.profile_view(did, detailed=True) for did in dids if did]}
+
+        did = data.resolve(params.get('actor', [''])[0])
+        if did is None:
+            return 400, {'error': 'InvalidRequest', 'message': 'Profile not found'}
+        if method == 'app.bsky.actor.getProfile':
+            return 200, data.profile_view(did, detailed=True)
+
+        limit = min(int(params.get('limit', ['50'])[0]), MAX_PAGE)
+        offset = int(params.get('cursor', ['0'])[0])
+        if method in ('app.bsky.graph.getFollows', 'app.bsky.graph.getFollowers'):
+            key = 'follows' if method.endswith('Follows') else 'followers'
+            accounts = (data.follows if key == 'follows' else data.followers).get(did, [])
+            page = accounts[offset:offset + limit]
+            response = {'subject': data.profile_view(did), key: [data.profile_view(other) for other in page]}
+            total = len(accounts)
+        elif method == 'app.bsky.feed.getAuthorFeed':
+            page = range(offset, min(offset + limit, data.posts_per_actor))
+            response = {'feed': [data.post_view(did, k) for k in page]}
+            total = data.posts_per_actor
+        else:
+            return 501, {'error': 'MethodNotImplemented', 'message': f"{method} is not served by the fake server"}
+        if offset + limit < total:
+            response['cursor'] = str(offset + limit)
+        return 200, response
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _serve(self, body):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        method = url.path.rsplit('/', 1)[-1]
+        delay = fake._delay()
+        if delay:
+            time.sleep(delay)
+
+        # Logging in is not retried by the crawlers, so faults only hit the data endpoints; login
+        # includes the session's own getProfile (Client.login and login(session_string=...))
+        status = None if fake._is_login(method, parse_qs(url.query)) else fake._fault()
+        headers = {}
+        if status == 'timeout':
+            with fake._lock:
+                fake.stats[(method, status)] += 1
+            time.sleep(fake.stall)
+            self.close_connection = True  # The client gave up by now
+            return
+        if status == 429:
+            response = {'error': 'RateLimitExceeded', 'message': 'Rate Limit Exceeded'}
+            headers = {'RateLimit-Limit': str(int(fake.rate_limit or 0)), 'RateLimit-Remaining': '0',
+                       'RateLimit-Reset': str(int(time.time()) + 1)}
+        elif status is not None:
+            response = {'error': 'InternalServerError', 'message': 'Injected error'}
+        else:
+            status, response = fake.handle(method, parse_qs(url.query), body)
+        with fake._lock:
+            fake.stats[(method, status)] += 1
+
+        payload = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._serve({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        self._serve(json.loads(raw) if raw else {})
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown the crawler output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a recorded or synthetic dataset as a fake Bluesky XRPC API")
+    parser.add_argument('--data-dir', help="Recorded crawl to replay (bluesky_download.py layout)")
+    parser.add_argument('--synthetic-edges', type=int, default=10000, help="Size of a generated dataset")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument('--rate-limit', type=float, help="Requests per second before answering 429")
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0)
+    parser.add_argument('--error-probability', type=float, default=0.0, help="Probability of a 502 or 503")
+    parser.add_argument('--timeout-probability', type=float, default=0.0,
+                        help="Probability of stalling a request until the client times out")
+    parser.add_argument('--stall', type=float, default=10.0, help="Seconds a stalled request is held")
+    args = parser.parse_args()
+
+    dataset = FakeDataset.from_crawl(args.data_dir) if args.data_dir else FakeDataset.synthetic(args.synthetic_edges)
+    server = FakeBlueskyServer(dataset, port=args.port, latency=args.latency, jitter=args.jitter,
+                               rate_limit=args.rate_limit, rate_limit_probability=args.rate_limit_probability,
+                               error_probability=args.error_probability,
+                               timeout_probability=args.timeout_probability, stall=args.stall)
+    print(f"Serving {len(dataset.profiles)} accounts and {sum(len(v) for v in dataset.follows.values())} follows")
+    print(f"Point the crawlers at it with: export {BASE_URL_VARIABLE}={server.base_url}")
+    print(f"Log in as {dataset.profiles[dataset.root_did]['handle']} with any password")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for (method, status), count in sorted(server.stats.items()):
+            print(f"{method} {status}: {count}")
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+
+from async_crawler import get_follows_for_user_async
+from bluesky_client import create_async_client, create_client
+from build_graph import load_network_data, load_network_data_from_store
+from crawl_journal import CrawlJournal
+from crawl_store import CrawlStore, save_actor_follows
+from instrumentation import save_metrics, stage
+from rate_limit import TokenBucket
+
+
+class Frontier:
+    """
+    Accounts whose follows are not crawled yet, best candidate first.
+
+    Candidates are ordered by depth (hops from the source user), then by
+    priority: the number of already crawled accounts that follow them. Each
+    account is held once, keyed by DID, however many times it is discovered.
+    """
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.priority = {}
+        self.depth = {}
+        self.profiles = {}
+        self.crawled = set()
+        self._pending = set()
+        self._heap = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, profile, depth):
+        """Record that a crawled account at depth - 1 follows `profile`"""
+        did = profile['did']
+        if did in self.crawled or depth > self.max_depth:
+            return
+        self.priority[did] = self.priority.get(did, 0) + 1
+        self.depth[did] = min(self.depth.get(did, depth), depth)
+        self.profiles.setdefault(did, profile)
+        self._pending.add(did)
+        # Outdated heap entries are skipped in pop()
+        heapq.heappush(self._heap, (self.depth[did], -self.priority[did], did))
+
+    def mark_crawled(self, did):
+        self.crawled.add(did)
+        self._pending.discard(did)
+
+    def pop(self):
+        """Take the best pending candidate: (profile, depth), or None when the frontier is empty"""
+        while self._heap:
+            depth, priority, did = heapq.heappop(self._heap)
+            if did in self._pending and (depth, -priority) == (self.depth[did], self.priority[did]):
+                self.mark_crawled(did)
+                return self.profiles[did], depth
+        return None
+
+
+def build_frontier(following, network_data, max_depth=2):
+    """
+    Rebuild the frontier from the follow lists saved so far.
+
+    Walks breadth-first from the accounts in `following` (depth 1) through the
+    saved follow lists: every saved account counts as crawled and every
+    account it follows becomes a candidate one hop deeper.
+    """
+    frontier = Frontier(max_depth)
+    queue = []
+    for profile in following:
+        frontier.add(profile, 1)
+        queue.append((profile, 1))
+    seen = {profile['did'] for profile in following}
+    for profile, depth in queue:  # The list grows while it is walked
+        follows = network_data.get(profile['handle'])
+        if follows is None:
+            continue
+        frontier.mark_crawled(profile['did'])
+        for follow in follows:
+            frontier.add(follow, depth + 1)
+            if follow['did'] not in seen:
+                seen.add(follow['did'])
+                queue.append((follow, depth + 1))
+    return frontier
+
+
+class RequestBudget:
+    """Wraps a TokenBucket and counts the requests made through it against a request and time budget"""
+
+    def __init__(self, limiter, max_requests=None, max_seconds=None):
+        self.limiter = limiter
+        self.max_requests = max_requests
+        self.max_seconds = max_seconds
+        self.requests = 0
+        self.started = time.monotonic()
+
+    async def acquire_async(self):
+        self.requests += 1
+        return await self.limiter.acquire_async()
+
+    def exhausted(self):
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        return self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds
+
+
+async def crawl_frontier_async(client, frontier, output_dir, journal, store=None, budget=None, concurrency=8):
+    """
+    Crawl the frontier in priority order until it is empty or the budget is spent.
+
+    No new account is started once the budget is exhausted; accounts already
+    in flight finish, so the budget can be exceeded by their remaining pages.
+    The follows of each crawled account are added to the frontier one hop deeper.
+
+    :return: Number of accounts crawled
+    """
+    budget = budget or RequestBudget(TokenBucket(8.0))
+    condition = asyncio.Condition()
+    in_flight = 0
+    crawled = 0
+
+    async def worker():
+        nonlocal in_flight, crawled
+        while True:
+            async with condition:
+                # An empty frontier may still grow from the accounts in flight
+                while not frontier and in_flight and not budget.exhausted():
+                    await condition.wait()
+                if budget.exhausted() or not frontier:
+                    condition.notify_all()
+                    return
+                profile, depth = frontier.pop()
+                in_flight += 1
+            handle = profile['handle']
+            print(f"Processing {handle} (depth {depth}, followed by {frontier.priority[profile['did']]} "
+                  f"crawled accounts, {len(frontier)} in frontier)")
+            follows, complete = await get_follows_for_user_async(client, handle, budget, journal)
+            async with condition:
+                in_flight -= 1
+                if complete:
+                    save_actor_follows(output_dir, store, profile, follows)
+                    journal.mark_done(handle)
+                    for follow in follows:
+                        frontier.add(follow, depth + 1)
+                    crawled += 1
+                else:
+                    print(f"Follows for {handle} are incomplete, they will be resumed on the next run")
+                condition.notify_all()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return crawled
+
+
+def crawl_frontier(session_string, output_dir='bluesky_data', store_path=None, max_depth=2, max_requests=1000,
+                   max_seconds=None, concurrency=8, rate_limit=8.0):
+    """
+    Extend a finished one-hop crawl to `max_depth` hops, most followed accounts first.
+
+    Secondary accounts are crawled in order of how many crawled accounts
+    follow them, so the best connected part of the extended graph gets real
+    outgoing edges first. Runs can be repeated: the frontier is rebuilt from
+    the saved follow lists, and interrupted accounts resume from the journal.
+
+    :param session_string: Session of a logged-in client (Client.export_session_string())
+    :param output_dir: Data directory of bluesky_download.py
+    :param store_path: Crawl store to read from and save to instead of following_network/*.json
+    :param max_requests: Stop starting new accounts after this many get_follows requests
+    :param max_seconds: Stop starting new accounts after this many seconds
+    """
+    with open(os.path.join(output_dir, "following.json"), "r", encoding="utf-8") as f:
+        following = json.load(f)
+    if store_path:
+        _, network_data = load_network_data_from_store(store_path)
+    else:
+        _, network_data = load_network_data(os.path.join(output_dir, "following.json"),
+                                            os.path.join(output_dir, "following_network"))
+    frontier = build_frontier(following, network_data, max_depth)
+    print(f"{len(frontier.crawled)} accounts crawled, {len(frontier)} in the frontier (max depth {max_depth})")
+
+    journal = CrawlJournal(output_dir)
+    store = CrawlStore(store_path) if store_path else None
+    budget = RequestBudget(TokenBucket(rate_limit), max_requests, max_seconds)
+
+    async def run():
+        client = create_async_client()
+        await client.login(session_string=session_string)
+        return await crawl_frontier_async(client, frontier, output_dir, journal, store, budget, concurrency)
+
+    try:
+        crawled = asyncio.run(run())
+    finally:
+        if store is not None:
+            store.close()
+    print(f"\nCrawled {crawled} accounts with {budget.requests} requests; {len(frontier)} left in the frontier")
+    return crawled
+
+
+if __name__ == "__main__":
+    username = input("Enter your Bluesky handle (e.g., username.bsky.social): ").strip()
+    password = input("Enter your Bluesky App Password (create one at Settings > App Passwords): ").strip()
+    client = create_client()
+    client.login(username, password)
+    with stage('crawl_frontier'):
+        crawl_frontier(client.export_session_string())
+    save_metrics('frontier_crawl')
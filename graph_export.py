@@ -0,0 +1,289 @@
+import os
+import re
+import gzip
+from itertools import islice
+from xml.sax.saxutils import escape, quoteattr
+
+from crawl_store import PROFILE_FIELDS, CrawlStore
+from csr_graph import NODE_TYPES, CSRGraph
+from metrics import stable_key
+from interning import node_attributes
+
+# Output format by file extension (a trailing .gz compresses any text format)
+FORMATS = {
+    '.graphml': 'graphml',
+    '.gexf': 'gexf',
+    '.tsv': 'edgelist',
+    '.edgelist': 'edgelist',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+}
+
+# Characters that are not allowed in XML 1.0 (they do turn up in profile descriptions)
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _clean(value):
+    """Attribute value as written: None becomes an empty string, invalid XML characters are dropped"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return _INVALID_XML.sub('', value)
+    return value
+
+
+def _field_type(types):
+    """Python type of an attribute column (bool, int, float or str) from the set of value types seen in it"""
+    types = types - {type(None)}
+    if not types or not types <= {bool, int, float}:
+        return str
+    if types == {bool}:
+        return bool
+    return float if float in types else int
+
+
+def _batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+class _Tables:
+    """
+    Node and edge streams of a graph, read without copying it.
+
+    `nodes()` yields (key, attributes) pairs and `edges()` yields lists of
+    (source key, target key) pairs; both can be iterated more than once. Node
+    keys are stable across runs: DIDs where known, handles otherwise.
+    """
+
+    def __init__(self, fields, nodes, edges):
+        self.fields = fields  # Attribute name -> Python type
+        self.nodes = nodes
+        self.edges = edges
+
+
+def _networkx_tables(G, batch_size):
+    def nodes():
+        for node in G.nodes():
+            yield str(stable_key(G, node)), node_attributes(G, node)
+
+    def edges():
+        pairs = ((str(stable_key(G, u)), str(stable_key(G, v))) for u, v in G.edges())
+        yield from _batched(pairs, batch_size)
+
+    # One pass to declare attribute types up front, as GraphML and GEXF require;
+    # only the set of value types per attribute is kept, not the values
+    column_types = {}
+    for _, attributes in nodes():
+        for name, value in attributes.items():
+            column_types.setdefault(name, set()).add(type(value))
+    fields = {name: _field_type(types) for name, types in column_types.items()}
+    return _Tables(fields, nodes, edges)
+
+
+def _csr_tables(G, batch_size):
+    keys = [str(G.interner.dids[node_id]) if G.interner is not None else str(G.label(i))
+            for i, node_id in enumerate(G.node_ids)]
+
+    def nodes():
+        for i, key in enumerate(keys):
+            attributes = G.interner.attributes(G.node_ids[i]) if G.interner is not None else {}
+            attributes['node_type'] = NODE_TYPES[G.node_type[i]]
+            yield key, attributes
+
+    def edges():
+        coo = G.out_adj.tocoo()
+        for start in range(0, coo.nnz, batch_size):
+            rows, cols = coo.row[start:start + batch_size], coo.col[start:start + batch_size]
+            yield [(keys[u], keys[v]) for u, v in zip(rows, cols)]
+
+    fields = dict.fromkeys(('did', 'handle', 'display_name', 'description') if G.interner is not None else (), str)
+    fields['node_type'] = str
+    return _Tables(fields, nodes, edges)
+
+
+def _store_tables(store, batch_size):
+    root = store.root_did()
+
+    def nodes():
+        for profiles in store.iter_profiles(batch_size):
+            for profile in profiles:
+                profile['node_type'] = 'source' if profile['did'] == root else 'following'
+                yield profile['did'], profile
+
+    def edges():
+        yield from store.iter_did_edges(batch_size)
+
+    return _Tables({**dict.fromkeys(PROFILE_FIELDS, str), 'node_type': str}, nodes, edges)
+
+
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='\n')
+    return open(path, 'w', encoding='utf-8', newline='\n')
+
+
+XML_TYPES = {bool: 'boolean', int: 'long', float: 'double', str: 'string'}
+
+
+def write_graphml(tables, path):
+    """Write GraphML element by element, like nx.write_graphml but without building the XML tree"""
+    with _open_text(path) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+                'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+        key_ids = {}
+        for name, kind in tables.fields.items():
+            key_ids[name] = f"d{len(key_ids)}"
+            f.write(f'  <key id="{key_ids[name]}" for="node" attr.name={quoteattr(name)} '
+                    f'attr.type="{XML_TYPES[kind]}" />\n')
+        f.write('  <graph edgedefault="directed">\n')
+        for key, attributes in tables.nodes():
+            f.write(f'    <node id={quoteattr(_clean(key))}>\n')
+            for name, value in attributes.items():
+                if value is None and tables.fields[name] is not str:
+                    continue  # Missing numbers are left out rather than written as ""
+                value = str(_clean(value)).lower() if tables.fields[name] is bool else str(_clean(value))
+                f.write(f'      <data key="{key_ids[name]}">{escape(value)}</data>\n')
+            f.write('    </node>\n')
+        for edges in tables.edges():
+            f.write(''.join(f'    <edge source={quoteattr(_clean(u))} target={quoteattr(_clean(v))} />\n'
+                            for u, v in edges))
+        f.write('  </graph>\n</graphml>\n')
+
+
+def write_gexf(tables, path):
+    """Write GEXF 1.2 (Gephi's native format); handles are used as node labels"""
+    with _open_text(path) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n')
+        f.write('  <graph defaultedgetype="directed" mode="static">\n')
+        f.write('    <attributes class="node" mode="static">\n')
+        attribute_ids = {}
+        for name, kind in tables.fields.items():
+            attribute_ids[name] = str(len(attribute_ids))
+            f.write(f'      <attribute id="{attribute_ids[name]}" title={quoteattr(name)} '
+                    f'type="{XML_TYPES[kind]}" />\n')
+        f.write('    </attributes>\n    <nodes>\n')
+        for key, attributes in tables.nodes():
+            label = attributes.get('handle') or key
+            f.write(f'      <node id={quoteattr(_clean(key))} label={quoteattr(_clean(label))}>\n')
+            f.write('        <attvalues>\n')
+            for name, value in attributes.items():
+                if value is None and tables.fields[name] is not str:
+                    continue
+                value = str(_clean(value)).lower() if tables.fields[name] is bool else str(_clean(value))
+                f.write(f'          <attvalue for="{attribute_ids[name]}" value={quoteattr(value)} />\n')
+            f.write('        </attvalues>\n      </node>\n')
+        f.write('    </nodes>\n    <edges>\n')
+        edge_id = 0
+        for edges in tables.edges():
+            lines = []
+            for u, v in edges:
+                lines.append(f'      <edge id="{edge_id}" source={quoteattr(_clean(u))} '
+                             f'target={quoteattr(_clean(v))} />\n')
+                edge_id += 1
+            f.write(''.join(lines))
+        f.write('    </edges>\n  </graph>\n</gexf>\n')
+
+
+def write_edgelist(tables, path):
+    """Write one tab-separated `source<TAB>target` line per follow (node attributes are not included)"""
+    with _open_text(path) as f:
+        for edges in tables.edges():
+            f.write(''.join(f"{u}\t{v}\n" for u, v in edges))
+
+
+def _arrow_writers(tables, path, batch_size, open_writer):
+    """Stream node and edge tables to `<name>.nodes<ext>` and `<name>.edges<ext>`"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("Parquet and Arrow export need pyarrow (pip install pyarrow)")
+
+    base, ext = os.path.splitext(path)
+    arrow_types = {bool: pa.bool_(), int: pa.int64(), float: pa.float64(), str: pa.string()}
+    node_schema = pa.schema([('id', pa.string())] + [(name, arrow_types[kind]) for name, kind in tables.fields.items()])
+    edge_schema = pa.schema([('source', pa.string()), ('target', pa.string())])
+
+    with open_writer(f"{base}.nodes{ext}", node_schema) as writer:
+        for batch in _batched(tables.nodes(), batch_size):
+            columns = {'id': [key for key, _ in batch]}
+            for name in tables.fields:
+                columns[name] = [attributes.get(name) for _, attributes in batch]
+            writer.write_table(pa.table(columns, schema=node_schema))
+    with open_writer(f"{base}.edges{ext}", edge_schema) as writer:
+        for edges in tables.edges():
+            writer.write_table(pa.table({'source': [u for u, _ in edges], 'target': [v for _, v in edges]},
+                                        schema=edge_schema))
+
+
+def write_parquet(tables, path, batch_size=100000):
+    import pyarrow.parquet as pq
+    _arrow_writers(tables, path, batch_size, lambda name, schema: pq.ParquetWriter(name, schema))
+
+
+def write_arrow(tables, path, batch_size=100000):
+    import pyarrow.ipc as ipc
+    _arrow_writers(tables, path, batch_size, lambda name, schema: ipc.new_file(name, schema))
+
+
+def output_format(path):
+    """Format name implied by the file extension, ignoring a trailing .gz"""
+    ext = os.path.splitext(path[:-len('.gz')] if path.endswith('.gz') else path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unknown export format for '{path}' (expected one of {', '.join(sorted(FORMATS))})")
+    return FORMATS[ext]
+
+
+def _write(tables, output_file, format, batch_size):
+    format = format or output_format(output_file)
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    if format == 'graphml':
+        write_graphml(tables, output_file)
+    elif format == 'gexf':
+        write_gexf(tables, output_file)
+    elif format == 'edgelist':
+        write_edgelist(tables, output_file)
+    elif format == 'parquet':
+        write_parquet(tables, output_file, batch_size)
+    elif format == 'arrow':
+        write_arrow(tables, output_file, batch_size)
+    else:
+        raise ValueError(f"Unknown export format: {format}")
+    print(f"\nNetwork data exported to '{output_file}'")
+
+
+def export_graph(G, output_file, format=None, batch_size=100000):
+    """
+    Stream a graph to disk without copying it.
+
+    Attributes are cleaned as they are written (None becomes "", characters
+    invalid in XML are dropped). Parquet and Arrow exports write two tables,
+    e.g. network.nodes.parquet and network.edges.parquet, and need pyarrow.
+
+    :param G: nx.DiGraph (handle-keyed or interned) or CSRGraph
+    :param output_file: Path whose extension picks the format (.graphml, .gexf, .tsv.gz, .parquet, .arrow)
+    :param format: Override the format: 'graphml', 'gexf', 'edgelist', 'parquet' or 'arrow'
+    """
+    tables = _csr_tables(G, batch_size) if isinstance(G, CSRGraph) else _networkx_tables(G, batch_size)
+    _write(tables, output_file, format, batch_size)
+
+
+def export_store(store_path, output_file, format=None, batch_size=100000):
+    """Stream every actor and follow of a crawl store to disk, without building a graph first"""
+    with CrawlStore(store_path) as store:
+        _write(_store_tables(store, batch_size), output_file, format, batch_size)
+
+
+if __name__ == "__main__":
+    store_path = 'bluesky_data/crawl.sqlite'
+    for output_file in ('bluesky_network_extended.graphml', 'bluesky_network_extended.gexf',
+                        'bluesky_network_extended.tsv.gz'):
+        export_store(store_path, os.path.join('output_data', output_file))
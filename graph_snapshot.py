@@ -0,0 +1,219 @@
+import os
+import json
+import hashlib
+import numpy as np
+from scipy import sparse
+
+from build_graph import create_csr_graph, load_network_data_from_store, stream_network_data
+from csr_graph import CSRGraph
+
+SNAPSHOT_VERSION = 1
+STRING_COLUMNS = ('dids', 'handles', 'display_names', 'descriptions')
+ARRAYS = ('out_indptr', 'out_indices', 'in_indptr', 'in_indices', 'data', 'node_type')
+
+
+class StringTable:
+    """Read-only sequence of strings stored as one UTF-8 buffer and an offsets array"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def index(self, value):
+        """Position of the first string equal to `value`, or None; searched in the buffer without decoding it"""
+        needle = value.encode('utf-8')
+        buffer = self.data.tobytes()
+        start = buffer.find(needle)
+        while start != -1:
+            # A match counts only if it spans exactly one string
+            i = int(np.searchsorted(self.offsets, start))
+            if i < len(self) and self.offsets[i] == start and self.offsets[i + 1] == start + len(needle):
+                return i
+            start = buffer.find(needle, start + 1)
+        return None
+
+    @staticmethod
+    def encode(strings):
+        """The UTF-8 buffer (uint8) and the int64 offsets of a StringTable holding `strings`"""
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    @staticmethod
+    def save(prefix, strings):
+        data, offsets = StringTable.encode(strings)
+        np.save(f"{prefix}.npy", data)
+        np.save(f"{prefix}_offsets.npy", offsets)
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        return cls(np.load(f"{prefix}.npy", mmap_mode=mmap_mode), np.load(f"{prefix}_offsets.npy", mmap_mode=mmap_mode))
+
+
+class SnapshotInterner:
+    """
+    Read-only stand-in for a NodeInterner whose side tables are memory-mapped.
+
+    Strings are decoded only when a node is looked up; the DID and handle
+    indexes used by id_for are built on first use.
+    """
+
+    def __init__(self, dids, handles, display_names, descriptions):
+        self.dids = dids
+        self.handles = handles
+        self.display_names = display_names
+        self.descriptions = descriptions
+        self._ids = None
+
+    def __len__(self):
+        return len(self.dids)
+
+    def id_for(self, key):
+        if self._ids is None:
+            # Handles first, so a DID wins if a handle ever equals another node's DID
+            self._ids = {handle: i for i, handle in enumerate(self.handles)}
+            self._ids.update((did, i) for i, did in enumerate(self.dids))
+        return self._ids.get(key)
+
+    def handle(self, node_id):
+        return self.handles[node_id]
+
+    def attributes(self, node_id):
+        return {
+            'did': self.dids[node_id],
+            'handle': self.handles[node_id],
+            'display_name': self.display_names[node_id],
+            'description': self.descriptions[node_id],
+        }
+
+
+def source_fingerprint(main_json_path, network_dir=None, store_path=None):
+    """
+    Hash of the path, size and modification time of every source file.
+
+    Only the files are stat'ed, nothing is parsed, so checking whether a
+    snapshot is still current costs one directory listing.
+    """
+    if store_path:
+        paths = [store_path, store_path + '-wal']
+    else:
+        paths = [main_json_path] + [entry.path for entry in os.scandir(network_dir)
+                                    if entry.name.endswith('.json')]
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def compile_snapshot(snapshot_dir, main_following, network_data, include_secondary_follows=False, fingerprint=None):
+    """
+    Build the CSR graph once and write it as .npy arrays plus a manifest.
+
+    Edge indexes (CSR out-edges and CSC in-edges), the node type column and
+    the interner's string tables are separate files that can be memory-mapped.
+    The manifest is written last, so an interrupted compile is never loaded.
+    """
+    G = create_csr_graph(main_following, network_data, include_secondary_follows=include_secondary_follows)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    manifest_path = os.path.join(snapshot_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    out_adj, in_adj = G.out_adj, G.in_adj
+    out_adj.sort_indices()
+    in_adj.sort_indices()
+    arrays = {
+        'out_indptr': out_adj.indptr, 'out_indices': out_adj.indices,
+        'in_indptr': in_adj.indptr, 'in_indices': in_adj.indices,
+        'data': out_adj.data, 'node_type': G.node_type,
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(snapshot_dir, f"{name}.npy"), values)
+    for name in STRING_COLUMNS:
+        StringTable.save(os.path.join(snapshot_dir, name), getattr(G.interner, name)[:G.number_of_nodes()])
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': SNAPSHOT_VERSION,
+            'fingerprint': fingerprint,
+            'include_secondary_follows': include_secondary_follows,
+            'nodes': G.number_of_nodes(),
+            'edges': G.number_of_edges(),
+        }, f, indent=2)
+    print(f"Graph snapshot with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges "
+          f"written to '{snapshot_dir}'")
+
+
+def read_manifest(snapshot_dir):
+    path = os.path.join(snapshot_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_snapshot(snapshot_dir, mmap_mode='r'):
+    """Open a compiled snapshot as a CSRGraph whose arrays are memory-mapped (read-only by default)"""
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No graph snapshot in '{snapshot_dir}'")
+    arrays = {name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+    n = manifest['nodes']
+    out_adj = sparse.csr_matrix((arrays['data'], arrays['out_indices'], arrays['out_indptr']), shape=(n, n),
+                                copy=False)
+    in_adj = sparse.csc_matrix((arrays['data'], arrays['in_indices'], arrays['in_indptr']), shape=(n, n),
+                               copy=False)
+    out_adj.has_sorted_indices = in_adj.has_sorted_indices = True
+    interner = SnapshotInterner(*(StringTable.load(os.path.join(snapshot_dir, name), mmap_mode)
+                                  for name in STRING_COLUMNS))
+    return CSRGraph.from_arrays(out_adj, in_adj, arrays['node_type'], interner=interner)
+
+
+def open_graph(main_json_path='bluesky_data/following.json', network_dir='bluesky_data/following_network',
+               include_secondary_follows=False, store_path=None, snapshot_dir=None, load=None):
+    """
+    The follow graph as a memory-mapped CSRGraph, compiling the snapshot first if needed.
+
+    The snapshot is rebuilt automatically when any source file (following.json,
+    a following_network/*.json file or the crawl store) was added, removed or
+    modified since it was compiled.
+
+    :param snapshot_dir: Defaults to output_data/graph_snapshot (or graph_snapshot_extended)
+    :param load: Callable returning (main_following, network_data), used instead of reading the
+                 sources when the snapshot has to be compiled (lets several snapshots share one parse)
+    """
+    if snapshot_dir is None:
+        snapshot_dir = os.path.join('output_data', 'graph_snapshot_extended' if include_secondary_follows
+                                    else 'graph_snapshot')
+    fingerprint = source_fingerprint(main_json_path, network_dir, store_path)
+    manifest = read_manifest(snapshot_dir)
+    if (manifest is None or manifest['version'] != SNAPSHOT_VERSION or manifest['fingerprint'] != fingerprint
+            or manifest['include_secondary_follows'] != include_secondary_follows):
+        print("Compiling graph snapshot...")
+        if load is not None:
+            main_following, network_data = load()
+        elif store_path:
+            main_following, network_data = load_network_data_from_store(store_path)
+        else:
+            with open(main_json_path, 'r', encoding='utf-8') as f:
+                main_following = json.load(f)
+            network_data = stream_network_data(network_dir)
+        compile_snapshot(snapshot_dir, main_following, network_data, include_secondary_follows, fingerprint)
+    return load_snapshot(snapshot_dir)
+
+
+if __name__ == "__main__":
+    open_graph()
+    open_graph(include_secondary_follows=True)
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Upper bounds (seconds) of the API latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far in MB, or None where getrusage is not available"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10  # Bytes on macOS, KiB on Linux
+
+
+def current_rss_mb():
+    """
+    Resident set size of this process in MB: from /proc, else psutil if it is
+    installed, else the peak so far; None when none of them is available
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2 ** 20
+    return peak_rss_mb()
+
+
+def _max_rss(*values):
+    known = [value for value in values if value is not None]
+    return max(known) if known else None
+
+
+def _round(value, digits=1):
+    return round(value, digits) if value is not None else None
+
+
+def _label_string(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+class Metrics:
+    """
+    Stage timings, memory, API call and rate-limit metrics of one run.
+
+    Stages record their wall time and peak RSS; a background thread samples
+    the RSS every `sample_interval` seconds while any stage is open, and exits
+    once none is. RSS values are None where it cannot be measured. API
+    calls are counted per XRPC endpoint and status, with a latency histogram
+    per endpoint. Other counters (pages, retries, rate-limit sleep) are keyed
+    by name and labels. All methods are thread-safe.
+    """
+
+    def __init__(self, sample_interval=0.05):
+        self.sample_interval = sample_interval
+        self.started = datetime.now(timezone.utc)
+        self.stages = []
+        self.counters = Counter()  # (name, ((label, value), ...)) -> value
+        self.calls = Counter()  # (endpoint, status) -> count
+        self.latency = {}  # endpoint -> {'buckets': [...], 'sum': seconds, 'count': n, 'max': seconds}
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def _sample(self):
+        while True:
+            time.sleep(self.sample_interval)
+            rss = current_rss_mb()
+            with self._lock:
+                if not self._open:
+                    # The next stage starts a new sampler
+                    self._sampler = None
+                    return
+                for entry in self._open:
+                    entry['peak_rss_mb'] = _max_rss(entry['peak_rss_mb'], rss)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block and track its peak RSS"""
+        rss = current_rss_mb()
+        entry = {'stage': name, 'started': datetime.now(timezone.utc).isoformat(), 'rss_start_mb': rss,
+                 'peak_rss_mb': rss}
+        with self._lock:
+            self._open.append(entry)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            seconds = time.perf_counter() - start
+            rss = current_rss_mb()
+            with self._lock:
+                self._open.remove(entry)
+                entry.update(seconds=round(seconds, 4), rss_end_mb=_round(rss),
+                             peak_rss_mb=_round(_max_rss(entry['peak_rss_mb'], rss)),
+                             rss_start_mb=_round(entry['rss_start_mb']))
+                self.stages.append(entry)
+            peak = entry['peak_rss_mb']
+            print(f"[{name}] {seconds:.2f}s" + (f", peak RSS {peak:.0f} MB" if peak is not None else ""))
+
+    def count(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe_call(self, endpoint, status, seconds):
+        """Record one XRPC request; `status` is the HTTP status, or 'error' when no response arrived"""
+        with self._lock:
+            self.calls[(endpoint, str(status))] += 1
+            histogram = self.latency.setdefault(
+                endpoint, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0, 'max': 0.0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], seconds)
+
+    def to_dict(self):
+        with self._lock:
+            api = {}
+            for (endpoint, status), count in sorted(self.calls.items()):
+                api.setdefault(endpoint, {'calls': {}})['calls'][status] = count
+            for endpoint, histogram in self.latency.items():
+                api[endpoint]['latency'] = {
+                    'buckets': {str(bound): count for bound, count in zip(LATENCY_BUCKETS, histogram['buckets'])},
+                    'count': histogram['count'],
+                    'sum_seconds': round(histogram['sum'], 4),
+                    'mean_seconds': round(histogram['sum'] / histogram['count'], 4),
+                    'max_seconds': round(histogram['max'], 4),
+                }
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                if labels:
+                    counters.setdefault(name, {})[_label_string(labels)] = round(value, 4)
+                else:
+                    counters[name] = round(value, 4)
+            return {
+                'started': self.started.isoformat(),
+                'finished': datetime.now(timezone.utc).isoformat(),
+                'max_rss_mb': _round(peak_rss_mb()),
+                'stages': list(self.stages),
+                'api': api,
+                'counters': counters,
+            }
+
+    def to_prometheus(self, prefix='bluesky'):
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            seconds, peak = Counter(), {}
+            for entry in self.stages:  # A stage that ran several times is summed
+                seconds[entry['stage']] += entry['seconds']
+                if entry['peak_rss_mb'] is not None:
+                    peak[entry['stage']] = max(peak.get(entry['stage'], 0), entry['peak_rss_mb'])
+            lines = [f"# TYPE {prefix}_stage_seconds gauge"]
+            lines += [f'{prefix}_stage_seconds{{stage="{stage}"}} {value:.4f}' for stage, value in seconds.items()]
+            lines.append(f"# TYPE {prefix}_stage_peak_rss_bytes gauge")
+            lines += [f'{prefix}_stage_peak_rss_bytes{{stage="{stage}"}} {int(value * 2 ** 20)}'
+                      for stage, value in peak.items()]
+
+            lines.append(f"# TYPE {prefix}_api_calls_total counter")
+            lines += [f'{prefix}_api_calls_total{{endpoint="{endpoint}",status="{status}"}} {count}'
+                      for (endpoint, status), count in sorted(self.calls.items())]
+            lines.append(f"# TYPE {prefix}_api_latency_seconds histogram")
+            for endpoint, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f'{prefix}_api_latency_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_api_latency_seconds_sum{{endpoint="{endpoint}"}} {histogram["sum"]:.4f}')
+                lines.append(f'{prefix}_api_latency_seconds_count{{endpoint="{endpoint}"}} {histogram["count"]}')
+
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {prefix}_{name}_total counter")
+                    typed.add(name)
+                label_string = f"{{{_label_string(labels)}}}" if labels else ''
+                lines.append(f"{prefix}_{name}_total{label_string} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def save(self, name, output_dir='output_data/metrics'):
+        """Write output_dir/<name>.json and the same metrics as Prometheus text in output_dir/<name>.prom"""
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, f"{name}.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        with open(os.path.join(output_dir, f"{name}.prom"), 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        print(f"Run metrics saved to '{os.path.join(output_dir, name)}.json' (and .prom)")
+
+
+# Metrics of the current process, shared by the crawlers and the analysis scripts
+METRICS = Metrics()
+
+
+def stage(name):
+    return METRICS.stage(name)
+
+
+def count(name, value=1, **labels):
+    METRICS.count(name, value, **labels)
+
+
+def observe_call(endpoint, status, seconds):
+    METRICS.observe_call(endpoint, status, seconds)
+
+
+def save_metrics(name, output_dir='output_data/metrics'):
+    METRICS.save(name, output_dir)
@@ -0,0 +1,98 @@
+SOURCE_USER = "user"  # Pseudo-DID (and handle) of the account the crawl started from
+
+
+class NodeInterner:
+    """
+    Map each DID to a dense integer node ID, exactly once.
+
+    Handles, display names and descriptions live in side tables indexed by node
+    ID instead of on every graph node, so a handle change does not change the
+    identity of a node and graphs can be keyed by small integers.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.dids = []
+        self.handles = []
+        self.display_names = []
+        self.descriptions = []
+        self._handle_ids = {}
+
+    def __len__(self):
+        return len(self.dids)
+
+    def intern(self, did, handle=None, display_name=None, description=None):
+        """Return the node ID for a DID, assigning the next free ID on first sight"""
+        node_id = self.ids.get(did)
+        if node_id is None:
+            node_id = len(self.dids)
+            self.ids[did] = node_id
+            self.dids.append(did)
+            self.handles.append(handle or did)
+            self.display_names.append(display_name or handle or did)
+            self.descriptions.append(description or '')
+        elif handle and handle != self.handles[node_id]:
+            # The account changed its handle: keep the ID, update the side table
+            self._handle_ids.pop(self.handles[node_id], None)
+            self.handles[node_id] = handle
+        if handle:
+            self._handle_ids[handle] = node_id
+        return node_id
+
+    def intern_profile(self, profile):
+        """Intern a profile dict as found in following.json / following_network/*.json"""
+        return self.intern(profile['did'], profile.get('handle'),
+                           profile.get('display_name'), profile.get('description'))
+
+    def intern_key(self, key):
+        """Intern an actor known only by a DID or a handle (e.g. a following_network filename)"""
+        if key in self.ids:
+            return self.ids[key]
+        if key in self._handle_ids:
+            return self._handle_ids[key]
+        if key.startswith('did:'):
+            return self.intern(key)
+        # No DID known for this handle yet; it becomes the node's identity
+        return self.intern(key, handle=key)
+
+    def id_for(self, key):
+        """Look up the node ID of a DID or handle, or None if it was never interned"""
+        node_id = self.ids.get(key)
+        return node_id if node_id is not None else self._handle_ids.get(key)
+
+    def handle(self, node_id):
+        return self.handles[node_id]
+
+    def attributes(self, node_id):
+        """Side-table attributes of a node, as they would be stored on a handle-keyed graph"""
+        return {
+            'did': self.dids[node_id],
+            'handle': self.handles[node_id],
+            'display_name': self.display_names[node_id],
+            'description': self.descriptions[node_id],
+        }
+
+
+def node_label(G, node):
+    """Human-readable label (the handle) of a node, for handle-keyed and interned graphs alike"""
+    interner = G.graph.get('interner')
+    return interner.handles[node] if interner is not None else node
+
+
+def node_attributes(G, node):
+    """Node attributes merged with the interner side table when the graph uses integer IDs"""
+    interner = G.graph.get('interner')
+    if interner is None:
+        return G.nodes[node]
+    return {**interner.attributes(node), **G.nodes[node]}
+
+
+def resolve_node(G, key):
+    """Translate a handle or DID into the graph's node key"""
+    interner = G.graph.get('interner')
+    if interner is None:
+        return key
+    node = interner.id_for(key)
+    if node is None:
+        raise KeyError(f"Unknown account: {key}")
+    return node
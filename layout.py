@@ -0,0 +1,278 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+
+
+MAX_DEPTH = 20  # Quadtree levels below the root at most; Morton codes take 2 bits per level
+
+
+def _expand(rows, first, count):
+    """Pair each of `rows` with `count` consecutive indices starting at `first`: (repeated rows, indices)"""
+    within = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    return np.repeat(rows, count), np.repeat(first, count) + within
+
+
+def _accumulate(forces, rows, values):
+    """forces[rows] += values with repeated rows summed (np.add.at, but much faster)"""
+    for d in range(forces.shape[1]):
+        forces[:, d] += np.bincount(rows, weights=values[:, d], minlength=len(forces))
+
+
+class ForceAtlas2Layout:
+    """
+    ForceAtlas2 layout with NumPy-vectorized forces.
+
+    Repulsion uses the Barnes-Hut approximation: a quadtree is built over the
+    nodes, and a cell acts on a node through its mass center when its width is
+    below `theta` times its distance to the node (1.2, as in Gephi); closer
+    cells are opened, down to leaves of at most `leaf_size` nodes that repel
+    exactly. All nodes walk the tree together, level by level, in node chunks
+    on a thread pool; NumPy releases the GIL for the heavy array work.
+    Attraction, gravity and the adaptive speed follow the reference
+    ForceAtlas2 implementation.
+    """
+
+    def __init__(self, outbound_attraction_distribution=True, lin_log_mode=False, edge_weight_influence=0.0,
+                 jitter_tolerance=2.0, scaling_ratio=20.0, strong_gravity_mode=True, gravity=0.5,
+                 theta=1.2, leaf_size=8, threads=None, verbose=True):
+        self.outbound_attraction_distribution = outbound_attraction_distribution
+        self.lin_log_mode = lin_log_mode
+        self.edge_weight_influence = edge_weight_influence
+        self.jitter_tolerance = jitter_tolerance
+        self.scaling_ratio = scaling_ratio
+        self.strong_gravity_mode = strong_gravity_mode
+        self.gravity = gravity
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.threads = threads or min(8, os.cpu_count() or 1)
+        self.verbose = verbose
+
+    def layout(self, adjacency, pos=None, iterations=100, seed=42):
+        """
+        Compute node positions.
+
+        :param adjacency: Square scipy sparse adjacency matrix (directed edges are made undirected)
+        :param pos: Optional (n, 2) array of starting positions, e.g. from a previous run
+        :return: (n, 2) array of positions
+        """
+        A = sparse.csr_matrix(adjacency, dtype=np.float64)
+        A = (A + A.T).tocsr()
+        A.setdiag(0)
+        A.eliminate_zeros()
+        n = A.shape[0]
+        rng = np.random.default_rng(seed)
+        pos = rng.random((n, 2)) if pos is None else np.array(pos, dtype=np.float64)
+        if n == 0:
+            return pos
+
+        mass = 1.0 + np.diff(A.indptr)
+        coo = sparse.triu(A, k=1).tocoo()
+        edges = np.column_stack((coo.row, coo.col))
+        weights = coo.data ** self.edge_weight_influence if self.edge_weight_influence else np.ones(len(coo.data))
+        outbound = mass.mean() if self.outbound_attraction_distribution else 1.0
+
+        speed, speed_efficiency = 1.0, 1.0
+        old_forces = np.zeros_like(pos)
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for iteration in range(iterations):
+                forces = self._repulsion(pos, mass, pool)
+                forces += self._gravity(pos, mass)
+                forces += self._attraction(pos, mass, edges, weights, outbound)
+                speed, speed_efficiency = self._apply(pos, mass, forces, old_forces, speed, speed_efficiency)
+                old_forces = forces
+                if self.verbose and (iteration + 1) % 100 == 0:
+                    print(f"Layout iteration {iteration + 1}/{iterations}")
+        return pos
+
+    def _gravity(self, pos, mass):
+        if self.strong_gravity_mode:
+            return -self.gravity * self.scaling_ratio * mass[:, None] * pos
+        distance = np.linalg.norm(pos, axis=1)
+        factor = np.divide(self.gravity * mass, distance, out=np.zeros_like(distance), where=distance > 0)
+        return -factor[:, None] * pos
+
+    def _attraction(self, pos, mass, edges, weights, outbound):
+        forces = np.zeros_like(pos)
+        if len(edges) == 0:
+            return forces
+        delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+        if self.lin_log_mode:
+            distance = np.linalg.norm(delta, axis=1)
+            factor = np.divide(np.log1p(distance), distance, out=np.zeros_like(distance), where=distance > 0)
+        else:
+            factor = np.ones(len(edges))
+        factor = -weights * factor
+        if self.outbound_attraction_distribution:
+            # Dissuade hubs: attraction divided by the mass of the source node
+            factor = factor * outbound / mass[edges[:, 0]]
+        pull = factor[:, None] * delta
+        np.add.at(forces, edges[:, 0], pull)
+        np.add.at(forces, edges[:, 1], -pull)
+        return forces
+
+    def _repulsion(self, pos, mass, pool):
+        """Barnes-Hut repulsion: every node walks the quadtree on its own, in node chunks on the thread pool"""
+        tree = self._quadtree(pos, mass)
+        chunks = np.array_split(np.arange(len(pos)), self.threads)
+        forces = np.zeros_like(pos)
+        for chunk, chunk_forces in zip(chunks, pool.map(lambda chunk: self._walk(chunk, pos, mass, tree), chunks)):
+            forces[chunk] = chunk_forces
+        return forces
+
+    def _repel(self, delta, mass_i, mass_j):
+        """Repulsion between points and mass centers: k_r * m_i * m_j / d along the displacement"""
+        distance_sq = (delta ** 2).sum(axis=1)
+        factor = np.divide(self.scaling_ratio * mass_i * mass_j, distance_sq,
+                           out=np.zeros_like(distance_sq), where=distance_sq > 0)
+        return factor[:, None] * delta
+
+    def _quadtree(self, pos, mass):
+        """
+        Quadtree over the nodes sorted by Morton code: every occupied cell of a
+        level is a contiguous range of the sorted nodes. Levels are added until
+        no cell holds more than `leaf_size` nodes (or MAX_DEPTH is reached).
+
+        :return: (order, codes, levels) where `order` sorts the nodes, `codes`
+                 holds each node's Morton code and every level is a dict of
+                 per-cell arrays (key, start, end, mass, center, first and end
+                 child in the next level) plus the cell width
+        """
+        n = len(pos)
+        low = pos.min(axis=0)
+        size = max(float((pos.max(axis=0) - low).max()), 1e-9) * (1 + 1e-9)
+        grid = np.minimum(((pos - low) / size * 2 ** MAX_DEPTH).astype(np.int64), 2 ** MAX_DEPTH - 1)
+        codes = np.zeros(n, dtype=np.int64)
+        for bit in range(MAX_DEPTH):
+            codes |= ((grid[:, 0] >> bit) & 1) << (2 * bit + 1) | ((grid[:, 1] >> bit) & 1) << (2 * bit)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes, sorted_mass, sorted_pos = codes[order], mass[order], pos[order]
+
+        levels = []
+        for level in range(MAX_DEPTH + 1):
+            keys = sorted_codes >> 2 * (MAX_DEPTH - level)
+            start = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+            end = np.append(start[1:], n)
+            cell_mass = np.add.reduceat(sorted_mass, start)
+            center = np.add.reduceat(sorted_mass[:, None] * sorted_pos, start) / cell_mass[:, None]
+            levels.append({'key': keys[start], 'start': start, 'end': end, 'mass': cell_mass, 'center': center,
+                           'width': size / 2 ** level})
+            if (end - start).max() <= self.leaf_size:
+                break
+        for parent, children in zip(levels, levels[1:] + [None]):
+            parent_keys = children['key'] >> 2 if children else np.empty(0, dtype=np.int64)  # No children below the last level
+            parent['first_child'] = np.searchsorted(parent_keys, parent['key'], side='left')
+            parent['end_child'] = np.searchsorted(parent_keys, parent['key'], side='right')
+        return order, codes, levels
+
+    def _walk(self, chunk, pos, mass, tree):
+        """
+        Repulsion on the nodes of `chunk`, walking the quadtree a level at a
+        time for all of them at once. A cell that does not contain the node and
+        whose width is below `theta` times its distance to the node acts through
+        its mass center; leaves that are too close repel with each of their nodes
+        exactly; the other cells are opened.
+        """
+        order, codes, levels = tree
+        forces = np.zeros((len(chunk), 2))
+        rows = np.arange(len(chunk))
+        cells = np.zeros(len(chunk), dtype=np.int64)
+        for level, cell in enumerate(levels):
+            if len(rows) == 0:
+                break
+            nodes = chunk[rows]
+            delta = pos[nodes] - cell['center'][cells]
+            contains = (codes[nodes] >> 2 * (MAX_DEPTH - level)) == cell['key'][cells]
+            far = ~contains & (cell['width'] < self.theta * np.sqrt((delta ** 2).sum(axis=1)))
+            _accumulate(forces, rows[far], self._repel(delta[far], mass[nodes[far]], cell['mass'][cells[far]]))
+
+            size = cell['end'][cells] - cell['start'][cells]
+            leaf = ~far & ((size <= self.leaf_size) | (level == len(levels) - 1))
+            pair_rows, members = _expand(rows[leaf], cell['start'][cells[leaf]], size[leaf])
+            members = order[members]
+            keep = members != chunk[pair_rows]
+            pair_rows, members = pair_rows[keep], members[keep]
+            _accumulate(forces, pair_rows, self._repel(pos[chunk[pair_rows]] - pos[members], mass[chunk[pair_rows]],
+                                                       mass[members]))
+
+            opened = ~far & ~leaf
+            first_child = cell['first_child'][cells[opened]]
+            rows, cells = _expand(rows[opened], first_child, cell['end_child'][cells[opened]] - first_child)
+        return forces
+
+    def _apply(self, pos, mass, forces, old_forces, speed, speed_efficiency):
+        """Adaptive speed and displacement, as in the reference ForceAtlas2"""
+        n = len(pos)
+        swinging = mass * np.linalg.norm(old_forces - forces, axis=1)
+        traction = 0.5 * mass * np.linalg.norm(old_forces + forces, axis=1)
+        total_swinging, total_traction = swinging.sum(), traction.sum()
+
+        estimated_jitter = 0.05 * np.sqrt(n)
+        min_jitter, max_jitter = np.sqrt(estimated_jitter), 10.0
+        jitter = self.jitter_tolerance * max(min_jitter, min(max_jitter,
+                                                              estimated_jitter * total_traction / n ** 2))
+        min_speed_efficiency = 0.05
+        if total_traction and total_swinging / total_traction > 2.0:
+            if speed_efficiency > min_speed_efficiency:
+                speed_efficiency *= 0.5
+            jitter = max(jitter, self.jitter_tolerance)
+
+        target_speed = np.inf if total_swinging == 0 else \
+            jitter * speed_efficiency * total_traction / total_swinging
+        if total_swinging > jitter * total_traction:
+            if speed_efficiency > min_speed_efficiency:
+                speed_efficiency *= 0.7
+        elif speed < 1000:
+            speed_efficiency *= 1.3
+        speed = speed + min(target_speed - speed, 0.5 * speed)
+
+        factor = speed / (1.0 + np.sqrt(speed * swinging))
+        pos += forces * factor[:, None]
+        return speed, speed_efficiency
+
+
+def load_positions(path):
+    """Saved layout positions by stable node key (DID), or {} if there are none"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {key: np.array(value) for key, value in json.load(f).items()}
+
+
+def save_positions(path, keys, pos):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({key: [round(float(x), 4), round(float(y), 4)] for key, (x, y) in zip(keys, pos)}, f)
+
+
+def initial_positions(keys, adjacency, saved, seed=42):
+    """
+    Starting positions from a previous layout.
+
+    Known nodes start where they were; new nodes start at the mean position of
+    their already placed neighbors (or at random), with a little jitter.
+
+    :return: (positions, share of nodes that had a saved position)
+    """
+    rng = np.random.default_rng(seed)
+    n = len(keys)
+    known = np.array([key in saved for key in keys], dtype=bool)
+    if not known.any():
+        return None, 0.0
+
+    pos = rng.random((n, 2))
+    pos[known] = np.array([saved[key] for key, k in zip(keys, known) if k])
+    A = sparse.csr_matrix(adjacency, dtype=np.float64)
+    A = (A + A.T).tocsr()
+    placed = A @ sparse.diags(known.astype(float))
+    count = np.asarray(placed.sum(axis=1)).ravel()
+    neighbor_mean = np.divide(placed @ pos, count[:, None], out=np.zeros_like(pos), where=count[:, None] > 0)
+    spread = pos[known].std(axis=0).mean() or 1.0
+    new_with_neighbors = ~known & (count > 0)
+    pos[new_with_neighbors] = neighbor_mean[new_with_neighbors] + \
+        rng.normal(scale=0.01 * spread, size=(new_with_neighbors.sum(), 2))
+    new_alone = ~known & (count == 0)
+    center = pos[known].mean(axis=0)
+    pos[new_alone] = center + rng.normal(scale=spread, size=(new_alone.sum(), 2))
+    return pos, known.mean()
@@ -0,0 +1,298 @@
+import os
+import json
+import math
+import random
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+
+def stable_key(G, node):
+    """Key of a node that survives re-interning: the DID on interned graphs, the handle otherwise"""
+    interner = G.graph.get('interner')
+    return interner.dids[node] if interner is not None else node
+
+
+def hash_keys(keys):
+    """Stable 64-bit hash of each node key (Python's hash() is salted per process)"""
+    return np.array([int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'little')
+                     for key in keys], dtype=np.uint64)
+
+
+def graph_fingerprint(G):
+    """Content hash of the node and edge set, independent of insertion order and node numbering"""
+    keys = [str(stable_key(G, node)) for node in G.nodes()]
+    order = np.argsort(np.array(keys, dtype=object))
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys))
+    position = {node: i for i, node in enumerate(G.nodes())}
+
+    edges = np.array([(rank[position[u]], rank[position[v]]) for u, v in G.edges()], dtype=np.int64)
+    edges = edges.reshape(-1, 2)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+    digest = hashlib.sha256()
+    digest.update("\n".join(keys[i] for i in order).encode('utf-8'))
+    digest.update(str(G.is_directed()).encode('utf-8'))
+    digest.update(edges.tobytes())
+    return digest.hexdigest()
+
+
+class MetricsCache:
+    """
+    Compute each metric once per graph and keep it on disk.
+
+    Results are keyed by the graph fingerprint, the metric name and its
+    parameters, and stored as JSON by stable node key, so reruns on an
+    unchanged graph load them instead of recomputing.
+    """
+
+    def __init__(self, cache_dir='output_data/metrics_cache'):
+        self.cache_dir = cache_dir
+        self._memory = {}
+
+    def fingerprint(self, G):
+        # Not memoized per graph object: an edit that keeps the node and edge
+        # counts would otherwise serve metrics of the old graph
+        return graph_fingerprint(G)
+
+    def _path(self, fingerprint, name, params):
+        param_hash = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, fingerprint[:16], f"{name}-{param_hash}.json")
+
+    def previous(self, G, name, **params):
+        """
+        Most recently cached values of a metric computed on any graph, mapped onto
+        the nodes of G (nodes that did not exist then are left out). Useful as a
+        warm start after a re-crawl changed the graph slightly.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return None
+        filename = os.path.basename(self._path('', name, params))
+        candidates = [os.path.join(self.cache_dir, entry, filename) for entry in os.listdir(self.cache_dir)]
+        candidates = [path for path in candidates if os.path.exists(path)]
+        if not candidates:
+            return None
+        with open(max(candidates, key=os.path.getmtime), 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        values = {}
+        for node in G.nodes():
+            key = str(stable_key(G, node))
+            if key in stored:
+                values[node] = stored[key]
+        return values or None
+
+    def get(self, G, name, compute, **params):
+        """Return metric `name` for G, calling compute(G, **params) only on a cache miss"""
+        fingerprint = self.fingerprint(G)
+        path = self._path(fingerprint, name, params)
+        if path in self._memory:
+            return self._memory[path]
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            # JSON object keys are strings, so match on the string form of the node key
+            node_by_key = {str(stable_key(G, node)): node for node in G.nodes()}
+            values = {node_by_key[key]: value for key, value in stored.items()}
+        else:
+            print(f"Computing {name}...")
+            values = compute(G, **params)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({stable_key(G, node): value for node, value in values.items()}, f)
+
+        self._memory[path] = values
+        return values
+
+
+_default_cache = None
+
+
+def default_cache():
+    """Process-wide cache used when a caller does not pass one"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MetricsCache()
+    return _default_cache
+
+
+def degree_centrality(G, cache=None):
+    return (cache or default_cache()).get(G, 'degree_centrality', nx.degree_centrality)
+
+
+def betweenness_sample_size(n, epsilon=0.05, delta=0.1):
+    """
+    Number of pivots for an additive error of at most `epsilon` per node with
+    probability 1 - delta (Hoeffding bound with a union bound over the n nodes).
+    """
+    return min(n, math.ceil(math.log(2 * n / delta) / (2 * epsilon ** 2)))
+
+
+# Graph shared with pool workers, set once per process by _init_worker
+_worker_graph = None
+
+
+def _init_worker(G):
+    global _worker_graph
+    _worker_graph = G
+
+
+def _betweenness_from_sources(sources, G=None):
+    """Unnormalized betweenness contributions of the shortest paths starting at `sources`"""
+    G = _worker_graph if G is None else G
+    return nx.betweenness_centrality_subset(G, sources=sources, targets=list(G), normalized=False)
+
+
+def parallel_betweenness_centrality(G, k=None, seed=42, processes=None, chunk_size=64):
+    """
+    Betweenness centrality with single-source shortest paths spread over a process pool.
+
+    With `k`, only k pivot nodes drawn with a fixed `seed` are used as sources
+    and the result is extrapolated, as in nx.betweenness_centrality(G, k=k).
+    Scores are normalized like nx.betweenness_centrality.
+    """
+    nodes = list(G)
+    n = len(nodes)
+    if k is None or k >= n:
+        pivots = nodes
+        k = None
+    else:
+        pivots = random.Random(seed).sample(nodes, k)
+    chunks = [pivots[i:i + chunk_size] for i in range(0, len(pivots), chunk_size)]
+
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(G,)) as pool:
+            partials = list(pool.map(_betweenness_from_sources, chunks))
+    else:
+        partials = [_betweenness_from_sources(chunk, G) for chunk in chunks]
+
+    betweenness = dict.fromkeys(nodes, 0.0)
+    for chunk_scores in partials:
+        for node, value in chunk_scores.items():
+            betweenness[node] += value
+
+    # betweenness_centrality_subset halves undirected scores; undo that before normalizing
+    scale = 1.0 if G.is_directed() else 2.0
+    scale *= 1 / ((n - 1) * (n - 2)) if n > 2 else 1.0
+    if k is not None:
+        scale *= n / k
+    return {node: value * scale for node, value in betweenness.items()}
+
+
+def betweenness_centrality(G, cache=None, approximate=False, epsilon=0.05, k=None, seed=42, processes=None):
+    """
+    Betweenness centrality, exact or estimated from sampled pivots.
+
+    :param approximate: Sample pivots instead of using every node as a source
+    :param epsilon: Error budget used to pick the number of pivots when `k` is not given
+    :param k: Number of pivots (overrides `epsilon`)
+    :param seed: Seed for pivot sampling, so repeated runs give the same scores
+    :param processes: Spread the shortest-path computations over this many processes
+    """
+    cache = cache or default_cache()
+    if not approximate:
+        compute = partial(parallel_betweenness_centrality, processes=processes) if processes \
+            else nx.betweenness_centrality
+        return cache.get(G, 'betweenness_centrality', compute)
+
+    if k is None:
+        k = betweenness_sample_size(G.number_of_nodes(), epsilon)
+    compute = partial(parallel_betweenness_centrality, processes=processes)
+    return cache.get(G, 'approximate_betweenness_centrality', compute, k=k, seed=seed)
+
+
+def _start_vector(nodes, nstart):
+    """Initial iterate from previous scores; nodes without one start at the mean score"""
+    if not nstart:
+        return np.full(len(nodes), 1.0 / len(nodes))
+    fill = sum(nstart.values()) / len(nstart)
+    x = np.array([nstart.get(node, fill) for node in nodes], dtype=float)
+    total = x.sum()
+    return x / total if total > 0 else np.full(len(nodes), 1.0 / len(nodes))
+
+
+def sparse_eigenvector_centrality(G, max_iter=1000, tol=1e-06, nstart=None):
+    """
+    Eigenvector centrality by power iteration on a sparse adjacency matrix.
+
+    Same iteration and convergence test as nx.eigenvector_centrality (in-edges,
+    shifted by the identity), but with sparse matrix-vector products. Unlike
+    networkx, it returns the last iterate instead of raising when it does not
+    converge within `max_iter`.
+    `nstart` (node -> score) warm-starts the iteration, e.g. from a previous run.
+    """
+    nodes = list(G)
+    if not nodes:
+        return {}
+    A = nx.to_scipy_sparse_array(G, nodelist=nodes, weight=None, dtype=float, format='csr')
+    AT = A.T.tocsr()
+    x = _start_vector(nodes, nstart)
+    n = len(nodes)
+    for _ in range(max_iter):
+        xlast = x
+        x = xlast + AT @ xlast
+        norm = np.linalg.norm(x) or 1.0
+        x = x / norm
+        if np.abs(x - xlast).sum() < n * tol:
+            return dict(zip(nodes, map(float, x)))
+    # Directed follow graphs often converge slowly; the last iterate is still a usable ranking
+    print(f"Warning: eigenvector centrality did not converge in {max_iter} iterations, using the last iterate")
+    return dict(zip(nodes, map(float, x)))
+
+
+def sparse_pagerank(G, alpha=0.85, max_iter=100, tol=1e-06, nstart=None):
+    """
+    PageRank by power iteration on a sparse, row-normalized adjacency matrix.
+
+    Matches nx.pagerank (uniform teleport, dangling nodes redistributed
+    uniformly), except that it returns the last iterate instead of raising when
+    it does not converge. `nstart` (node -> score) warm-starts the iteration.
+    """
+    nodes = list(G)
+    n = len(nodes)
+    if n == 0:
+        return {}
+    A = nx.to_scipy_sparse_array(G, nodelist=nodes, weight=None, dtype=float, format='csr')
+    out_degree = np.asarray(A.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, out_degree, out=np.zeros(n), where=out_degree != 0)
+    PT = (sparse.diags(inverse) @ A).T.tocsr()
+    dangling = out_degree == 0
+    p = np.full(n, 1.0 / n)
+
+    x = _start_vector(nodes, nstart)
+    for _ in range(max_iter):
+        xlast = x
+        x = alpha * (PT @ xlast + xlast[dangling].sum() * p) + (1 - alpha) * p
+        if np.abs(x - xlast).sum() < n * tol:
+            return dict(zip(nodes, map(float, x)))
+    print(f"Warning: PageRank did not converge in {max_iter} iterations, using the last iterate")
+    return dict(zip(nodes, map(float, x)))
+
+
+def _warm_started(compute, cache, name, **params):
+    """Wrap compute so it starts from the latest cached scores; only called on a cache miss"""
+    def run(G, **kwargs):
+        return compute(G, nstart=cache.previous(G, name, **params), **kwargs)
+    return run
+
+
+def eigenvector_centrality(G, cache=None, max_iter=1000, warm_start=True):
+    """Sparse eigenvector centrality, warm-started from the latest cached scores"""
+    cache = cache or default_cache()
+    compute = sparse_eigenvector_centrality
+    if warm_start:
+        compute = _warm_started(compute, cache, 'eigenvector_centrality', max_iter=max_iter)
+    return cache.get(G, 'eigenvector_centrality', compute, max_iter=max_iter)
+
+
+def pagerank(G, cache=None, alpha=0.85, warm_start=True):
+    """Sparse PageRank, warm-started from the latest cached scores"""
+    cache = cache or default_cache()
+    compute = sparse_pagerank
+    if warm_start:
+        compute = _warm_started(compute, cache, 'pagerank', alpha=alpha)
+    return cache.get(G, 'pagerank', compute, alpha=alpha)
@@ -1,30 +1,68 @@
 import networkx as nx
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 import json
 import os
 import csv
 import numpy as np
-from fa2 import ForceAtlas2
-from scipy import sparse
-from build_graph import create_network_graph, load_network_data
+from communities import detect_communities_csr
+from graph_snapshot import open_graph
+from instrumentation import save_metrics, stage
+from interning import node_attributes, node_label
+from layout import ForceAtlas2Layout, initial_positions, load_positions, save_positions
+from metrics import (MetricsCache, betweenness_centrality, degree_centrality, eigenvector_centrality, pagerank,
+                     stable_key)
+from profile_cache import hydrate_profiles
 
 
-def detect_communities(G):
+def detect_communities(G, seed=42, state_file='output_data/communities_state.npz'):
     """Detect communities in the network using Louvain method"""
     print("\nDetecting communities...")
-    communities = nx.community.louvain_communities(G)
-    print(f"Found {len(communities)} communities")
+    communities = detect_communities_csr(G, seed=seed, state_file=state_file)
+    print(f"Found {sum(1 for community in communities if community)} communities")
     return communities
 
-def export_nodes(G, communities, output_file='output_data/nodes_info.csv'):
-    """Export node information including communities and centrality metrics"""
+def compute_centrality(G, cache=None, betweenness='exact', betweenness_epsilon=0.05, processes=None):
+    """
+    Degree, betweenness, eigenvector and PageRank centrality of every node
+
+    :param betweenness: 'exact', or 'approximate' to estimate betweenness from sampled pivots
+    :param betweenness_epsilon: Error budget of the approximate betweenness
+    :param processes: Spread the betweenness computation over this many processes
+    :return: Dict of metric name ('degree', 'betweenness', 'eigenvector', 'pagerank') -> {node: value}
+    """
+    if betweenness not in ('exact', 'approximate'):
+        raise ValueError(f"Unknown betweenness mode: {betweenness}")
+    return {
+        'degree': degree_centrality(G, cache),
+        'betweenness': betweenness_centrality(G, cache, approximate=betweenness == 'approximate',
+                                              epsilon=betweenness_epsilon, processes=processes),
+        'eigenvector': eigenvector_centrality(G, cache, max_iter=1000),
+        'pagerank': pagerank(G, cache),
+    }
+
+def export_nodes(G, communities, output_file='output_data/nodes_info.csv', cache=None,
+                 betweenness='exact', betweenness_epsilon=0.05, processes=None, centrality=None):
+    """
+    Export node information including communities and centrality metrics
+
+    :param betweenness: 'exact', or 'approximate' to estimate betweenness from sampled pivots
+    :param betweenness_epsilon: Error budget of the approximate betweenness
+    :param processes: Spread the betweenness computation over this many processes
+    :param centrality: Metrics already computed by compute_centrality (the three options above are then unused)
+    """
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
     # Calculate various centrality metrics
-    degree_cent = nx.degree_centrality(G)
-    betweenness_cent = nx.betweenness_centrality(G)
-    eigenvector_cent = nx.eigenvector_centrality(G, max_iter=1000)
+    if centrality is None:
+        centrality = compute_centrality(G, cache, betweenness, betweenness_epsilon, processes)
+    degree_cent = centrality['degree']
+    betweenness_cent = centrality['betweenness']
+    eigenvector_cent = centrality['eigenvector']
+    pagerank_scores = centrality['pagerank']
     
     # Find community membership for each node
     community_map = {}
@@ -45,6 +83,7 @@ def export_nodes(G, communities, output_file='output_data/nodes_info.csv'):
             'DegreeCentrality',
             'BetweennessCentrality',
             'EigenvectorCentrality',
+            'PageRank',
             'Followers',
             'Following',
             'Posts',
@@ -53,9 +92,9 @@ def export_nodes(G, communities, output_file='output_data/nodes_info.csv'):
         
         # Write node data
         for node in G.nodes():
-            node_data = G.nodes[node]
+            node_data = node_attributes(G, node)
             writer.writerow([
-                node,  # Handle
+                node_label(G, node),  # Handle
                 node_data.get('display_name', ''),
                 node_data.get('description', ''),
                 node_data.get('node_type', ''),
@@ -63,6 +102,7 @@ def export_nodes(G, communities, output_file='output_data/nodes_info.csv'):
                 round(degree_cent[node], 4),
                 round(betweenness_cent[node], 4),
                 round(eigenvector_cent[node], 4),
+                round(pagerank_scores[node], 6),
                 G.in_degree(node),  # Followers
                 G.out_degree(node),  # Following
                 node_data.get('posts_count', 0),
@@ -75,133 +115,159 @@ def export_nodes(G, communities, output_file='output_data/nodes_info.csv'):
     print("- Degree centrality")
     print("- Betweenness centrality")
     print("- Eigenvector centrality")
+    print("- PageRank")
     print("- Network statistics (followers/following)")
 
-def visualize_network(G, communities, output_file='output_data/bluesky_network.png'):
-    """Visualize the network using NetworkX and Matplotlib"""
-    # Create output directory if it doesn't exist
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    
-    plt.figure(figsize=(20, 20))
-    
+def compute_layout(G, positions_file='output_data/layout_positions.json', iterations=2000,
+                   warm_iterations=300, warm_share=0.9):
+    """
+    ForceAtlas2 layout, warm-started from the positions of the previous run.
+
+    Positions are saved by DID (handle on non-interned graphs). If at least
+    `warm_share` of the nodes already had a position, only `warm_iterations`
+    are run instead of `iterations`.
+    """
     # Initialize ForceAtlas2 with custom settings
-    forceatlas2 = ForceAtlas2(
+    forceatlas2 = ForceAtlas2Layout(
         # Behavior alternatives
-        outboundAttractionDistribution=True,  # Dissuade hubs
-        linLogMode=False,  # Not implemented yet
-        adjustSizes=False,  # Not implemented yet
-        edgeWeightInfluence=0.0,  # Ignore edge weights for more even spacing
+        outbound_attraction_distribution=True,  # Dissuade hubs
+        lin_log_mode=False,
+        edge_weight_influence=0.0,  # Ignore edge weights for more even spacing
 
         # Performance
-        jitterTolerance=2.0,  # Increased for more movement
-        barnesHutOptimize=True,
-        barnesHutTheta=2.0,  # Increased for faster convergence
-        multiThreaded=False,  # Not implemented yet
+        jitter_tolerance=2.0,  # Increased for more movement
 
         # Tuning
-        scalingRatio=20.0,  # Significantly increased for more spacing
-        strongGravityMode=True,  # Keep components together
+        scaling_ratio=20.0,  # Significantly increased for more spacing
+        strong_gravity_mode=True,  # Keep components together
         gravity=0.5,  # Reduced to allow more expansion
 
         # Log
         verbose=True
     )
-    
-    # Calculate layout using ForceAtlas2
+
     print("\nCalculating network layout...")
-    # Convert to scipy sparse matrix first
-    A = nx.adjacency_matrix(G)
-    pos = forceatlas2.forceatlas2(A, pos=None, iterations=2000)
-    
+    nodes = list(G.nodes())
+    keys = [stable_key(G, node) for node in nodes]
+    A = nx.adjacency_matrix(G, nodelist=nodes, weight=None)
+    pos, known_share = initial_positions(keys, A, load_positions(positions_file))
+    if pos is not None and known_share >= warm_share:
+        print(f"Warm start from the previous layout ({known_share:.0%} of nodes placed)")
+        iterations = warm_iterations
+    pos = forceatlas2.layout(A, pos=pos, iterations=iterations)
+    save_positions(positions_file, keys, pos)
+
     # Convert positions back to dictionary format
-    pos = {node: pos[i] for i, node in enumerate(G.nodes())}
+    return {node: pos[i] for i, node in enumerate(nodes)}
+
+def visualize_network(G, communities, output_file='output_data/bluesky_network.png', cache=None,
+                      positions_file='output_data/layout_positions.json', max_labels=100, max_edges=20000,
+                      dpi=300, seed=42, centrality=None, pos=None):
+    """
+    Visualize the network using Matplotlib
+
+    Edges are drawn as one LineCollection and nodes as one scatter, so the
+    number of artists does not grow with the graph.
+
+    :param max_labels: Label only this many nodes, the most central by degree
+    :param max_edges: Level of detail: draw a centrality-weighted sample of at most this many edges
+    :param centrality: Metrics already computed by compute_centrality
+    :param pos: Positions already computed by compute_layout
+    """
+    # Create output directory if it doesn't exist
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    
+    # A figure of its own rather than pyplot's global state, so it can be drawn on any thread
+    fig = Figure(figsize=(20, 20))
+    FigureCanvasAgg(fig)
+    
+    if pos is None:
+        pos = compute_layout(G, positions_file)
     
+    nodes = list(G.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    xy = np.array([pos[node] for node in nodes]).reshape(-1, 2)
+    is_source = np.array([G.nodes[node]['node_type'] == 'source' for node in nodes], dtype=bool)
+
     # Create a color map for communities
     num_communities = len(communities)
-    color_map = plt.colormaps['Set3'](np.linspace(0, 1, num_communities))
+    color_map = matplotlib.colormaps['Set3'](np.linspace(0, 1, max(num_communities, 1)))
     
-    # Assign colors to nodes based on their community
-    node_colors = []
-    for node in G.nodes():
-        if G.nodes[node]['node_type'] == 'source':
-            node_colors.append('red')  # Keep source node red
-        else:
-            # Find which community this node belongs to
-            for idx, community in enumerate(communities):
-                if node in community:
-                    node_colors.append(color_map[idx])
-                    break
+    # Assign colors to nodes based on their community (one dict lookup per node)
+    community_map = {node: idx for idx, community in enumerate(communities) for node in community}
+    node_colors = np.array([color_map[community_map[node]] if node in community_map else (0.7, 0.7, 0.7, 1.0)
+                            for node in nodes]).reshape(-1, 4)
+    node_colors[is_source] = (1.0, 0.0, 0.0, 1.0)  # Keep source node red
     
     # Calculate node sizes based on degree centrality
-    degree_centrality = nx.degree_centrality(G)
-    node_sizes = [3000 if G.nodes[node]['node_type'] == 'source' else 
-                  200 + 3000 * degree_centrality[node] for node in G.nodes()]
-    
-    # Draw nodes
-    nx.draw_networkx_nodes(G, pos,
-                          node_color=node_colors,
-                          node_size=node_sizes,
-                          alpha=0.6)
-    
-    # Draw edges with arrows
-    nx.draw_networkx_edges(G, pos,
-                          edge_color='gray',
-                          arrows=True,
-                          arrowsize=10,
-                          alpha=0.2,  # Reduced edge alpha for better visibility
-                          width=0.5)
-    
-    # Draw labels with font size based on degree centrality
-    labels = {node: node for node in G.nodes()}
+    degree_cent = centrality['degree'] if centrality is not None else degree_centrality(G, cache)
+    betweenness_cent = centrality['betweenness'] if centrality is not None else None
+    centrality_values = np.array([degree_cent[node] for node in nodes])
+    node_sizes = np.where(is_source, 3000, 200 + 3000 * centrality_values)
     
+    ax = fig.add_subplot()
+
+    # Draw edges as a single LineCollection; on large graphs keep a sample
+    # biased towards edges between central nodes (level of detail)
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    if len(edges) > max_edges:
+        weight = centrality_values[edges[:, 0]] + centrality_values[edges[:, 1]] + 1e-12
+        keep = np.random.default_rng(seed).choice(len(edges), size=max_edges, replace=False,
+                                                  p=weight / weight.sum())
+        print(f"Drawing {max_edges} of {len(edges)} edges")
+        edges = edges[keep]
+    ax.add_collection(LineCollection(xy[edges], colors='gray',
+                                     alpha=0.2,  # Reduced edge alpha for better visibility
+                                     linewidths=0.5, zorder=1))
+
+    # Draw nodes as a single scatter
+    ax.scatter(xy[:, 0], xy[:, 1], s=node_sizes, c=node_colors, alpha=0.6, linewidths=0, zorder=2)
+    
+    # Label only the top nodes by degree centrality (the source node always)
+    labelled = np.argsort(-centrality_values, kind='stable')[:max_labels]
+    labelled = np.union1d(labelled, np.flatnonzero(is_source)).astype(np.int64)
+
     # Calculate font sizes: minimum 4, maximum 12, scaled by degree centrality
-    font_sizes = {}
     min_font, max_font = 4, 12
-    min_cent = min(degree_centrality.values())
-    max_cent = max(degree_centrality.values())
-    
-    for node in G.nodes():
-        if G.nodes[node]['node_type'] == 'source':
-            font_sizes[node] = max_font  # Source node gets maximum font size
+    min_cent = centrality_values.min() if len(centrality_values) else 0.0
+    max_cent = centrality_values.max() if len(centrality_values) else 0.0
+    for i in labelled:
+        if is_source[i]:
+            font_size = max_font  # Source node gets maximum font size
         else:
             # Scale font size between min_font and max_font based on degree centrality
-            scale = (degree_centrality[node] - min_cent) / (max_cent - min_cent)
-            font_sizes[node] = min_font + scale * (max_font - min_font)
-    
-    # Draw labels for each node with its calculated font size
-    for node, font_size in font_sizes.items():
-        nx.draw_networkx_labels(G, pos,
-                              {node: node},
-                              font_size=font_size,
-                              font_weight='bold')
+            scale = (centrality_values[i] - min_cent) / (max_cent - min_cent) if max_cent > min_cent else 0.0
+            font_size = min_font + scale * (max_font - min_font)
+        ax.text(xy[i, 0], xy[i, 1], node_label(G, nodes[i]), fontsize=font_size, fontweight='bold',
+                ha='center', va='center', zorder=3)
+    ax.autoscale_view()
     
-    plt.title("Bluesky Follow Network\nColored by Communities", fontsize=16, pad=20)
-    plt.axis('off')
+    ax.set_title("Bluesky Follow Network\nColored by Communities", fontsize=16, pad=20)
+    ax.axis('off')
     
     # Save the plot
-    print(f"Saving visualization...")
-    plt.savefig(output_file, dpi=300, bbox_inches='tight')
-    plt.close()
+    print("Saving visualization...")
+    fig.savefig(output_file, dpi=dpi, bbox_inches='tight')
     
     print(f"\nNetwork visualization has been saved as '{output_file}'")
-    print(f"\nNetwork Statistics:")
+    print("\nNetwork Statistics:")
     print(f"Number of nodes: {G.number_of_nodes()}")
     print(f"Number of edges: {G.number_of_edges()}")
-    print(f"Number of communities detected: {len(communities)}")
+    print(f"Number of communities detected: {sum(1 for community in communities if community)}")
     
     # Calculate and print some network metrics
     print("\nTop 5 accounts by degree centrality:")
-    degree_cent = nx.degree_centrality(G)
     top_degree = sorted(degree_cent.items(), key=lambda x: x[1], reverse=True)[:5]
-    for node, centrality in top_degree:
-        print(f"{node}: {centrality:.3f}")
+    for node, score in top_degree:
+        print(f"{node_label(G, node)}: {score:.3f}")
 
     # Calculate and print betweenness centrality
     print("\nTop 5 accounts by betweenness centrality:")
-    betweenness_cent = nx.betweenness_centrality(G)
+    if betweenness_cent is None:
+        betweenness_cent = betweenness_centrality(G, cache)
     top_betweenness = sorted(betweenness_cent.items(), key=lambda x: x[1], reverse=True)[:5]
-    for node, centrality in top_betweenness:
-        print(f"{node}: {centrality:.3f}")
+    for node, score in top_betweenness:
+        print(f"{node_label(G, node)}: {score:.3f}")
 
 
 def main():
@@ -210,20 +276,30 @@ def main():
     main_json_path = 'bluesky_data/following.json'
     network_dir = 'bluesky_data/following_network'
     
-    # Load the data
-    main_following, network_data = load_network_data(main_json_path, network_dir)
-    
-    # Create the network graph
-    G = create_network_graph(main_following, network_data)
+    # Open the compiled network graph (rebuilt only when the data changed); the
+    # analysis below uses NetworkX
+    with stage('open_graph'):
+        G = open_graph(main_json_path, network_dir).to_networkx()
+
+    # Posts and join dates come from the profiles cached by bluesky_download.py
+    with stage('hydrate_profiles'):
+        hydrate_profiles(G)
     
+    # Centralities are computed once and shared by the export and the visualization
+    cache = MetricsCache()
+
     # Detect communities
-    communities = detect_communities(G)
+    with stage('detect_communities'):
+        communities = detect_communities(G)
 
     # Export node information    
-    export_nodes(G, communities)
+    with stage('export_nodes'):
+        export_nodes(G, communities, cache=cache)
 
     # Visualize the network
-    visualize_network(G, communities)
+    with stage('visualize_network'):
+        visualize_network(G, communities, cache=cache)
+    save_metrics('network_visualization')
 
 if __name__ == "__main__":
     main()
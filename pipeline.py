@@ -0,0 +1,411 @@
+import os
+import json
+import glob
+import pickle
+import shutil
+import hashlib
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from build_graph import load_network_data_from_store, stream_network_data
+from embeddings import update_index
+from graph_export import export_graph
+from graph_snapshot import open_graph, source_fingerprint
+from instrumentation import save_metrics, stage as timed_stage
+from metrics import MetricsCache
+from network_visualization import (compute_centrality, compute_layout, detect_communities, export_nodes,
+                                   visualize_network)
+from profile_cache import hydrate_profiles
+from recommend_accounts import recommend_accounts
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    run(*inputs, **params) is called with the outputs of the `inputs` stages.
+    The stage's key hashes its name, version, params, `sources` (a fingerprint
+    of files read directly) and the keys of its inputs, so it changes exactly
+    when something the output depends on changes. `sources` may be a callable,
+    evaluated once the input stages have run (e.g. after a crawl stage wrote
+    new files). With `cache`, outputs are pickled under that key; `produces`
+    lists files the stage writes, which must still exist for a cached result
+    to count. `state` lists files the stage reads as a warm start and rewrites
+    (see Pipeline).
+    """
+
+    def __init__(self, name, run, inputs=(), params=None, sources=None, cache=True, produces=(), state=(),
+                 version=1):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.params = params or {}
+        self.sources = sources
+        self.cache = cache
+        self.produces = tuple(produces)
+        self.state = tuple(state)
+        self.version = version
+
+    def key(self, input_keys, sources=None, state=None):
+        description = {'stage': self.name, 'version': self.version, 'params': self.params,
+                       'sources': sources, 'state': state, 'inputs': list(input_keys)}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _file_digest(path):
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    Stages run as a DAG with content-addressed caching.
+
+    A stage runs only when its key has no cached output (or it is not
+    cacheable and a stage that has to run needs its output). Stages whose
+    inputs are ready run in parallel on a thread pool; NumPy, SciPy and file
+    I/O release the GIL, and betweenness can use its own process pool. Stages
+    must not modify their inputs, which other stages may be reading.
+
+    Warm-start `state` files are part of a stage's key. The state a stage
+    consumed is frozen in the cache when its other inputs change, and put
+    back before a rerun with the same inputs, so a cached output always
+    matches what a rerun would produce.
+    """
+
+    def __init__(self, stages, cache_dir='output_data/pipeline_cache', workers=4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.keys = {}
+        self._base_keys = {}  # Keys without the warm-start state
+        self.results = {}
+        listed = set()
+        for stage in stages:  # Stages are listed in dependency order
+            missing = [name for name in stage.inputs if name not in listed]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on stages not listed before it: {missing}")
+            listed.add(stage.name)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name, f"{self.keys[name]}.pkl")
+
+    def _state_dir(self, name):
+        return os.path.join(self.cache_dir, name, 'state')
+
+    def _state_record(self, name):
+        """Base key of the inputs the frozen state was consumed for, or None"""
+        path = os.path.join(self._state_dir(name), 'state.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['key']
+
+    def _consumed_state(self, name):
+        """Paths of the state files a run of `name` with its current inputs reads"""
+        stage = self.stages[name]
+        if self._state_record(name) == self._base_keys[name]:
+            return [os.path.join(self._state_dir(name), os.path.basename(path)) for path in stage.state]
+        return list(stage.state)
+
+    def _prepare_state(self, name):
+        """Freeze the live state files for new inputs, or restore the frozen ones for a rerun"""
+        stage = self.stages[name]
+        state_dir = self._state_dir(name)
+        frozen = [os.path.join(state_dir, os.path.basename(path)) for path in stage.state]
+        restore = self._state_record(name) == self._base_keys[name]
+        if not restore:
+            shutil.rmtree(state_dir, ignore_errors=True)
+            os.makedirs(state_dir)
+        for live, copy in zip(stage.state, frozen):
+            source, target = (copy, live) if restore else (live, copy)
+            if os.path.exists(source):
+                shutil.copyfile(source, target)
+            elif os.path.exists(target):
+                os.remove(target)
+        if not restore:
+            with open(os.path.join(state_dir, 'state.json'), 'w', encoding='utf-8') as f:
+                json.dump({'key': self._base_keys[name]}, f)
+
+    def _resolve_keys(self, force=()):
+        for stage in self.stages.values():
+            sources = stage.sources
+            if callable(sources):
+                if stage.inputs:
+                    # The sources are only current once the input stages ran
+                    self._execute(self.plan(stage.inputs, force))
+                sources = sources()
+            input_keys = [self.keys[name] for name in stage.inputs]
+            self._base_keys[stage.name] = stage.key(input_keys, sources)
+            state = None
+            if stage.state:
+                state = [_file_digest(path) for path in self._consumed_state(stage.name)]
+            self.keys[stage.name] = stage.key(input_keys, sources, state)
+
+    def cached(self, name):
+        stage = self.stages[name]
+        return (stage.cache and os.path.exists(self._path(name))
+                and all(os.path.exists(path) for path in stage.produces))
+
+    def _load(self, name):
+        with open(self._path(name), 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, name, value):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        for old in glob.glob(os.path.join(os.path.dirname(path), '*.pkl')):
+            if old != path:
+                os.remove(old)  # Outputs of earlier keys are never read again
+
+    def default_targets(self):
+        """Every cacheable stage; the others only run when a stage that runs needs their output"""
+        return [name for name, stage in self.stages.items() if stage.cache]
+
+    def plan(self, targets=None, force=()):
+        """Stages that have to run to produce `targets` (see default_targets), in dependency order"""
+        to_run = set()
+
+        def require(name):
+            if name in to_run or name in self.results:
+                return
+            if name not in force and self.cached(name):
+                return
+            to_run.add(name)
+            for dependency in self.stages[name].inputs:
+                require(dependency)
+
+        for name in targets or self.default_targets():
+            require(name)
+        return [name for name in self.stages if name in to_run]
+
+    def _execute(self, to_run):
+        """Run the stages in `to_run`, loading the cached outputs they need, into self.results"""
+        results = self.results
+        for name in to_run:
+            for dependency in self.stages[name].inputs:
+                if dependency not in to_run and dependency not in results:
+                    results[dependency] = self._load(dependency)
+
+        def execute(name):
+            stage = self.stages[name]
+            if stage.state:
+                self._prepare_state(name)
+            with timed_stage(name):
+                value = stage.run(*(results[dependency] for dependency in stage.inputs), **stage.params)
+            if stage.cache:
+                self._save(name, value)
+            return value
+
+        pending = list(to_run)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for name in list(pending):
+                    if all(dependency in results for dependency in self.stages[name].inputs):
+                        pending.remove(name)
+                        running[pool.submit(execute, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        raise
+
+    def run(self, targets=None, force=()):
+        """
+        Run the stages needed for `targets` and return the outputs that were
+        computed or loaded, by stage name.
+
+        :param force: Stage names to rerun even if their output is cached
+        """
+        self.results = {}
+        self._resolve_keys(force)
+        to_run = self.plan(targets, force)
+        skipped = [name for name in (targets or self.default_targets()) if name not in to_run]
+        print(f"Pipeline: {len(to_run)} stages to run ({', '.join(to_run) or 'none'}), "
+              f"{len(skipped)} up to date")
+        self._execute(to_run)
+        return self.results
+
+
+class SharedLoad:
+    """Parses the crawl data at most once, for whichever graph snapshot needs compiling first"""
+
+    def __init__(self, main_json_path, network_dir, store_path=None):
+        self.main_json_path = main_json_path
+        self.network_dir = network_dir
+        self.store_path = store_path
+        self._data = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self._data is None:
+                if self.store_path:
+                    self._data = load_network_data_from_store(self.store_path)
+                else:
+                    with open(self.main_json_path, 'r', encoding='utf-8') as f:
+                        main_following = json.load(f)
+                    self._data = (main_following, list(stream_network_data(self.network_dir).follow_lists()))
+            return self._data
+
+
+def _file_fingerprint(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _export_nodes(G, communities, centrality, output_file, profile_cache):
+    # Only the CSV uses the profile counts, so hydration is part of this stage
+    # and a refreshed profile cache does not invalidate the metrics. Other
+    # stages read G on other threads, so the counts go on a copy
+    G = G.copy()
+    hydrate_profiles(G, cache_path=profile_cache)
+    export_nodes(G, communities, output_file, centrality=centrality)
+    return output_file
+
+
+def _render(G, communities, centrality, pos, output_file, **options):
+    visualize_network(G, communities, output_file, centrality=centrality, pos=pos, **options)
+    return output_file
+
+
+def _export(G, output_file):
+    export_graph(G, output_file)
+    return output_file
+
+
+def _embed(G, index_dir, dim):
+    update_index(G, index_dir, dim)
+    return index_dir
+
+
+def _crawl(data_dir, store_path):
+    from bluesky_download import download_bluesky_network
+    username = input("Enter your Bluesky handle (e.g., username.bsky.social): ").strip()
+    password = input("Enter your Bluesky App Password (create one at Settings > App Passwords): ").strip()
+    download_bluesky_network(username, password, output_dir=data_dir, concurrency=8, store_path=store_path,
+                             refresh=True, hydrate=True)
+
+
+def analysis_stages(data_dir='bluesky_data', output_dir='output_data', store_path=None, crawl=False,
+                    source_user="user", betweenness='exact', layout_iterations=2000, max_labels=100, max_edges=20000,
+                    dpi=300, embedding_dim=64, seed=42):
+    """
+    The analysis as pipeline stages: optionally a crawl, graph snapshots,
+    communities, centrality and layout, then the node CSV, the visualization,
+    the GraphML exports, the recommendations and the embedding index.
+
+    :param crawl: Start with a crawl stage (asks for credentials); it always
+                  runs, and the graph stages fingerprint the source files after it
+    """
+    main_json_path = os.path.join(data_dir, "following.json")
+    network_dir = os.path.join(data_dir, "following_network")
+    profile_cache = os.path.join(data_dir, "profile_cache.json")
+    load = SharedLoad(main_json_path, network_dir, store_path)
+    metrics_cache = MetricsCache(os.path.join(output_dir, 'metrics_cache'))
+
+    def sources():
+        return source_fingerprint(main_json_path, network_dir, store_path)
+
+    def graph(*crawled, include_secondary_follows):
+        # The crawl stage's output (if any) only orders this stage after it
+        snapshot_dir = os.path.join(output_dir, 'graph_snapshot_extended' if include_secondary_follows
+                                    else 'graph_snapshot')
+        return open_graph(main_json_path, network_dir, include_secondary_follows, store_path, snapshot_dir, load)
+
+    nodes_file = os.path.join(output_dir, 'nodes_info.csv')
+    image_file = os.path.join(output_dir, 'bluesky_network.png')
+    graphml_file = os.path.join(output_dir, 'bluesky_network.graphml')
+    graphml_extended_file = os.path.join(output_dir, 'bluesky_network_extended.graphml')
+    index_dir = os.path.join(output_dir, 'embedding_index')
+    communities_state = os.path.join(output_dir, 'communities_state.npz')
+    layout_positions = os.path.join(output_dir, 'layout_positions.json')
+    crawl_stages = [Stage('crawl', _crawl, params={'data_dir': data_dir, 'store_path': store_path}, cache=False)] \
+        if crawl else []
+    graph_inputs = ['crawl'] if crawl else []
+    # The compiled snapshots are the cache of the graph stages
+    return crawl_stages + [
+        Stage('graph', graph, inputs=graph_inputs, params={'include_secondary_follows': False}, sources=sources,
+              cache=False),
+        Stage('graph_extended', graph, inputs=graph_inputs, params={'include_secondary_follows': True},
+              sources=sources, cache=False),
+        Stage('network', lambda G: G.to_networkx(), inputs=['graph'], cache=False),
+        # Communities and layout warm-start from the previous run's partition and positions
+        Stage('communities', lambda G, seed: detect_communities(G, seed=seed, state_file=communities_state),
+              inputs=['network'], params={'seed': seed}, state=[communities_state]),
+        Stage('centrality', lambda G, betweenness: compute_centrality(G, metrics_cache, betweenness),
+              inputs=['network'], params={'betweenness': betweenness}),
+        Stage('layout', lambda G, iterations: compute_layout(G, layout_positions, iterations=iterations),
+              inputs=['network'], params={'iterations': layout_iterations}, state=[layout_positions]),
+        Stage('export_nodes', _export_nodes, inputs=['network', 'communities', 'centrality'],
+              params={'output_file': nodes_file, 'profile_cache': profile_cache},
+              sources=lambda: _file_fingerprint(profile_cache), produces=[nodes_file]),
+        Stage('render', _render, inputs=['network', 'communities', 'centrality', 'layout'],
+              params={'output_file': image_file, 'max_labels': max_labels, 'max_edges': max_edges, 'dpi': dpi,
+                      'seed': seed},
+              produces=[image_file]),
+        Stage('export_graphml', _export, inputs=['graph'], params={'output_file': graphml_file},
+              produces=[graphml_file]),
+        Stage('export_graphml_extended', _export, inputs=['graph_extended'],
+              params={'output_file': graphml_extended_file}, produces=[graphml_extended_file]),
+        Stage('recommendations', lambda G, source_user, scores: recommend_accounts(G, source_user, scores=scores),
+              inputs=['graph_extended'], params={'source_user': source_user, 'scores': ['jaccard', 'adamic_adar']}),
+        # The index refreshes itself incrementally when the graph changed little
+        Stage('embeddings', _embed, inputs=['graph_extended'], params={'index_dir': index_dir, 'dim': embedding_dim},
+              produces=[os.path.join(index_dir, 'manifest.json')]),
+    ]
+
+
+def run_pipeline(data_dir='bluesky_data', output_dir='output_data', store_path=None, crawl=False, targets=None,
+                 force=(), workers=4, **options):
+    """
+    Run every analysis stage whose inputs or parameters changed since the last run.
+
+    :param crawl: Run bluesky_download.py as the first stage (asks for credentials); the
+                  analysis stages then see the new data through the source fingerprint
+    :param targets: Stage names to produce (defaults to all)
+    :param options: Stage parameters passed to analysis_stages (betweenness, layout_iterations, dpi, ...)
+    """
+    pipeline = Pipeline(analysis_stages(data_dir, output_dir, store_path, crawl, **options),
+                        cache_dir=os.path.join(output_dir, 'pipeline_cache'), workers=workers)
+    results = pipeline.run(targets, force)
+    save_metrics('pipeline', os.path.join(output_dir, 'metrics'))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the analysis, skipping stages whose inputs did not change")
+    parser.add_argument('--data-dir', default='bluesky_data')
+    parser.add_argument('--output-dir', default='output_data')
+    parser.add_argument('--store', help="Read the crawl from this SQLite crawl store")
+    parser.add_argument('--crawl', action='store_true', help="Download new data before the analysis")
+    parser.add_argument('--targets', nargs='+', help="Only produce these stages (and what they need)")
+    parser.add_argument('--force', nargs='+', default=[], help="Rerun these stages even if they are cached")
+    parser.add_argument('--workers', type=int, default=4, help="Stages run at the same time")
+    parser.add_argument('--betweenness', choices=['exact', 'approximate'], default='exact')
+    parser.add_argument('--layout-iterations', type=int, default=2000)
+    parser.add_argument('--max-labels', type=int, default=100)
+    parser.add_argument('--max-edges', type=int, default=20000)
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--embedding-dim', type=int, default=64)
+    args = parser.parse_args()
+
+    run_pipeline(args.data_dir, args.output_dir, args.store, args.crawl, args.targets, args.force, args.workers,
+                 betweenness=args.betweenness, layout_iterations=args.layout_iterations,
+                 max_labels=args.max_labels, max_edges=args.max_edges, dpi=args.dpi, embedding_dim=args.embedding_dim)
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import asyncio
+
+from async_crawler import call_with_retries
+from bluesky_client import create_async_client
+from delta_crawl import PROFILES_PER_REQUEST
+from interning import SOURCE_USER
+from metrics import stable_key
+from rate_limit import TokenBucket
+
+# Profile fields attached to graph nodes by hydrate_profiles
+HYDRATED_FIELDS = ('followers_count', 'follows_count', 'posts_count', 'created_at')
+
+
+class ProfileCache:
+    """
+    Full profiles (counts and creation date) by DID, kept in a JSON file.
+
+    Entries older than `ttl` seconds are refetched by refresh_profiles but
+    are still used when no fresh copy can be fetched.
+    """
+
+    def __init__(self, path='bluesky_data/profile_cache.json', ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        self._handles = {entry['handle']: did for did, entry in self.entries.items()}
+
+    def get(self, actor):
+        """Cached profile of a DID or handle, fresh or not, or None"""
+        return self.entries.get(actor) or self.entries.get(self._handles.get(actor))
+
+    def stale(self, actors):
+        """Actors that are missing from the cache or older than the TTL"""
+        now = time.time()
+        stale = []
+        for actor in actors:
+            entry = self.get(actor)
+            if entry is None or now - entry['fetched_at'] > self.ttl:
+                stale.append(actor)
+        return stale
+
+    def update(self, profiles):
+        now = time.time()
+        for profile in profiles:
+            entry = {field: profile.get(field) for field in HYDRATED_FIELDS}
+            entry.update(handle=profile['handle'], fetched_at=now)
+            self.entries[profile['did']] = entry
+            self._handles[profile['handle']] = profile['did']
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+
+
+async def fetch_profiles_async(client, actors, limiter, concurrency=4):
+    """
+    Fetch full profiles with app.bsky.actor.get_profiles, 25 actors per request,
+    at most `concurrency` requests in flight.
+
+    :return: List of profile dicts (actors that no longer resolve are left out)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = [actors[i:i + PROFILES_PER_REQUEST] for i in range(0, len(actors), PROFILES_PER_REQUEST)]
+
+    async def fetch(i, batch):
+        async with semaphore:
+            try:
+                response = await call_with_retries(limiter, client.app.bsky.actor.get_profiles,
+                                                   {'actors': batch})
+            except Exception as e:
+                print(f"Error fetching profile batch {i + 1}/{len(batches)}: {str(e)}")
+                return []
+        return [profile.model_dump() for profile in response.profiles]
+
+    results = await asyncio.gather(*(fetch(i, batch) for i, batch in enumerate(batches)))
+    return [profile for batch in results for profile in batch]
+
+
+def refresh_profiles(session_string, actors, cache, concurrency=4, rate_limit=8.0):
+    """Fetch the profiles of `actors` (DIDs or handles) that are not cached or expired, and save the cache"""
+    stale = cache.stale(actors)
+    print(f"Fetching {len(stale)} of {len(actors)} profiles "
+          f"({-(-len(stale) // PROFILES_PER_REQUEST)} requests)...")
+    if not stale:
+        return
+
+    async def run():
+        client = create_async_client()
+        await client.login(session_string=session_string)
+        return await fetch_profiles_async(client, stale, TokenBucket(rate_limit), concurrency)
+
+    cache.update(asyncio.run(run()))
+    cache.save()
+
+
+def hydrate_profiles(G, cache_path='bluesky_data/profile_cache.json', session_string=None,
+                     ttl=7 * 24 * 3600, concurrency=4, rate_limit=8.0):
+    """
+    Attach followers, follows and posts counts and the creation date to the nodes of G.
+
+    With a `session_string` (from Client.export_session_string()), profiles
+    that are missing from the cache or older than `ttl` are fetched first;
+    without one, only cached profiles are used.
+
+    :return: Number of nodes that got profile data
+    """
+    cache = ProfileCache(cache_path, ttl)
+    nodes = [node for node in G.nodes() if stable_key(G, node) != SOURCE_USER]
+    if session_string:
+        refresh_profiles(session_string, [stable_key(G, node) for node in nodes], cache,
+                         concurrency=concurrency, rate_limit=rate_limit)
+
+    hydrated = 0
+    for node in nodes:
+        entry = cache.get(stable_key(G, node))
+        if entry is None:
+            continue
+        for field in HYDRATED_FIELDS:
+            if entry.get(field) is not None:
+                G.nodes[node][field] = entry[field]
+        hydrated += 1
+    print(f"Profile data attached to {hydrated} of {G.number_of_nodes()} nodes")
+    return hydrated
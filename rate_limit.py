@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import time
+
+from instrumentation import count
+
+
+class TokenBucket:
+    """Token-bucket rate limiter that can be shared between concurrent requests.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. A caller
+    that finds the bucket empty reserves the next token anyway and sleeps until
+    it becomes available, so waiting callers are served in arrival order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take one token and return how long the caller has to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """Block the current thread until a token is available"""
+        wait = self._reserve()
+        if wait > 0:
+            count('rate_limit_sleep_seconds', wait)
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """Wait (without blocking the event loop) until a token is available"""
+        wait = self._reserve()
+        if wait > 0:
+            count('rate_limit_sleep_seconds', wait)
+            await asyncio.sleep(wait)
+        return wait
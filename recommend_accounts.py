@@ -1,69 +1,210 @@
-import networkx as nx
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from scipy import sparse
 
-from build_graph import create_network_graph, load_network_data
+from csr_graph import CSRGraph
+from graph_snapshot import StringTable, open_graph
+from instrumentation import save_metrics, stage
 
-def recommend_accounts(G, source_user="user", num_recommendations=10):
-    """Recommend accounts based on Jaccard similarity"""
+SCORES = ('common_neighbors', 'jaccard', 'adamic_adar', 'resource_allocation')
 
-    # Convert directed graph to undirected
-    print("Converting graph to undirected...")
-    undirected_G = G.to_undirected()
+def filtered_adjacency(graph, min_degree=2):
+    """Undirected adjacency with nodes of (directed) degree below `min_degree` removed"""
+    keep = (graph.degree() >= min_degree).astype(np.float32)
+    mask = sparse.diags(keep)
+    A = (mask @ graph.undirected_adjacency() @ mask).tocsr()
+    A.eliminate_zeros()
+    return A
+
+def link_prediction_scores(A, sources, scores=SCORES):
+    """
+    Score every node against each source in one pass of sparse products.
+
+    Row i of each returned matrix holds the scores of all nodes two hops away
+    from sources[i]; the sources themselves and their current neighbors are
+    removed, and every other node has a score of 0.
+
+    :param A: Symmetric 0/1 CSR adjacency (see filtered_adjacency)
+    :param sources: Node positions to score against
+    :param scores: Names from SCORES
+    :return: Dict mapping score name -> sparse CSR matrix of shape (len(sources), n)
+    """
+    unknown = set(scores) - set(SCORES)
+    if unknown:
+        raise ValueError(f"Unknown scores: {', '.join(sorted(unknown))}")
+
+    sources = np.asarray(sources)
+    rows = A[sources]
+    degree = np.asarray(A.sum(axis=1), dtype=np.float64).ravel()
+
+    # Existing neighbors and the sources themselves are not recommended
+    excluded = (rows + sparse.csr_matrix((np.ones(len(sources), dtype=np.float32),
+                                          (np.arange(len(sources)), sources)), shape=rows.shape)).tocsr()
+    excluded.data[:] = 1.0
+
+    def weighted_paths(weights):
+        result = (rows @ sparse.diags(weights) @ A).tocsr()
+        result = (result - result.multiply(excluded)).tocsr()
+        result.eliminate_zeros()
+        return result
+
+    results = {}
+    if 'common_neighbors' in scores or 'jaccard' in scores:
+        common = weighted_paths(np.ones_like(degree))
+        if 'common_neighbors' in scores:
+            results['common_neighbors'] = common
+        if 'jaccard' in scores:
+            # |N(u) & N(v)| / |N(u) | N(v)|, computed on the nonzero entries only
+            row_of = np.repeat(np.arange(common.shape[0]), np.diff(common.indptr))
+            union = degree[sources][row_of] + degree[common.indices] - common.data
+            jaccard = common.copy()
+            jaccard.data = common.data / union
+            results['jaccard'] = jaccard
+    if 'adamic_adar' in scores:
+        # Common neighbors always have degree >= 2, so log(degree) > 0 where it matters
+        with np.errstate(divide='ignore'):
+            weights = np.where(degree > 1, 1.0 / np.log(np.maximum(degree, 2)), 0.0)
+        results['adamic_adar'] = weighted_paths(weights)
+    if 'resource_allocation' in scores:
+        weights = np.where(degree > 0, 1.0 / np.maximum(degree, 1), 0.0)
+        results['resource_allocation'] = weighted_paths(weights)
+    return results
+
+def top_k(scores, k):
+    """Top-k (column, score) pairs of every row of a sparse score matrix, best first"""
+    result = []
+    for i in range(scores.shape[0]):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        data = scores.data[start:end]
+        if len(data) > k:
+            best = np.argpartition(-data, k - 1)[:k]
+        else:
+            best = np.arange(len(data))
+        best = best[np.argsort(-data[best], kind='stable')]
+        result.append(list(zip(scores.indices[start:end][best], data[best])))
+    return result
+
+def recommend_accounts(G, source_user="user", num_recommendations=10, scores="adamic_adar"):
+    """
+    Recommend accounts that are two hops away from `source_user`.
+
+    :param G: nx.DiGraph (handle-keyed or interned) or CSRGraph
+    :param scores: A score name from SCORES, or a list of them
+    :return: List of (handle, score) pairs for a single score name, or a dict
+             mapping each requested score name to such a list. Only accounts
+             with a nonzero score are returned.
+    """
+    graph = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    source = graph.index_of(source_user)
+    names = [scores] if isinstance(scores, str) else list(scores)
 
     # Filter nodes for performance
-    # print nr. of nodes
-    print("Filtering nodes for performance...", )
-    print(f"Number of nodes before filtering: {len(undirected_G.nodes)}")
-    filtered_nodes = [node for node in G.nodes if G.degree[node] < 2]
-    undirected_G.remove_nodes_from(filtered_nodes)
-    print(f"Number of nodes after filtering: {len(undirected_G.nodes)}")
-
-    # Get all nodes that are not connected to the source user
-    print("Getting all nodes that are not connected to the source user...")
-    all_nodes = set(undirected_G.nodes)
-    source_user_neighbors = set(undirected_G.neighbors(source_user))
-    other_nodes = all_nodes - source_user_neighbors - {source_user}
-
-    # List of pairs with user and other_nodes
-    print("Creating list of pairs with user and other nodes...")
-    pairs = [(source_user, node) for node in other_nodes]
-
-    # Calculate Jaccard similarity between source user and all other users
-    print("Calculating Jaccard similarity...")
-    recommended_users = similarity_list(nx.jaccard_coefficient(undirected_G, ebunch=pairs), source_user, num_recommendations)
-
-    print("Calculating Adamic-Adar similarity...")
-    recommended_users = similarity_list(nx.adamic_adar_index(undirected_G, ebunch=pairs), source_user, num_recommendations)
-
-    return recommended_users
-
-def similarity_list(similarity_iterable, source_user="user", num_recommendations=10):
-    similarity_scores = {}
-    for u, v, p in similarity_iterable:
-        if u == source_user:
-            similarity_scores[v] = p
-
-    # Sort users by similarity score and return top recommendations
-    print("Sorting similarity scores...")
-    sorted_users = sorted(similarity_scores.items(), key=lambda x: x[1], reverse=True)
-    recommendations = sorted_users[:num_recommendations]
-   
-    # Print recommended accounts
-    print(f"Recommended accounts for {source_user}:")
-    for user, score in recommendations:
-        print(user, score)
-
-    return recommendations
+    print("Filtering nodes for performance...")
+    A = filtered_adjacency(graph)
+    print(f"Number of nodes before filtering: {graph.number_of_nodes()}")
+    print(f"Number of nodes after filtering: {int(np.count_nonzero(graph.degree() >= 2))}")
+
+    print(f"Calculating {', '.join(names)} scores...")
+    score_matrices = link_prediction_scores(A, [source], names)
+
+    recommendations = {}
+    for name in names:
+        ranked = top_k(score_matrices[name], num_recommendations)[0]
+        recommendations[name] = [(graph.label(node), float(score)) for node, score in ranked]
+
+        # Print recommended accounts
+        print(f"Recommended accounts for {source_user} ({name}):")
+        for user, score in recommendations[name]:
+            print(user, score)
+
+    return recommendations[scores] if isinstance(scores, str) else recommendations
+
+# Adjacency shared with pool workers, set once per process by _init_worker
+_worker_adjacency = None
+
+def _init_worker(A):
+    global _worker_adjacency
+    _worker_adjacency = A
+
+def _score_block(sources, score, k, A=None):
+    """Top-k recommendations for one block of sources, as (source, target, score) columns"""
+    A = _worker_adjacency if A is None else A
+    ranked = top_k(link_prediction_scores(A, sources, [score])[score], k)
+    counts = [len(pairs) for pairs in ranked]
+    targets = [node for pairs in ranked for node, _ in pairs]
+    values = [value for pairs in ranked for _, value in pairs]
+    return (np.repeat(np.asarray(sources, dtype=np.int32), counts),
+            np.asarray(targets, dtype=np.int32),
+            np.asarray(values, dtype=np.float32))
+
+def recommend_all(G, sources=None, num_recommendations=10, score="adamic_adar", block_size=1024,
+                  processes=None, output_file='output_data/recommendations.npz'):
+    """
+    Precompute the top-k recommendations for many accounts in one run.
+
+    Sources are scored in blocks of `block_size` rows at a time, so memory is
+    bounded by the two-hop neighborhoods of one block. With `processes`, blocks
+    are spread over a process pool. Results are saved as columns (source,
+    target, score; node positions) in a compressed .npz, together with the
+    handle of every position, and its DID for interned graphs, as UTF-8
+    string tables (see graph_snapshot.StringTable).
+
+    :param G: nx.DiGraph or CSRGraph
+    :param sources: Handles/DIDs to score (defaults to every account that survives filtering)
+    :return: Dict of the saved columns
+    """
+    graph = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    A = filtered_adjacency(graph)
+    if sources is None:
+        source_nodes = np.flatnonzero(np.diff(A.indptr))
+    else:
+        source_nodes = np.array([graph.index_of(source) for source in sources], dtype=np.int64)
+    blocks = [source_nodes[i:i + block_size] for i in range(0, len(source_nodes), block_size)]
+    print(f"Scoring {len(source_nodes)} accounts in {len(blocks)} blocks...")
+
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(A,)) as pool:
+            parts = list(pool.map(_score_block, blocks, repeat(score), repeat(num_recommendations)))
+    else:
+        parts = [_score_block(block, score, num_recommendations, A) for block in blocks]
+
+    columns = {
+        'source': np.concatenate([part[0] for part in parts]) if parts else np.empty(0, dtype=np.int32),
+        'target': np.concatenate([part[1] for part in parts]) if parts else np.empty(0, dtype=np.int32),
+        'score': np.concatenate([part[2] for part in parts]) if parts else np.empty(0, dtype=np.float32),
+    }
+    columns['handles'], columns['handles_offsets'] = StringTable.encode(
+        str(graph.label(i)) for i in range(graph.number_of_nodes()))
+    if graph.interner is not None:
+        columns['dids'], columns['dids_offsets'] = StringTable.encode(
+            graph.interner.dids[node_id] for node_id in graph.node_ids)
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    np.savez_compressed(output_file, **columns)
+    print(f"\n{len(columns['score'])} recommendations saved to '{output_file}'")
+    return columns
+
+def load_recommendations(path, account):
+    """Read the precomputed recommendations of one account, by handle or DID, from a recommend_all output file"""
+    with np.load(path) as columns:
+        handles = StringTable(columns['handles'], columns['handles_offsets'])
+        node = handles.index(account)
+        if node is None and 'dids' in columns:
+            node = StringTable(columns['dids'], columns['dids_offsets']).index(account)
+        if node is None:
+            raise KeyError(f"Unknown account: {account}")
+        rows = np.flatnonzero(columns['source'] == node)
+        return [(handles[target], float(score)) for target, score in zip(columns['target'][rows], columns['score'][rows])]
 
 if __name__ == "__main__":
-    # Define paths
-    main_json_path = 'bluesky_data/following.json'
-    network_dir = 'bluesky_data/following_network'
-    
-    # Load the data
-    main_following, network_data = load_network_data(main_json_path, network_dir)
-    
-    # Create the network graph
-    G = create_network_graph(main_following, network_data, include_secondary_follows=True)
-    
+    # Open the compiled network graph (rebuilt from bluesky_data only when it changed)
+    with stage('open_graph'):
+        G = open_graph('bluesky_data/following.json', 'bluesky_data/following_network',
+                       include_secondary_follows=True)
+
     # Recommend accounts
-    recommend_accounts(G, source_user="user")
\ No newline at end of file
+    with stage('recommend_accounts'):
+        recommend_accounts(G, source_user="user", scores=["jaccard", "adamic_adar"])
+    save_metrics('recommend_accounts')
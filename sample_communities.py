@@ -3,10 +3,14 @@ import json
 import csv
 import random
 import time
-from datetime import datetime
-from atproto import Client, models
+import asyncio
 from collections import defaultdict
 
+from async_crawler import call_with_retries
+from bluesky_client import create_async_client, create_client
+from instrumentation import count, save_metrics, stage
+from rate_limit import TokenBucket
+
 def load_community_data(csv_file):
     """Load and group handles by community from the CSV file"""
     community_members = defaultdict(list)
@@ -18,65 +22,135 @@ def load_community_data(csv_file):
             community_members[community_id].append(handle)
     return community_members
 
+def _post_data(handle, post):
+    return {
+        'handle': handle,
+        'text': post.record.text,
+        'created_at': post.record.created_at,
+        'likes': post.like_count if hasattr(post, 'like_count') else 0,
+        'reposts': post.repost_count if hasattr(post, 'repost_count') else 0,
+    }
+
 def get_recent_posts(client, handle, limit=5):
     """Get recent posts from a specific user"""
     try:
         response = client.app.bsky.feed.get_author_feed({'actor': handle, 'limit': limit})
-        posts = []
-        for feed_view in response.feed:
-            post = feed_view.post
-            post_data = {
-                'handle': handle,
-                'text': post.record.text,
-                'created_at': post.record.created_at,
-                'likes': post.like_count if hasattr(post, 'like_count') else 0,
-                'reposts': post.repost_count if hasattr(post, 'repost_count') else 0,
-            }
-            posts.append(post_data)
-        return posts
+        return [_post_data(handle, feed_view.post) for feed_view in response.feed]
     except Exception as e:
         print(f"Error fetching posts for {handle}: {str(e)}")
         return []
 
-def sample_community_posts(username, password, community_data_file, output_file='output_data/community_posts.json'):
-    """Sample recent posts from each community"""
+async def get_recent_posts_async(client, handle, limiter, limit=5):
+    """Async version of get_recent_posts that paces requests with a shared limiter"""
+    response = await call_with_retries(limiter, client.app.bsky.feed.get_author_feed,
+                                       {'actor': handle, 'limit': limit})
+    return [_post_data(handle, feed_view.post) for feed_view in response.feed]
+
+class FeedCache:
+    """Recent posts per handle, one JSON file each, reused for `ttl` seconds"""
+
+    def __init__(self, cache_dir='output_data/feed_cache', ttl=24 * 3600):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, handle):
+        return os.path.join(self.cache_dir, f"{handle}.json")
+
+    def get(self, handle, limit):
+        """Cached posts of a handle, or None if missing, expired or fetched with a smaller limit"""
+        path = self._path(handle)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        if time.time() - entry['fetched_at'] > self.ttl or entry['limit'] < limit:
+            return None
+        return entry['posts'][:limit]
+
+    def put(self, handle, limit, posts):
+        path = self._path(handle)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'fetched_at': time.time(), 'limit': limit, 'posts': posts}, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+async def sample_communities_async(client, community_members, output_file, cache, members_per_community=5,
+                                   posts_per_member=5, concurrency=16, rate_limit=8.0, seed=None):
+    """
+    Fetch the posts of sampled members of every community at once.
+
+    All requests share one token bucket and at most `concurrency` are in
+    flight. Each member's posts are appended to `output_file` as one NDJSON
+    line ({"community", "handle", "posts"}) as soon as they arrive.
+
+    :return: Dict of community ID -> (number of posts, number of members with posts)
+    """
+    rng = random.Random(seed)
+    limiter = TokenBucket(rate_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+    summary = defaultdict(lambda: [0, 0])
+    tasks = [(community_id, handle) for community_id, members in community_members.items()
+             for handle in rng.sample(members, min(members_per_community, len(members)))]
+    print(f"Sampling {len(tasks)} members from {len(community_members)} communities")
+
+    with open(output_file, 'w', encoding='utf-8') as out:
+        async def sample(community_id, handle):
+            posts = cache.get(handle, posts_per_member)
+            count('feed_cache_lookups', result='miss' if posts is None else 'hit')
+            if posts is None:
+                async with semaphore:
+                    try:
+                        posts = await get_recent_posts_async(client, handle, limiter, posts_per_member)
+                    except Exception as e:
+                        print(f"Error fetching posts for {handle}: {str(e)}")
+                        return
+                cache.put(handle, posts_per_member, posts)
+            out.write(json.dumps({'community': community_id, 'handle': handle, 'posts': posts},
+                                 ensure_ascii=False) + "\n")
+            out.flush()
+            if posts:
+                summary[community_id][0] += len(posts)
+                summary[community_id][1] += 1
+
+        await asyncio.gather(*(sample(community_id, handle) for community_id, handle in tasks))
+    return {community_id: tuple(summary[community_id]) for community_id in community_members}
+
+def sample_community_posts(username, password, community_data_file, output_file='output_data/community_posts.ndjson',
+                           members_per_community=5, concurrency=16, rate_limit=8.0,
+                           cache_dir='output_data/feed_cache', cache_ttl=24 * 3600, seed=None):
+    """
+    Sample recent posts from each community
+
+    :param output_file: NDJSON file, one line per sampled member
+    :param cache_ttl: Seconds for which a member's fetched posts are reused by later runs
+    """
     # Create client and login
-    client = Client()
+    client = create_client()
     client.login(username, password)
     
     # Load community data
     community_members = load_community_data(community_data_file)
     
-    # Sample posts from each community
-    community_posts = {}
-    for community_id, members in community_members.items():
-        print(f"\nProcessing community {community_id}")
-        community_posts[community_id] = []
-        
-        # Randomly sample up to 5 members
-        sampled_members = random.sample(members, min(5, len(members)))
-        
-        # Get posts from each sampled member
-        for handle in sampled_members:
-            print(f"  Fetching posts from {handle}")
-            posts = get_recent_posts(client, handle)
-            if posts:
-                community_posts[community_id].extend(posts)
-            time.sleep(0.5)  # Rate limiting
-    
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
-    # Save the results
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(community_posts, f, indent=2, ensure_ascii=False)
+    # Sample posts from every community concurrently
+    async def run():
+        async_client = create_async_client()
+        await async_client.login(session_string=client.export_session_string())
+        return await sample_communities_async(async_client, community_members, output_file,
+                                              FeedCache(cache_dir, cache_ttl), members_per_community,
+                                              concurrency=concurrency, rate_limit=rate_limit, seed=seed)
+
+    with stage('sample_communities'):
+        summary = asyncio.run(run())
     
     print(f"\nCommunity posts have been saved to {output_file}")
     
     # Print summary statistics
     print("\nSummary:")
-    for community_id, posts in community_posts.items():
-        print(f"Community {community_id}: {len(posts)} posts from {len(set(p['handle'] for p in posts))} members")
+    for community_id, (posts, members) in summary.items():
+        print(f"Community {community_id}: {posts} posts from {members} members")
 
 def main():
     # You need to replace these with your Bluesky credentials
@@ -85,10 +159,11 @@ def main():
 
     # Input and output files
     community_data_file = 'output_data/nodes_info.csv'
-    output_file = 'output_data/community_posts.json'
+    output_file = 'output_data/community_posts.ndjson'
     
     # Run the sampling
     sample_community_posts(username, password, community_data_file, output_file)
+    save_metrics('sample_communities')
 
 if __name__ == "__main__":
     main()
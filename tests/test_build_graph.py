@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build_graph import create_csr_graph, create_network_graph, stream_network_data
+from interning import NodeInterner, node_label
+
+
+def _profile(name):
+    return {'did': f"did:plc:{name}", 'handle': f"{name}.bsky", 'display_name': name, 'description': ''}
+
+
+def _write_network(network_dir, follow_lists):
+    os.makedirs(network_dir)
+    for handle, follows in follow_lists.items():
+        with open(os.path.join(network_dir, f"{handle}.json"), 'w', encoding='utf-8') as f:
+            json.dump(follows, f)
+
+
+def _labeled_edges(G):
+    return sorted((node_label(G, u), node_label(G, v)) for u, v in G.edges())
+
+
+@pytest.mark.parametrize('build', ['networkx', 'csr'])
+def test_depth2_file_read_before_its_did_is_known(tmp_path, build):
+    # aaa.bsky.json sorts before zzz.bsky.json, the only list naming aaa's DID
+    main_following = [_profile('zzz')]
+    network_dir = str(tmp_path / 'following_network')
+    _write_network(network_dir, {'aaa.bsky': [_profile('bbb')], 'zzz.bsky': [_profile('aaa')]})
+
+    network_data = stream_network_data(network_dir)
+    if build == 'csr':
+        G = create_csr_graph(main_following, network_data, include_secondary_follows=True).to_networkx()
+    else:
+        G = create_network_graph(main_following, network_data, include_secondary_follows=True,
+                                 interner=NodeInterner())
+
+    labels = [node_label(G, node) for node in G.nodes()]
+    assert sorted(labels) == ['aaa.bsky', 'bbb.bsky', 'user', 'zzz.bsky']
+    assert _labeled_edges(G) == [('aaa.bsky', 'bbb.bsky'), ('user', 'zzz.bsky'), ('zzz.bsky', 'aaa.bsky')]
+    assert G.graph['interner'].dids[G.graph['interner'].id_for('aaa.bsky')] == 'did:plc:aaa'
+
+
+def test_graph_does_not_depend_on_file_order():
+    main_following = [_profile('zzz')]
+    follow_lists = [('aaa.bsky', [_profile('bbb')]), ('zzz.bsky', [_profile('aaa')])]
+
+    forward = create_network_graph(main_following, follow_lists, True, interner=NodeInterner())
+    backward = create_network_graph(main_following, follow_lists[::-1], True, interner=NodeInterner())
+    assert _labeled_edges(forward) == _labeled_edges(backward)
+    assert forward.number_of_nodes() == backward.number_of_nodes() == 4
+
+
+@pytest.mark.parametrize('include_secondary_follows', [False, True])
+@pytest.mark.parametrize('build', ['networkx', 'csr'])
+def test_renamed_account_file_resolves_to_its_did(build, include_secondary_follows):
+    # aaa renamed itself to aaa-new.bsky; its list is still saved under the old handle
+    renamed = dict(_profile('aaa'), handle='aaa-new.bsky')
+    main_following = [renamed, _profile('bbb')]
+    follow_lists = {'aaa.bsky': [_profile('bbb')], 'bbb.bsky': [_profile('aaa')]}
+
+    if build == 'csr':
+        G = create_csr_graph(main_following, follow_lists, include_secondary_follows).to_networkx()
+    else:
+        G = create_network_graph(main_following, follow_lists, include_secondary_follows)
+
+    assert G.number_of_nodes() == 3
+    interner = G.graph['interner']
+    aaa, bbb = interner.id_for('did:plc:aaa'), interner.id_for('did:plc:bbb')
+    assert G.has_edge(aaa, bbb) and G.has_edge(bbb, aaa)
+
+
+def test_first_hop_graph_does_not_intern_outside_followers():
+    main_following = [_profile('aaa')]
+    follow_lists = {'aaa.bsky': [_profile('zzz')], 'zzz.bsky': [_profile('aaa'), _profile('yyy')]}
+    G = create_network_graph(main_following, follow_lists)
+    assert len(G.graph['interner']) == G.number_of_nodes() == 2
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_stream_yields_did_batches_with_shared_profiles(tmp_path, processes):
+    network_dir = str(tmp_path / 'following_network')
+    _write_network(network_dir, {'aaa.bsky': [_profile('ccc'), _profile('bbb')], 'bbb.bsky': [_profile('ccc')]})
+
+    stream = stream_network_data(network_dir, processes=processes)
+    assert list(stream) == [('aaa.bsky', ['did:plc:ccc', 'did:plc:bbb']), ('bbb.bsky', ['did:plc:ccc'])]
+    assert stream.profiles['did:plc:ccc'] == _profile('ccc')
+
+    lists = dict(stream.follow_lists())
+    assert lists['aaa.bsky'][0] is lists['bbb.bsky'][0]  # One profile dict per DID
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from communities import _stable_labels, detect_communities_csr, louvain, symmetric_adjacency
+
+
+def test_louvain_on_empty_graph():
+    assert len(louvain(sparse.csr_matrix((0, 0)))) == 0
+    assert detect_communities_csr(nx.DiGraph(), state_file=None) == []
+
+
+def test_louvain_recovers_planted_partition():
+    G = nx.planted_partition_graph(4, 25, 0.5, 0.01, seed=7, directed=True)
+    membership = louvain(symmetric_adjacency(G))
+    communities = [set(np.flatnonzero(membership == label)) for label in np.unique(membership)]
+
+    undirected = G.to_undirected()
+    expected = nx.community.modularity(undirected, G.graph['partition'])
+    assert abs(nx.community.modularity(undirected, communities) - expected) < 0.01
+
+
+def test_incremental_run_keeps_community_ids(tmp_path):
+    state_file = str(tmp_path / 'communities_state.npz')
+    G = nx.planted_partition_graph(4, 25, 0.5, 0.01, seed=7, directed=True)
+    first = detect_communities_csr(G, state_file=state_file)
+    G.add_edge(0, 1)
+    second = detect_communities_csr(G, state_file=state_file)
+    assert first == second
+
+
+def test_stable_labels_reuse_retired_ids():
+    # IDs 1-8 are retired; the new community takes 1 instead of 10
+    previous = np.array([0, 0, -1, -1, 9, 9])
+    labels = _stable_labels(np.array([0, 0, 1, 1, 2, 2]), previous)
+    assert labels.tolist() == [0, 0, 1, 1, 9, 9]
@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawl_journal import CrawlJournal, needs_crawl
+
+
+def _page(start):
+    return [{'did': f"did:plc:{i}", 'handle': f"account{i}.bsky"} for i in range(start, start + 2)]
+
+
+def test_resume_after_torn_writes(tmp_path):
+    output_dir = str(tmp_path)
+    journal = CrawlJournal(output_dir)
+    journal.record_page('alice.bsky', _page(0), 'cursor1')
+    journal.record_page('alice.bsky', _page(2), 'cursor2')
+
+    # Crash: a third page reached the partial file but not the journal, and the journal's last line is torn
+    with open(journal._partial_path('alice.bsky'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(_page(4)) + "\n")
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"actor": "alice.bsky", "cur')
+
+    resumed = CrawlJournal(output_dir)
+    follows, cursor, finished = resumed.resume('alice.bsky')
+    assert follows == _page(0) + _page(2)
+    assert cursor == 'cursor2' and not finished
+
+    # Continuing drops the unacknowledged page before appending the next one
+    resumed.record_page('alice.bsky', _page(4), None)
+    follows, cursor, finished = CrawlJournal(output_dir).resume('alice.bsky')
+    assert follows == _page(0) + _page(2) + _page(4)
+    assert cursor is None and finished
+
+
+def test_done_and_reset(tmp_path):
+    journal = CrawlJournal(str(tmp_path))
+    journal.record_page('alice.bsky', _page(0), None)
+    journal.mark_done('alice.bsky')
+    assert not needs_crawl(CrawlJournal(str(tmp_path)), 'alice.bsky', saved=True)
+    assert not os.path.exists(journal._partial_path('alice.bsky'))
+
+    journal.reset('alice.bsky')
+    assert needs_crawl(CrawlJournal(str(tmp_path)), 'alice.bsky', saved=True)
+    assert CrawlJournal(str(tmp_path)).resume('alice.bsky') == ([], None, False)
+
+
+def test_lists_saved_before_the_journal_are_trusted(tmp_path):
+    journal = CrawlJournal(str(tmp_path))
+    assert not needs_crawl(journal, 'bob.bsky', saved=True)
+    assert needs_crawl(journal, 'bob.bsky', saved=False)
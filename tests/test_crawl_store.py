@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build_graph import load_network_data, load_network_data_from_store
+from crawl_store import CrawlStore, import_json_layout
+from interning import SOURCE_USER
+
+
+def _profile(name):
+    return {'did': f"did:plc:{name}", 'handle': f"{name}.bsky", 'display_name': name, 'description': '',
+            'avatar': f"https://cdn.example/{name}.jpg"}
+
+
+def _write_data_dir(data_dir, with_profile=True):
+    network_dir = os.path.join(data_dir, 'following_network')
+    os.makedirs(network_dir)
+    files = {
+        'profile.json': dict(_profile('root')),
+        'following.json': [_profile('aaa'), _profile('bbb')],
+        'following_network/aaa.bsky.json': [_profile('bbb'), _profile('a00')],
+        'following_network/bbb.bsky.json': [_profile('aaa'), _profile('a00')],
+        # Depth-2 list read first: a00 is not followed by root, its DID comes from the lists after it
+        'following_network/a00.bsky.json': [_profile('aaa')],
+        'following_network/unknown.bsky.json': [_profile('aaa')],
+    }
+    if not with_profile:
+        del files['profile.json']
+    for name, content in files.items():
+        with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as f:
+            json.dump(content, f)
+
+
+def _edges(network_data):
+    return sorted((follower, follow['handle']) for follower, follows in network_data.items() for follow in follows)
+
+
+def test_import_matches_the_json_layout(tmp_path, monkeypatch):
+    data_dir = str(tmp_path / 'bluesky_data')
+    store_path = str(tmp_path / 'crawl.sqlite')
+    _write_data_dir(data_dir)
+    # The depth-2 list comes before every list naming a00, whatever order the import picks
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: sorted(listdir(path), key=lambda name: name != 'a00.bsky.json'))
+    import_json_layout(data_dir, store_path)
+    monkeypatch.undo()
+
+    main_following, network_data = load_network_data(os.path.join(data_dir, 'following.json'),
+                                                     os.path.join(data_dir, 'following_network'))
+    del network_data['unknown.bsky']  # Skipped by the import: no DID known for it
+    store_following, store_network = load_network_data_from_store(store_path)
+
+    assert sorted(p['did'] for p in store_following) == sorted(p['did'] for p in main_following)
+    assert _edges(store_network) == _edges(network_data)
+
+    with CrawlStore(store_path) as store:
+        # One row per account, without the dropped fields
+        profiles = store.profiles()
+        assert sorted(p['did'] for p in profiles.values()) == ['did:plc:a00', 'did:plc:aaa', 'did:plc:bbb',
+                                                                'did:plc:root']
+        assert 'avatar' not in next(iter(profiles.values()))
+        assert store.root_did() == 'did:plc:root'
+        assert store.has_follows('did:plc:a00')
+        assert not store.has_follows('did:plc:unknown')
+
+
+def test_import_again_changes_nothing(tmp_path):
+    data_dir = str(tmp_path / 'bluesky_data')
+    store_path = str(tmp_path / 'crawl.sqlite')
+    _write_data_dir(data_dir)
+    import_json_layout(data_dir, store_path)
+    first = load_network_data_from_store(store_path)
+    import_json_layout(data_dir, store_path)
+    assert load_network_data_from_store(store_path) == first
+
+
+def test_import_without_profile_keeps_the_first_hop(tmp_path):
+    data_dir = str(tmp_path / 'bluesky_data')
+    store_path = str(tmp_path / 'crawl.sqlite')
+    _write_data_dir(data_dir, with_profile=False)
+    import_json_layout(data_dir, store_path)
+
+    main_following, _ = load_network_data_from_store(store_path)
+    assert sorted(p['did'] for p in main_following) == ['did:plc:aaa', 'did:plc:bbb']
+    with CrawlStore(store_path) as store:
+        assert store.root_did() == SOURCE_USER
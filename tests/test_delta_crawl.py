@@ -0,0 +1,107 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawl_journal import CrawlJournal, save_follows
+from crawl_store import CrawlStore, saved_follow_lists
+from delta_crawl import load_snapshot, plan_refresh, update_snapshot
+
+
+class _Client:
+    """Sync client stub whose get_profiles fails for batches containing `failing`"""
+
+    def __init__(self, follows_counts, failing=()):
+        self.follows_counts = follows_counts
+        self.failing = set(failing)
+        actor = SimpleNamespace(get_profiles=self.get_profiles)
+        self.app = SimpleNamespace(bsky=SimpleNamespace(actor=actor))
+
+    def get_profiles(self, params):
+        if self.failing & set(params['actors']):
+            raise ValueError("Injected error")
+        # Actors are given by DID or by handle
+        dids = [actor if actor.startswith('did:') else f"did:plc:{actor[:-len('.bsky')]}" for actor in params['actors']]
+        return SimpleNamespace(profiles=[
+            SimpleNamespace(did=did, handle=f"{did[8:]}.bsky", follows_count=self.follows_counts[did])
+            for did in dids])
+
+
+def _following(names):
+    return [{'did': f"did:plc:{name}", 'handle': f"{name}.bsky"} for name in names]
+
+
+def test_first_refresh_refetches_every_list(tmp_path):
+    output_dir = str(tmp_path)
+    journal = CrawlJournal(output_dir)
+    following = _following(['aaa', 'bbb'])
+    for follow in following:
+        journal.mark_done(follow['handle'])
+
+    client = _Client({'did:plc:aaa': 1, 'did:plc:bbb': 2})
+    counts, changed = plan_refresh(client, following, output_dir, journal, rate_limit=1000)
+    assert sorted(changed.values()) == ['aaa.bsky', 'bbb.bsky']
+    assert not journal.is_done('aaa.bsky')
+
+    for handle in changed.values():
+        journal.mark_done(handle)
+    update_snapshot(output_dir, journal, counts, changed)
+    counts, changed = plan_refresh(client, following, output_dir, journal, rate_limit=1000)
+    assert changed == {}
+
+
+def test_failed_batch_is_not_snapshotted(tmp_path):
+    output_dir = str(tmp_path)
+    journal = CrawlJournal(output_dir)
+    # 30 actors: the second batch of 25 fails
+    names = [f"a{i:02d}" for i in range(30)]
+    client = _Client({f"did:plc:{name}": 1 for name in names}, failing=['did:plc:a29'])
+    counts, changed = plan_refresh(client, _following(names), output_dir, journal, rate_limit=1000)
+    assert len(counts) == 25
+    update_snapshot(output_dir, journal, counts, {})
+    assert 'did:plc:a29' not in load_snapshot(output_dir)
+
+
+def _refresh(client, following, output_dir, journal, saved):
+    counts, changed = plan_refresh(client, following, output_dir, journal, rate_limit=1000, saved=saved)
+    for handle in changed.values():
+        journal.mark_done(handle)
+    update_snapshot(output_dir, journal, counts, changed)
+    return changed
+
+
+def test_changed_depth_2_list_is_refetched(tmp_path):
+    # aaa is followed, ccc is only reached through aaa; both lists are saved as files
+    output_dir = str(tmp_path)
+    journal = CrawlJournal(output_dir)
+    following = _following(['aaa'])
+    for name in ['aaa', 'ccc']:
+        save_follows(os.path.join(output_dir, 'following_network', f"{name}.bsky.json"), [])
+        journal.mark_done(f"{name}.bsky")
+    client = _Client({'did:plc:aaa': 1, 'did:plc:ccc': 5})
+    saved = saved_follow_lists(output_dir, None)
+    assert sorted(_refresh(client, following, output_dir, journal, saved)) == ['did:plc:aaa', 'did:plc:ccc']
+
+    client.follows_counts['did:plc:ccc'] = 6
+    counts, changed = plan_refresh(client, following, output_dir, journal, rate_limit=1000, saved=saved)
+    assert changed == {'did:plc:ccc': 'ccc.bsky'}
+    assert not journal.is_done('ccc.bsky')
+
+
+def test_store_refresh_checks_every_crawled_actor(tmp_path):
+    output_dir = str(tmp_path)
+    journal = CrawlJournal(output_dir)
+    following = _following(['aaa'])
+    with CrawlStore(str(tmp_path / 'crawl.sqlite')) as store:
+        store.set_root({'did': 'did:plc:root', 'handle': 'root.bsky'}, following)
+        store.set_follows(following[0], _following(['ccc']))
+        store.set_follows(_following(['ccc'])[0], [])
+        saved = saved_follow_lists(output_dir, store)
+    assert sorted(profile['did'] for profile in saved) == ['did:plc:aaa', 'did:plc:ccc']
+
+    client = _Client({'did:plc:aaa': 1, 'did:plc:ccc': 1})
+    _refresh(client, following, output_dir, journal, saved)
+    client.follows_counts['did:plc:ccc'] = 2
+    counts, changed = plan_refresh(client, following, output_dir, journal, rate_limit=1000, saved=saved)
+    assert changed == {'did:plc:ccc': 'ccc.bsky'}
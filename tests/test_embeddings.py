@@ -0,0 +1,41 @@
+import json
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import EmbeddingIndex, update_index
+
+
+def _graph():
+    G = nx.gnp_random_graph(200, 0.05, seed=1, directed=True)
+    return nx.relabel_nodes(G, {node: f"account{node}.bsky" for node in G})
+
+
+def test_update_index_rebuilds_when_dim_changes(tmp_path):
+    index_dir = str(tmp_path / 'embedding_index')
+    G = _graph()
+    assert update_index(G, index_dir, dim=8) == G.number_of_nodes()
+    assert update_index(G, index_dir, dim=8) == 0  # Nothing changed, nothing re-embedded
+
+    assert update_index(G, index_dir, dim=4) == G.number_of_nodes()
+    index = EmbeddingIndex(index_dir)
+    assert index.manifest['dim'] == 4
+    assert np.shape(index.source)[1] == 4
+
+
+def test_update_index_rebuilds_other_index_versions(tmp_path):
+    index_dir = str(tmp_path / 'embedding_index')
+    G = _graph()
+    update_index(G, index_dir, dim=8)
+    manifest_path = os.path.join(index_dir, 'manifest.json')
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['version'] = 0
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    assert update_index(G, index_dir, dim=8) == G.number_of_nodes()
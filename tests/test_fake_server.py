@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+from functools import partial
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_crawler
+import bluesky_download
+from bluesky_client import BASE_URL_VARIABLE, TIMEOUT_VARIABLE, create_client
+from crawl_journal import CrawlJournal
+from fake_bluesky_server import FakeBlueskyServer, FakeDataset
+
+NUM_FOLLOWING = 12
+FOLLOWS_PER_ACCOUNT = 250  # Three pages each
+
+
+def _dataset():
+    root = 'did:plc:root'
+    profiles = {root: {'did': root, 'handle': 'root.fake.test'}}
+    follows = {root: []}
+    for i in range(NUM_FOLLOWING):
+        did = f"did:plc:following{i}"
+        profiles[did] = {'did': did, 'handle': f"following{i}.fake.test"}
+        follows[root].append(did)
+        follows[did] = []
+        for j in range(FOLLOWS_PER_ACCOUNT):
+            followee = f"did:plc:account{(i * 37 + j) % 1000}"
+            profiles.setdefault(followee, {'did': followee, 'handle': f"account{(i * 37 + j) % 1000}.fake.test"})
+            follows[did].append(followee)
+    return FakeDataset(profiles, follows, root, posts_per_actor=5)
+
+
+def _saved_follows(output_dir, handle):
+    path = os.path.join(output_dir, 'following_network', f"{handle}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return [follow['did'] for follow in json.load(f)]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # Half the data requests fail with a 502 or 503, and some stall past the client timeout
+    with FakeBlueskyServer(_dataset(), error_probability=0.5, timeout_probability=0.05, stall=1.0,
+                           seed=7) as server:
+        monkeypatch.setenv(BASE_URL_VARIABLE, server.base_url)
+        monkeypatch.setenv(TIMEOUT_VARIABLE, '0.2')
+        yield server
+
+
+def test_faulted_async_crawl_resumes(server, tmp_path, monkeypatch):
+    dataset = server.dataset
+    output_dir = str(tmp_path)
+    os.makedirs(os.path.join(output_dir, 'following_network'))
+    following = [dataset.profiles[did] for did in dataset.follows[dataset.root_did]]
+
+    # Logging in (createSession and the session's own getProfile) is never faulted
+    client = create_client()
+    client.login('root.fake.test', 'password')
+    session_string = client.export_session_string()
+
+    # First run: no retries, one account at a time, so the seeded faults are reproducible
+    monkeypatch.setattr(async_crawler, 'call_with_retries',
+                        partial(async_crawler.call_with_retries, retries=0, backoff=0.0))
+    async_crawler.crawl_following_network(session_string, following, output_dir, CrawlJournal(output_dir),
+                                          concurrency=1, rate_limit=1000)
+    incomplete = [profile['handle'] for profile in following if _saved_follows(output_dir, profile['handle']) is None]
+    assert incomplete
+    journal = CrawlJournal(output_dir)
+    assert any(journal.resume(handle)[1] for handle in incomplete), "no crawl stopped mid-pagination"
+
+    # Second run: faults are retried, and interrupted accounts continue from their cursor
+    monkeypatch.setattr(async_crawler, 'call_with_retries',
+                        partial(async_crawler.call_with_retries.func, retries=8, backoff=0.0))
+    server.error_probability = 0.3
+    async_crawler.crawl_following_network(session_string, following, output_dir, CrawlJournal(output_dir),
+                                          concurrency=4, rate_limit=1000)
+    for profile in following:
+        assert _saved_follows(output_dir, profile['handle']) == dataset.follows[profile['did']]
+    assert server.stats[('app.bsky.graph.getFollows', 502)] > 0
+    assert server.stats[('app.bsky.graph.getFollows', 503)] > 0
+
+
+def test_faulted_sync_download(server, tmp_path, monkeypatch):
+    dataset = server.dataset
+    server.error_probability = 0.3
+    monkeypatch.setattr(async_crawler, 'call_with_retries',
+                        partial(async_crawler.call_with_retries, retries=8, backoff=0.0))
+    monkeypatch.setattr(bluesky_download, 'call_with_retries_sync',
+                        partial(async_crawler.call_with_retries_sync, retries=8, backoff=0.0))
+
+    output_dir = str(tmp_path)
+    bluesky_download.download_bluesky_network('root.fake.test', 'password', output_dir=output_dir, concurrency=4,
+                                              rate_limit=1000)
+    with open(os.path.join(output_dir, 'following.json'), 'r', encoding='utf-8') as f:
+        assert [follow['did'] for follow in json.load(f)] == dataset.follows[dataset.root_did]
+    for did in dataset.follows[dataset.root_did]:
+        assert _saved_follows(output_dir, dataset.profiles[did]['handle']) == dataset.follows[did]
+    statuses = {status for (method, status), count in server.stats.items()}
+    assert {502, 503, 'timeout'} <= statuses
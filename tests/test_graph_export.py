@@ -0,0 +1,40 @@
+import os
+import sys
+
+import networkx as nx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_export import export_graph
+
+
+def _graph():
+    G = nx.DiGraph()
+    G.add_node('user', node_type='source', followers=10, score=0.5, verified=True)
+    G.add_node('alice.bsky', node_type='following', followers=3, score=None, verified=False,
+               description='bio with a \x0b control character')
+    G.add_node('bob.bsky', node_type='following', followers=None, score=1.25, verified=True)
+    G.add_edges_from([('user', 'alice.bsky'), ('user', 'bob.bsky'), ('alice.bsky', 'bob.bsky')])
+    return G
+
+
+@pytest.mark.parametrize('extension, read', [('graphml', nx.read_graphml), ('gexf', nx.read_gexf)])
+def test_export_round_trip(tmp_path, extension, read):
+    path = str(tmp_path / f"network.{extension}")
+    export_graph(_graph(), path)
+    G = read(path)
+
+    assert set(G.edges()) == set(_graph().edges())
+    assert G.nodes['user']['followers'] == 10
+    assert G.nodes['user']['verified'] is True
+    assert G.nodes['bob.bsky']['score'] == 1.25
+    assert 'followers' not in G.nodes['bob.bsky']  # Missing numbers are left out
+    assert G.nodes['alice.bsky']['description'] == 'bio with a  control character'
+
+
+def test_export_edgelist(tmp_path):
+    path = str(tmp_path / 'network.tsv.gz')
+    export_graph(_graph(), path)
+    G = nx.read_edgelist(path, delimiter='\t', create_using=nx.DiGraph)
+    assert set(G.edges()) == set(_graph().edges())
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrumentation
+from instrumentation import Metrics
+
+
+def test_sampler_stops_once_no_stage_is_open():
+    metrics = Metrics(sample_interval=0.01)
+    with metrics.stage('load'):
+        time.sleep(0.03)
+        sampler = metrics._sampler
+        assert sampler.is_alive()
+    sampler.join(timeout=1)
+    assert not sampler.is_alive() and metrics._sampler is None
+
+    with metrics.stage('analyze'):  # A later stage starts a new sampler
+        assert metrics._sampler is not None
+    assert [entry['stage'] for entry in metrics.stages] == ['load', 'analyze']
+
+
+def test_metrics_without_rss(monkeypatch):
+    # Neither /proc, psutil nor the resource module (Windows without psutil)
+    monkeypatch.setattr(instrumentation, 'resource', None)
+    monkeypatch.setattr(instrumentation, 'current_rss_mb', lambda: None)
+    metrics = Metrics(sample_interval=0.01)
+    with metrics.stage('load'):
+        time.sleep(0.03)
+
+    assert metrics.stages[0]['peak_rss_mb'] is None
+    assert metrics.to_dict()['max_rss_mb'] is None
+    assert 'stage_peak_rss_bytes{' not in metrics.to_prometheus()
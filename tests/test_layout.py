@@ -0,0 +1,67 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from layout import ForceAtlas2Layout, initial_positions, load_positions, save_positions
+
+
+def _layout(**options):
+    return ForceAtlas2Layout(verbose=False, **options)
+
+
+def test_layout_is_deterministic_and_threads_do_not_change_it():
+    A = nx.to_scipy_sparse_array(nx.gnp_random_graph(200, 0.03, seed=2, directed=True), weight=None)
+    pos = _layout(threads=1).layout(A, iterations=30)
+    assert pos.shape == (200, 2) and np.isfinite(pos).all()
+    np.testing.assert_allclose(_layout(threads=4).layout(A, iterations=30), pos)
+
+
+def _exact_repulsion(layout, pos, mass):
+    delta = pos[:, None, :] - pos[None, :, :]
+    distance_sq = (delta ** 2).sum(axis=2)
+    np.fill_diagonal(distance_sq, np.inf)
+    factor = layout.scaling_ratio * mass[:, None] * mass[None, :] / distance_sq
+    return (factor[:, :, None] * delta).sum(axis=1)
+
+
+def test_barnes_hut_repulsion_matches_exact_forces():
+    rng = np.random.default_rng(3)
+    pos = rng.normal(size=(600, 2))
+    pos[:200] *= 0.05  # A dense cluster forces deep cells
+    mass = 1.0 + rng.integers(0, 20, size=600)
+    exact = _exact_repulsion(_layout(), pos, mass)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        # theta = 0 opens every cell down to the leaves: exact up to rounding
+        np.testing.assert_allclose(_layout(theta=0.0)._repulsion(pos, mass, pool), exact, rtol=1e-9, atol=1e-9)
+        approximate = _layout()._repulsion(pos, mass, pool)
+    error = np.linalg.norm(approximate - exact, axis=1) / np.linalg.norm(exact, axis=1)
+    assert np.median(error) < 0.03
+    assert np.linalg.norm(approximate - exact) / np.linalg.norm(exact) < 0.05
+
+
+def test_layout_separates_planted_communities():
+    G = nx.planted_partition_graph(2, 40, 0.3, 0.005, seed=4)
+    pos = _layout().layout(nx.to_scipy_sparse_array(G, weight=None), iterations=200)
+    first, second = pos[:40], pos[40:]
+    spread = (np.linalg.norm(first - first.mean(axis=0), axis=1).mean()
+              + np.linalg.norm(second - second.mean(axis=0), axis=1).mean()) / 2
+    assert np.linalg.norm(first.mean(axis=0) - second.mean(axis=0)) > spread
+
+
+def test_warm_start_keeps_known_nodes_and_places_new_ones_near_neighbors(tmp_path):
+    path = str(tmp_path / 'layout_positions.json')
+    save_positions(path, ['a', 'b', 'c'], np.array([[0.0, 0.0], [10.0, 0.0], [10.0, 10.0]]))
+    saved = load_positions(path)
+
+    # 'd' is new and only follows 'c'
+    A = nx.to_scipy_sparse_array(nx.DiGraph([('a', 'b'), ('d', 'c')]), nodelist=['a', 'b', 'c', 'd'])
+    pos, known_share = initial_positions(['a', 'b', 'c', 'd'], A, saved)
+    assert known_share == 0.75
+    np.testing.assert_allclose(pos[:3], [[0.0, 0.0], [10.0, 0.0], [10.0, 10.0]])
+    assert np.linalg.norm(pos[3] - pos[2]) < 1.0
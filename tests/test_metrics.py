@@ -0,0 +1,62 @@
+import os
+import sys
+
+import networkx as nx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import (MetricsCache, degree_centrality, pagerank, sparse_eigenvector_centrality,
+                     sparse_pagerank)
+
+
+def test_cache_recomputes_after_same_size_edit(tmp_path):
+    cache = MetricsCache(str(tmp_path / 'metrics_cache'))
+    G = nx.path_graph(5, create_using=nx.DiGraph)
+    degree_centrality(G, cache)
+
+    # Same node and edge counts, different graph
+    G.remove_edge(0, 1)
+    G.add_edge(4, 0)
+    assert degree_centrality(G, cache) == nx.degree_centrality(G)
+
+
+def test_cache_reloads_integer_node_keys(tmp_path):
+    G = nx.path_graph(5, create_using=nx.DiGraph)
+    expected = degree_centrality(G, MetricsCache(str(tmp_path / 'metrics_cache')))
+
+    # A fresh cache object has to read the JSON file back
+    reloaded = degree_centrality(G, MetricsCache(str(tmp_path / 'metrics_cache')))
+    assert reloaded == pytest.approx(expected)
+    assert set(reloaded) == set(G)
+
+
+def _follow_graph():
+    return nx.gnp_random_graph(150, 0.04, seed=3, directed=True)
+
+
+def test_sparse_pagerank_matches_networkx():
+    G = _follow_graph()
+    expected = nx.pagerank(G, alpha=0.85, tol=1e-10)
+    assert sparse_pagerank(G, tol=1e-10) == pytest.approx(expected, abs=1e-8)
+
+
+def test_sparse_eigenvector_centrality_matches_networkx():
+    G = _follow_graph()
+    expected = nx.eigenvector_centrality(G, max_iter=1000, tol=1e-10)
+    assert sparse_eigenvector_centrality(G, tol=1e-10) == pytest.approx(expected, abs=1e-6)
+
+
+def test_warm_start_reaches_the_same_scores(tmp_path):
+    cache = MetricsCache(str(tmp_path / 'metrics_cache'))
+    G = _follow_graph()
+    pagerank(G, cache)
+    G.add_edge(0, 149)
+    assert pagerank(G, cache) == pytest.approx(nx.pagerank(G), abs=1e-5)
+
+
+def test_non_convergence_returns_last_iterate():
+    G = _follow_graph()
+    scores = sparse_eigenvector_centrality(G, max_iter=2)
+    assert set(scores) == set(G)
+    assert sparse_pagerank(G, max_iter=1)[0] > 0
@@ -0,0 +1,123 @@
+import csv
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import generate_dataset
+import pipeline
+from pipeline import Pipeline, Stage, analysis_stages, run_pipeline
+from profile_cache import ProfileCache
+
+
+def test_parallel_stages_leave_the_shared_graph_untouched(tmp_path):
+    data_dir = str(tmp_path / 'bluesky_data')
+    output_dir = str(tmp_path / 'output_data')
+    generate_dataset(data_dir, 2000)
+    with open(os.path.join(data_dir, 'following.json'), 'r', encoding='utf-8') as f:
+        following = json.load(f)
+    cache = ProfileCache(os.path.join(data_dir, 'profile_cache.json'))
+    cache.update({'did': profile['did'], 'handle': profile['handle'], 'followers_count': 7, 'follows_count': 3,
+                  'posts_count': 1, 'created_at': '2024-01-01T00:00:00.000Z'} for profile in following)
+    cache.save()
+
+    results = run_pipeline(data_dir, output_dir, workers=4, betweenness='approximate', layout_iterations=20,
+                           dpi=20, embedding_dim=8)
+
+    # export_nodes hydrated its own copy: the graph the other stages read has no profile counts
+    G = results['network']
+    assert not any('created_at' in attributes for _, attributes in G.nodes(data=True))
+    with open(os.path.join(output_dir, 'nodes_info.csv'), 'r', encoding='utf-8') as f:
+        join_dates = {row['JoinDate'] for row in csv.DictReader(f) if row['NodeType'] == 'following'}
+    assert join_dates == {'2024-01-01T00:00:00.000Z'}
+
+    # render drew on its own Figure from a worker thread
+    with open(os.path.join(output_dir, 'bluesky_network.png'), 'rb') as f:
+        assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+def test_second_run_reuses_every_stage(tmp_path):
+    data_dir = str(tmp_path / 'bluesky_data')
+    output_dir = str(tmp_path / 'output_data')
+    generate_dataset(data_dir, 500)
+    options = dict(betweenness='approximate', layout_iterations=5, dpi=20, embedding_dim=4, workers=2)
+    run_pipeline(data_dir, output_dir, **options)
+
+    # The layout and communities rewrote their warm-start state, which must not invalidate them
+    pipeline = Pipeline(analysis_stages(data_dir, output_dir, betweenness='approximate', layout_iterations=5,
+                                        dpi=20, embedding_dim=4), cache_dir=os.path.join(output_dir, 'pipeline_cache'))
+    pipeline._resolve_keys()
+    assert pipeline.plan() == []
+
+
+def test_crawl_stage_output_reaches_stages_with_callable_sources(tmp_path):
+    source = tmp_path / 'source.txt'
+    source.write_text('1')
+    reads = []
+
+    def crawl(value):
+        source.write_text(value)
+
+    def read(_):
+        reads.append(source.read_text())
+        return source.read_text()
+
+    def stages(value):
+        return [Stage('crawl', crawl, params={'value': value}, cache=False),
+                Stage('read', read, inputs=['crawl'], sources=lambda: source.read_text())]
+
+    cache_dir = str(tmp_path / 'cache')
+    for value in ('2', '2', '3'):
+        Pipeline(stages(value), cache_dir).run()
+    assert reads == ['2', '3']  # The unchanged second crawl left the stage cached
+
+
+def test_profile_cache_written_by_the_crawl_refreshes_the_node_csv(tmp_path, monkeypatch):
+    data_dir = str(tmp_path / 'bluesky_data')
+    output_dir = str(tmp_path / 'output_data')
+    generate_dataset(data_dir, 300)
+    with open(os.path.join(data_dir, 'following.json'), 'r', encoding='utf-8') as f:
+        following = json.load(f)
+    hydrate = []
+
+    def crawl(data_dir, store_path):
+        # Stands in for a crawl that hydrates profiles, on the second run only
+        if hydrate:
+            cache = ProfileCache(os.path.join(data_dir, 'profile_cache.json'))
+            cache.update({'did': profile['did'], 'handle': profile['handle'], 'followers_count': 7,
+                          'follows_count': 3, 'posts_count': 1, 'created_at': '2024-01-01T00:00:00.000Z'}
+                         for profile in following)
+            cache.save()
+
+    monkeypatch.setattr(pipeline, '_crawl', crawl)
+    options = dict(crawl=True, targets=['export_nodes'], betweenness='approximate', layout_iterations=5)
+    run_pipeline(data_dir, output_dir, **options)
+    hydrate.append(True)
+    run_pipeline(data_dir, output_dir, **options)
+
+    with open(os.path.join(output_dir, 'nodes_info.csv'), 'r', encoding='utf-8') as f:
+        join_dates = {row['JoinDate'] for row in csv.DictReader(f) if row['NodeType'] == 'following'}
+    assert join_dates == {'2024-01-01T00:00:00.000Z'}
+
+
+def test_rerun_consumes_the_same_warm_state(tmp_path):
+    state = tmp_path / 'state.txt'
+    outputs = []
+
+    def step(x):
+        # Warm start: continue from the saved value
+        previous = int(state.read_text()) if state.exists() else 0
+        state.write_text(str(previous + x))
+        outputs.append(previous + x)
+        return previous + x
+
+    def stages(x):
+        return [Stage('step', step, params={'x': x}, state=[str(state)])]
+
+    cache_dir = str(tmp_path / 'cache')
+    Pipeline(stages(1), cache_dir).run()
+    Pipeline(stages(1), cache_dir).run()  # Cached, although the state file changed
+    Pipeline(stages(1), cache_dir).run(force=['step'])  # Rerun from the state the cached output used
+    Pipeline(stages(10), cache_dir).run()  # New inputs warm-start from the latest state
+    assert outputs == [1, 1, 11]
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build_graph import create_csr_graph
+from recommend_accounts import link_prediction_scores, load_recommendations, recommend_accounts, recommend_all
+
+NX_SCORES = {
+    'common_neighbors': lambda G, pairs: ((u, v, len(list(nx.common_neighbors(G, u, v)))) for u, v in pairs),
+    'jaccard': nx.jaccard_coefficient,
+    'adamic_adar': nx.adamic_adar_index,
+    'resource_allocation': nx.resource_allocation_index,
+}
+
+
+@pytest.mark.parametrize('score', sorted(NX_SCORES))
+def test_scores_match_networkx(score):
+    G = nx.gnp_random_graph(60, 0.1, seed=5)
+    A = nx.to_scipy_sparse_array(G, nodelist=range(60), weight=None, dtype=float, format='csr')
+    sources = [0, 7, 42]
+    matrix = link_prediction_scores(A, sources, [score])[score].toarray()
+
+    for row, u in enumerate(sources):
+        candidates = [(u, v) for v in G if v != u and not G.has_edge(u, v)]
+        for _, v, expected in NX_SCORES[score](G, candidates):
+            assert matrix[row, v] == pytest.approx(expected)
+        # Neighbors and the source itself are never scored
+        assert all(matrix[row, v] == 0 for v in list(G[u]) + [u])
+
+
+def test_unknown_score_is_rejected():
+    A = nx.to_scipy_sparse_array(nx.path_graph(3), format='csr')
+    with pytest.raises(ValueError):
+        link_prediction_scores(A, [0], ['katz'])
+
+
+def _follow_graph():
+    G = nx.gnp_random_graph(80, 0.08, seed=11, directed=True)
+    return nx.relabel_nodes(G, {node: f"account{node}.bsky" for node in G})
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_recommend_all_matches_single_account_recommendations(tmp_path, processes):
+    G = _follow_graph()
+    output_file = str(tmp_path / 'recommendations.npz')
+    recommend_all(G, num_recommendations=100, block_size=16, processes=processes, output_file=output_file)
+
+    for handle in ('account0.bsky', 'account33.bsky'):
+        expected = dict(recommend_accounts(G, handle, num_recommendations=100))
+        saved = dict(load_recommendations(output_file, handle))
+        assert saved.keys() == expected.keys()
+        assert saved == pytest.approx(expected, rel=1e-6)
+
+
+def test_load_recommendations_of_unknown_account(tmp_path):
+    output_file = str(tmp_path / 'recommendations.npz')
+    recommend_all(_follow_graph(), output_file=output_file)
+    with pytest.raises(KeyError):
+        load_recommendations(output_file, 'nobody.bsky')
+
+
+def test_saved_handles_are_compact_and_dids_resolve(tmp_path):
+    # One long handle must not widen every saved string to its length
+    names = ['zoë', 'a' * 200] + [f"account{i}" for i in range(20)]
+    profiles = [{'did': f"did:plc:{i}", 'handle': f"{name}.bsky"} for i, name in enumerate(names)]
+    follow_lists = [(profile['handle'], [profiles[(i + step) % len(profiles)] for step in (1, 2, 5)])
+                    for i, profile in enumerate(profiles)]
+    G = create_csr_graph(profiles[:5], follow_lists, include_secondary_follows=True)
+    output_file = str(tmp_path / 'recommendations.npz')
+    columns = recommend_all(G, output_file=output_file)
+    assert columns['handles'].dtype == np.uint8
+    assert columns['handles'].nbytes < 2 * sum(len(name.encode('utf-8')) + 5 for name in names + ['user'])
+
+    for profile in profiles[:3]:
+        by_handle = load_recommendations(output_file, profile['handle'])
+        assert by_handle and load_recommendations(output_file, profile['did']) == by_handle
+    assert dict(load_recommendations(output_file, 'zoë.bsky')) == pytest.approx(dict(recommend_accounts(G, 'zoë.bsky')),
+                                                                                rel=1e-6)